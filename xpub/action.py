@@ -1,79 +1,261 @@
 import os
 import json
-import requests
+import hashlib
 from datetime import datetime
 from prompter import Prompt
+from batch import partition, common_root, MAX_TASK_ITEMS, SIDECAR_SUFFIX
+from outbox import Outbox
+from stores import route, Portal, Local, LocalHatabase
+from journal import Journal, PENDING, SUBMITTED
+from atomic import dump_json
+from settings import state_path
+from profiles import load_profiles, transfer_options, resume_options
+from dedup import ContentIndex
 import re
 import sys
 import json
 from collections import defaultdict as dd
-from apscheduler.schedulers.blocking import BlockingScheduler
-from globusonline.transfer import api_client
-from globusonline.transfer.api_client import Transfer
-from globusonline.transfer.api_client.goauth import get_access_token
 import logging
+import posixpath
 logging.basicConfig()
 
-# save/update a json config file (at `path`) with config `data`
+# globus endpoints and destination directory for file transfers
+SRC_ENDPOINT = "mattbest#NICHO-LENO5"       # source endpoint
+DST_ENDPOINT = "mattbest#Oba-Nicho5-Dell"   # destination endpoint
+DEST_DIR = "~/example-copy/"
+
+# base url of the portal api
+API_URL = os.environ.get('XROMM_API', 'http://xromm.rcc.uchicago/api/')
+
+# save/update a json file (at `path`) with `data`, replacing it atomically
 def save_json(data, path):
     data['updated_at'] = datetime.now().isoformat() + 'Z'
-    with open(path, 'w') as f:
-        json.dump(data, f, indent=4)
+    dump_json(data, path)
 
 
-# possible actions to take with collected input  . . .
+# possible actions to take with a batch of collected input  . . .
 
-def view(results): 
-    print json.dumps(results, indent=4)
+def view(batch): 
+    for results in batch:
+        print json.dumps(results, indent=4)
     print '<<< COLLECTED METADATA'
 
-def save(results):                              
-    path = os.path.join(os.getcwd(), 'input.json')
-    save_json(results, path)
-    print "input saved to", path
+def save(batch):                              
+    for i, results in enumerate(batch):
+        name = 'input.json' if len(batch) == 1 else 'input-{}.json'.format(i + 1)
+        path = os.path.join(os.getcwd(), name)
+        save_json(results, path)
+        print "input saved to", path
     if os.name == 'nt':                             #check for Windows
         print "press any key to exit"
         os.system('pause')                          #allows message reading (Windows/cygwin)
 
-def transferfile(results):
-    src_file_path = results['file_abs_path']
-    dest_file_path = "~/example-copy"
-    save_json(results, src_file_path)
+# write the metadata `results` for a file to a sidecar file next to it
+# (or in the state dir if its dir isn't writable), returning its path
+def write_sidecar(results):
+    path = results['file_abs_path'] + SIDECAR_SUFFIX
+    try:
+        save_json(results, path)
+    except (IOError, OSError):                  # e.g. a read-only dir
+        name = hashlib.sha1(path).hexdigest()[:12] + '-' + \
+               os.path.basename(path)
+        path = state_path(os.path.join('sidecars', name))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        save_json(results, path)
+    return path
+
+# return the destination path of a file: its path relative to the root
+# of its batch (`file_rel_path`, so same-named files in different dirs
+# are kept apart) in the destination directory
+def destination(results):
+    rel_path = results.get('file_rel_path') or results['file_name']
+    return posixpath.join(DEST_DIR, *rel_path.split(os.sep))
+
+# return the transfer items for a batch: for each file, its (source,
+# destination, size) and those of the sidecar holding its metadata;
+# raises a ValueError if two files would have the same destination
+def transfer_items(batch):
+    items = []
+    sources = {}                                # destination -> source
+    for results in batch:
+        src_file_path = results['file_abs_path']
+        dest_file_path = destination(results)
+        if dest_file_path in sources:
+            raise ValueError('{} and {} would both be transferred to {}'
+                             .format(sources[dest_file_path], src_file_path,
+                                     dest_file_path))
+        sources[dest_file_path] = src_file_path
+        sidecar_path = write_sidecar(results)   # (the file isn't touched)
+        items.append(((src_file_path, dest_file_path,
+                       results.get('file_size')),
+                      (sidecar_path, dest_file_path + SIDECAR_SUFFIX,
+                       os.path.getsize(sidecar_path))))
+    return items
+
+# drop the files in a `batch` whose content was transferred before (or
+# is earlier in the batch), linking their results to the earlier copy;
+# returns the rest of the batch and the number of bytes saved
+def skip_duplicates(batch, index):
+    rest = []
+    seen = {}                                   # content -> destination
+    saved = 0
+    for results in batch:
+        content = results.get('file_sha256'), results.get('file_size')
+        dest_file_path = destination(results)
+        earlier = content[0] and index.lookup(*content)
+        if earlier:
+            link = dict(task_id=earlier['task_id'],
+                        destination_path=earlier['destination_path'])
+        elif content in seen:
+            link = dict(task_id=None, destination_path=seen[content])
+        else:
+            if content[0]:
+                seen[content] = dest_file_path
+            rest.append(results)
+            continue
+        results['file_duplicate_of'] = link
+        saved += content[1]
+        print "skipping {} (same content as {}, {})".format(
+            results['file_abs_path'], link['destination_path'],
+            'task ' + link['task_id'] if link['task_id'] else
+            'earlier in this batch')
+    return rest, saved
+
+def transferfile(batch):
+    from globusonline.transfer.api_client import Transfer
+    index = ContentIndex()
+    batch, saved = skip_duplicates(batch, index)
+    if saved:
+        print "{:,} bytes saved by skipping duplicates".format(saved)
+    if not batch:
+        print "nothing left to transfer"
+        return
+    items = transfer_items(batch)
+    files = dict((item[0][0], item) for item in items)     # by source path
+    records = dict((r['file_abs_path'], r) for r in batch)
+    sizes = dict((src, size) for item in items for src, dest, size in item)
+    # group files by the transfer profile of their mediatype
+    profiles = load_profiles()
+    groups = dd(list)                           # source paths by resource
+    for results, item in zip(batch, items):
+        groups[results['resource']].append(item[0][0])
+    api = connect(SRC_ENDPOINT, DST_ENDPOINT)
+    journal = Journal()
+    # designate endpoints(1) and items(2) for each transfer task(3), 
+    # splitting large batches into a few size-balanced tasks (with the
+    # sidecar of each file in the same task as the file)
+    transfers = []                      # (task, source paths, hours)
+    for resource in sorted(groups):
+        options = transfer_options(profiles.get(resource, {}))
+        hours = profiles.get(resource, {}).get('deadline')
+        for group in partition(groups[resource],
+                               max_items=MAX_TASK_ITEMS // 2):
+            # get submission id
+            code, reason, result = api.transfer_submission_id()
+            t = Transfer(result["value"], SRC_ENDPOINT, DST_ENDPOINT,
+                         label='xpub {}'.format(resource), **options)
+            for path in group:
+                for src, dest, size in files[path]:
+                    t.add_item(src, dest, verify_size=size)
+            transfers.append((t, group, hours))
+    # record the tasks before submitting (only once they're all built, so
+    # a batch that couldn't be built can be retried without leftovers)
+    for t, group, hours in transfers:
+        journal.record(t, sizes, deadline_hours=hours)
+        index.publish(t.submission_id,
+                      [(records[path], files[path][0][1]) for path in group])
+    print "submitting {} file(s) with metadata in {} transfer task(s)".format(
+        len(items), len(transfers))
+    for t, group, hours in transfers:
+        task_id = submit(api, journal, t)
+        if task_id:
+            index.submitted(t.submission_id, task_id)
+
+# authenticate using access token and activate the given endpoints,
+# returning a transfer api client
+def connect(*endpoints):
+    from globusonline.transfer import api_client
+    from globusonline.transfer.api_client.goauth import get_access_token
     auth = get_access_token()
-    src = "mattbest#NICHO-LENO5"     # source endpoint
-    dst = "mattbest#Oba-Nicho5-Dell"   # destination endpoint
-    # authenticate using access token
     api = api_client.TransferAPIClient(
         username=auth.username,
         goauth=auth.token
     )
-    # activate endpoints
-    status, message, data = api.endpoint_autoactivate(src)
-    status, message, data = api.endpoint_autoactivate(dst)
-    # get submission id
-    code, reason, result = api.transfer_submission_id()
-    submission_id = result["value"]
-    # designate endpoints(1) and items(2) for transfer(3)
-    def transfer(id, source, dest):
-        t = Transfer(id, source, dest)
-        t.add_item(src_file_path, dest_file_path)
-        status, reason, result = api.transfer(t)
-        os._exit(1)
-    ### SCHEDULE TRANSFER JOB ###
-    scheduler = BlockingScheduler()
-    now = datetime.now()
-    scheduler.add_job(lambda:
-        transfer(submission_id, src, dst),
-        'date',
-        run_date=datetime(now.year, now.month, now.day, now.hour, now.minute+1, 0)
-    )
-    # returns 0 in the child, pid of the child in the parent
-    if os.fork():
-        sys.exit()
-    scheduler.start()
-    scheduler.shutdown()
+    for endpoint in endpoints:
+        status, message, data = api.endpoint_autoactivate(endpoint)
+    return api
+
+# submit a `transfer` task and record the outcome in the `journal`
+def submit(api, journal, transfer):
+    try:
+        code, reason, result = api.transfer(transfer)
+    except Exception as e:                      # api or network error
+        journal.update(transfer.submission_id, message=str(e))
+        print "transfer submission failed:", e
+        print "run `xpub --resume` to resubmit"
+        return None
+    task_id = result['task_id']
+    journal.update(transfer.submission_id, task_id=task_id,
+                   status=SUBMITTED, message=result.get('code'))
+    print "transfer task", task_id, "submitted"
+    return task_id
+
+# resubmit any journaled transfer tasks that were never accepted
+# (re-using their submission ids, so nothing is transferred twice)
+def resume():
+    from globusonline.transfer.api_client import Transfer
+    journal = Journal()
+    tasks = journal.tasks(PENDING)
+    if not tasks:
+        print "no pending transfer tasks"
+        return
+    endpoints = set()
+    for task in tasks:
+        endpoints.update([task['source'], task['destination']])
+    api = connect(*endpoints)
+    index = ContentIndex()
+    for task in tasks:
+        options = resume_options(json.loads(task['options']))
+        t = Transfer(task['submission_id'], task['source'],
+                     task['destination'], **options)
+        for item in journal.items(task['submission_id']):
+            t.add_item(item['source_path'], item['destination_path'],
+                       verify_size=item['size'])
+        task_id = submit(api, journal, t)
+        if task_id:
+            index.submitted(t.submission_id, task_id)
+
+# send a `batch` to the backends that store it (as given by the `store`
+# of each prompt), writing to each concurrently; returns the names of
+# the backends that failed
+def send(batch): 
+    failed = route(batch, {
+        'xromm':    Portal(url_for),            # the portal (via the outbox)
+        'ross_db':  Local('ross_db'),           # local ross_db.db
+        'hatabase': LocalHatabase(),            # local hatabase.db
+    })
+    if failed:
+        print "not all records were stored: {} failed".format(
+            ', '.join(sorted(failed)))
+    if os.name == 'nt':                             #check for Windows
+        print "press any key to exit"
+        os.system('pause')                          #allows message reading (Windows/cygwin)
+    return sorted(failed)
 
-def send(results): 
+# send the records queued in the `outbox`, returning the number unsent
+def flush(outbox=None):
+    outbox = outbox or Outbox()
+    sent, unsent = outbox.flush()
+    if unsent:
+        print unsent, "record(s) left in the outbox"
+        print "run `xpub --flush` to send them"
+    elif not sent:
+        print "nothing to send"
+    return unsent
+
+# return the portal url to send a `results` dict to
+def url_for(results):
     resource = results['resource']
     version = results['version']
     path = 'studies/'
@@ -87,22 +269,17 @@ def send(results):
             study, trial = study_trial, ''          # no trial name
             path += '{}/'.format(study)
 
-    elif resource is 'trial':
+    elif resource == 'trial':
         path += results['data']['study'] + '/trials/'
 
-    url = 'http://xromm.rcc.uchicago/api/v{}/{}'.format(version, path)
-    print "sending to", url
+    url = API_URL + 'v{}/{}'.format(version, path)
 
-    # comment out next two lines when backend service in place!
-    url = "http://httpbin.org/post"     
-    print "\n... actually, we're sending to", url, "for testing purposes!"
-    resp = requests.post(url, data=json.dumps(results))
-    print(resp.text)
-    if os.name == 'nt':                             #check for Windows
-        print "press any key to exit"
-        os.system('pause')                          #allows message reading (Windows/cygwin)
+    # remove the next line when backend service in place! until then,
+    # results are sent to a stand-in service ($XROMM_TEST_URL if set)
+    url = os.environ.get('XROMM_TEST_URL', "http://httpbin.org/post")
+    return url
 
-def quit(results): 
+def quit(batch): 
     raise SystemExit
 
 
@@ -134,17 +311,33 @@ config = {
     "regex": ""
 }
 
-# prompt the user for the action to take on the `results` dict
-def prompt_for_action(results, path=None):
-    if path:
-        results['file_name'] = os.path.basename(path)
-        results['file_abs_path'] = os.path.abspath(path)
+# prompt the user for the action to take on a `batch` of results dicts
+# (one per file being transferred, with the file `paths` given in order
+# and their digests computed in the background by `checksums`)
+def prompt_for_action(batch, paths=None, checksums=None):
+    add_file_info(batch, paths, checksums)
     prompt = Prompt(config)                 # create prompt based on config
     input = prompt(fixed=True)              # prompt for input
     choice = input.split(' ')[0]            # get action from input
-    actions[choice](results)                # do the chosen action
+    actions[choice](batch)                  # do the chosen action
     if choice == 'view':
-        prompt_for_action(results)          # prompt again
+        prompt_for_action(batch)            # prompt again
+
+# add the name, path and digests of each file to its results dict, and
+# its path relative to `root` (by default, the dir holding all the files)
+def add_file_info(batch, paths=None, checksums=None, root=None):
+    root = root or (paths and common_root(paths))
+    for results, path in zip(batch, paths or []):
+        results['file_name'] = os.path.basename(path)
+        results['file_abs_path'] = os.path.abspath(path)
+        results['file_rel_path'] = os.path.relpath(os.path.abspath(path),
+                                                   root)
+        if checksums:
+            if not checksums.ready(path):
+                print "waiting for checksum of", path
+            digest = checksums(path)
+            for name, value in digest.items():
+                results['file_' + name] = value     # file_size, file_md5, ...
 
 
 if __name__ == '__main__':
@@ -153,4 +346,4 @@ if __name__ == '__main__':
     results = dict(resource="trial", study="pig-chewing-study")
 
     # prompt user to select action to take on results and then do it
-    prompt_for_action(results)
+    prompt_for_action([results])
@@ -0,0 +1,84 @@
+import os
+import json
+
+
+DEFAULTS_NAME = '.xpub-defaults.json'   # answers template in a directory
+
+
+def load_defaults(dir):
+    """
+    Return the answers template for the files in `dir`, given by its
+    (optional) `.xpub-defaults.json` file: a dict of prompt keys to
+    values for every file, with an optional `mediatypes` dict of the
+    values for files of particular mediatypes, such as ...
+
+        {
+            "study_trial": "pig-study/trial-1",
+            "camera_make": "Phantom",
+            "mediatypes": {"NSx": {"sampling_rate": "30 kHz"}}
+        }
+
+    """
+    path = os.path.join(dir, DEFAULTS_NAME)
+    if not os.path.isfile(path):
+        return {}
+    return json.load(open(path))
+
+
+class Answers:
+    """
+    The answers given so far in a session for the files of a scope
+    (e.g. a directory), keyed by prompt key, so that each shared field
+    is only asked once.
+
+    An answer is applied to the files of any mediatype with a matching
+    prompt (one with the same key and text).  Prompts marked `per_file`
+    are asked for each file.  Answers can be pre-seeded with a template
+    (see `load_defaults`), which applies to per-file prompts too.
+
+    """
+    def __init__(self, defaults=None):
+        self.defaults = dict(defaults or {})
+        self.by_mediatype = self.defaults.pop('mediatypes', {})
+        self.given = {}                 # key -> (prompt text, value)
+
+    @classmethod
+    def load(cls, dir):
+        "Return the answers for a directory, pre-seeded by its template."
+        return cls(load_defaults(dir))
+
+    def default(self, prompt, mediatype=None):
+        "Return the template's value for `prompt`, or None if it's unset."
+        defaults = self.by_mediatype.get(mediatype, {})
+        if prompt.key not in defaults:
+            defaults = self.defaults
+        return defaults.get(prompt.key)
+
+    def fill(self, prompts, mediatype=None):
+        """
+        Return a dict of the known values for `prompts` (for a file of
+        `mediatype`), and the list of prompts still to be asked.
+
+        """
+        data = {}
+        ask = []
+        for prompt in prompts:
+            value = self.default(prompt, mediatype)
+            if value is not None:
+                try:
+                    data[prompt.key] = prompt.validate(value)
+                    continue
+                except ValueError as e:
+                    print "ignoring default for `{}`: {}".format(prompt.key, e)
+            given = self.given.get(prompt.key)
+            if given and given[0] == prompt.text and not prompt.per_file:
+                data[prompt.key] = given[1]
+            else:
+                ask.append(prompt)
+        return data, ask
+
+    def remember(self, prompts, data):
+        "Remember the answers in `data` to the shared `prompts`."
+        for prompt in prompts:
+            if prompt.key in data and not prompt.per_file:
+                self.given[prompt.key] = prompt.text, data[prompt.key]
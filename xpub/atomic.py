@@ -0,0 +1,72 @@
+import os
+import json
+import tempfile
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:                     # (windows)
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def locked(path):
+    """
+    Hold an exclusive advisory lock on the file at `path` (by locking
+    a `.lock` file next to it), so that other `xpub` sessions reading
+    and rewriting the file wait their turn.  Keep it held briefly.
+
+    """
+    with open(path + '.lock', 'a') as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def write(path, data):
+    """
+    Replace the file at `path` with `data` (a string) atomically: the
+    data is written and synced to a temp file in the same directory,
+    which is then renamed over the file.  Readers see either the old
+    or the new file, never a partially written one.
+
+    """
+    path = os.path.abspath(path)
+    dir, name = os.path.split(path)
+    fd, tmp = tempfile.mkstemp(prefix=name + '.', suffix='.tmp', dir=dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        mode = os.stat(path).st_mode if os.path.exists(path) else 0644
+        os.chmod(tmp, mode & 0777)
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)             # (rename won't replace on windows)
+        os.rename(tmp, path)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    if os.name != 'nt':                 # make the rename itself durable
+        fd = os.open(dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def dump_json(data, path):
+    "Write `data` as json to `path` atomically (see `write`)."
+    write(path, json.dumps(data, indent=4))
+
@@ -0,0 +1,92 @@
+import os
+import glob
+import heapq
+
+
+# upper bounds for the items in a single globus transfer task
+MAX_TASK_BYTES = 500 * 1024 ** 3        # 500 GB per task
+MAX_TASK_ITEMS = 10000                  # items per task
+
+SIDECAR_SUFFIX = '.xpub.json'           # metadata file sent with a file
+
+
+def expand_paths(paths):
+    """
+    Expand a list of file paths, directories and glob patterns into
+    a list of absolute file paths.
+
+    Directories are walked recursively and glob patterns are expanded
+    here (for shells that don't expand them, e.g. `cmd.exe`).  Hidden
+    files and metadata sidecars found in directories (or by patterns)
+    are skipped, and duplicates are dropped, preserving the order in
+    which files were given.
+
+    """
+    seen = set()
+    files = []
+
+    def add(path):
+        path = os.path.abspath(path)
+        if path not in seen:
+            seen.add(path)
+            files.append(path)
+
+    for arg in paths:
+        if glob.has_magic(arg):
+            matches = [path for path in sorted(glob.glob(arg))
+                       if not path.endswith(SIDECAR_SUFFIX)]
+        else:
+            matches = [arg]
+        for path in matches:
+            if os.path.isdir(path):
+                for root, dirs, names in os.walk(path):
+                    dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+                    for name in sorted(names):
+                        if not (name.startswith('.') or
+                                name.endswith(SIDECAR_SUFFIX)):
+                            add(os.path.join(root, name))
+            elif os.path.isfile(path):
+                add(path)
+            else:
+                print "skipping", path, "(no such file)"
+    return files
+
+
+def common_root(paths):
+    "Return the deepest directory holding all of the files at `paths`."
+    dirs = [os.path.dirname(os.path.abspath(path)).split(os.sep)
+            for path in paths]
+    return os.sep.join(os.path.commonprefix(dirs)) or os.sep
+
+
+def partition(paths, max_bytes=MAX_TASK_BYTES, max_items=MAX_TASK_ITEMS):
+    """
+    Split `paths` into as few size-balanced groups as the task limits
+    allow, returning a list of lists of paths.
+
+    Files are assigned largest-first to the currently smallest group,
+    so a batch is spread evenly over the tasks it needs.
+
+    """
+    if not paths:
+        return []
+    sizes = dict((path, os.path.getsize(path)) for path in paths)
+    total = sum(sizes.values())
+    n = max(-(-total // max_bytes), -(-len(paths) // max_items), 1)
+
+    heap = [(0, i, []) for i in range(n)]   # (bytes, group no., paths)
+    for path in sorted(paths, key=sizes.get, reverse=True):
+        full = []                           # groups at the item limit
+        size, i, group = heapq.heappop(heap)
+        while len(group) >= max_items:
+            full.append((size, i, group))
+            size, i, group = heapq.heappop(heap)
+        group.append(path)
+        heapq.heappush(heap, (size + sizes[path], i, group))
+        for entry in full:
+            heapq.heappush(heap, entry)
+
+    # keep the caller's ordering within (and across) each group
+    order = dict((path, i) for i, path in enumerate(paths))
+    groups = [sorted(group, key=order.get) for size, i, group in heap]
+    return sorted(groups, key=lambda group: order[group[0]])
@@ -0,0 +1,81 @@
+import os
+import hashlib
+import cPickle as pickle
+from settings import state_path
+from atomic import write
+
+
+# bump when the structure of bundled objects (e.g. `Prompt`) changes
+VERSION = 3
+
+
+def stamp(path):
+    "Return the (mtime, size) of the file at `path`."
+    st = os.stat(path)
+    return st.st_mtime, st.st_size
+
+
+def digest(path):
+    "Return the sha1 hex digest of the file at `path`."
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class Bundle:
+    """
+    A binary cache of objects compiled from config files (e.g. loaded
+    configs and their validated `Prompt` objects), so a warm start can
+    skip parsing and validating the configs.
+
+    Each bundled object is keyed by a name and stored along with the
+    mtimes, sizes and hashes of the source files it was built from.
+    It's rebuilt whenever a source file's content changes.
+
+    """
+    def __init__(self, path=None):
+        self.path = path or state_path('bundle.pickle')
+        self.entries = {}           # name -> (stamps, digests, pickle)
+        self.dirty = False
+        try:
+            with open(self.path, 'rb') as f:
+                version, entries = pickle.load(f)
+            if version == VERSION:
+                self.entries = entries
+        except Exception:           # missing, stale or corrupt bundle
+            pass
+
+    def get(self, name, sources, build):
+        """
+        Return the object named `name`, built by calling `build()` from
+        the list of `sources` files if it's not in the bundle (or any
+        of the source files have changed).
+
+        Each call returns a fresh copy of the object, so callers can
+        modify it without affecting the bundle.
+
+        """
+        stamps = [stamp(path) for path in sources]
+        entry = self.entries.get(name)
+        if entry:
+            old_stamps, digests, data = entry
+            if old_stamps == stamps:
+                return pickle.loads(data)
+            # files may have been touched without being changed
+            if digests == [digest(path) for path in sources]:
+                self.entries[name] = stamps, digests, data
+                self.dirty = True
+                return pickle.loads(data)
+        obj = build()
+        digests = [digest(path) for path in sources]
+        data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        self.entries[name] = stamps, digests, data
+        self.dirty = True
+        return obj
+
+    def save(self):
+        "Write the bundle to disk (if anything has changed)."
+        if not self.dirty:
+            return
+        write(self.path, pickle.dumps((VERSION, self.entries),
+                                      pickle.HIGHEST_PROTOCOL))
+        self.dirty = False
@@ -0,0 +1,154 @@
+import os
+import json
+import sqlite3
+from datetime import datetime
+from settings import CONFIG_DIR, state_path
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS studies (
+    name TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS trials (
+    study TEXT,
+    name  TEXT,
+    PRIMARY KEY (study, name)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+# flat cache of study/trial names that a new catalog is seeded from
+SEED_PATH = os.path.join(CONFIG_DIR, 'cache.json')
+
+
+def now():
+    return datetime.now().isoformat() + 'Z'
+
+
+def prefix_range(prefix):
+    """
+    Return the bounds of the names starting with `prefix`, for a range
+    query that can use an index (unlike `LIKE`).
+
+    """
+    if isinstance(prefix, str):
+        prefix = prefix.decode('utf-8')
+    return prefix, prefix + u'\U0010ffff'
+
+
+class Catalog:
+    """
+    A local, indexed catalog of the names of the studies and trials
+    on the portal, used to offer them as options when prompting.
+
+    Names can be looked up by prefix and counted, and new names are
+    inserted individually, so the catalog stays fast as it grows to
+    tens of thousands of studies and trials.
+
+    A new catalog is seeded with the names in the flat `cache.json`
+    file (a dict of study names to lists of trial names), and is then
+    kept in sync with the portal from the cache's `updated_at` time
+    (see `sync.py`).
+
+    """
+    def __init__(self, path=None, seed=SEED_PATH):
+        self.path = path or state_path('catalog.db')
+        self.db = sqlite3.connect(self.path, timeout=30)
+        self.db.executescript(SCHEMA)
+        if self.updated_at is None and seed and os.path.isfile(seed):
+            cache = json.load(open(seed))
+            self.add(cache['studies'].keys(),
+                     [(study, trial)
+                      for study, trials in cache['studies'].items()
+                      for trial in trials],
+                     updated_at=cache['updated_at'])
+            with self.db:
+                self.set_meta('sync_since', cache['updated_at'])
+
+    def get_meta(self, key):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?',
+                              (key,)).fetchone()
+        return row and row[0]
+
+    def set_meta(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO meta VALUES (?,?)',
+                        (key, value))
+
+    @property
+    def updated_at(self):
+        "When names were last added to the catalog (None if never)."
+        return self.get_meta('updated_at')
+
+    def add(self, studies=(), trials=(), updated_at=None):
+        """
+        Add the names of `studies` and of `trials` (given as pairs of
+        study and trial names) in one transaction.  The studies of the
+        trials are added too.  Returns the number of new names.
+
+        """
+        trials = list(trials)
+        studies = set(studies) | set(study for study, trial in trials)
+        with self.db:
+            before = self.db.total_changes
+            self.db.executemany('INSERT OR IGNORE INTO studies VALUES (?)',
+                                [(study,) for study in studies])
+            self.db.executemany('INSERT OR IGNORE INTO trials VALUES (?,?)',
+                                trials)
+            added = self.db.total_changes - before
+            if added or updated_at:
+                self.set_meta('updated_at', updated_at or now())
+        return added
+
+    def add_study(self, name):
+        "Add a study name, returning True if it's new."
+        return self.add([name]) > 0
+
+    def add_trial(self, study, name):
+        "Add a trial name (and its study), returning True if it's new."
+        return self.add(trials=[(study, name)]) > 0
+
+    def studies(self, prefix=''):
+        "Return the (sorted) study names starting with `prefix`."
+        return [row[0] for row in self.db.execute(
+            'SELECT name FROM studies WHERE name >= ? AND name < ? '
+            'ORDER BY name', prefix_range(prefix))]
+
+    def trials(self, study, prefix=''):
+        "Return the (sorted) trial names of `study` starting with `prefix`."
+        return [row[0] for row in self.db.execute(
+            'SELECT name FROM trials WHERE study = ? '
+            'AND name >= ? AND name < ? ORDER BY name',
+            (study,) + prefix_range(prefix))]
+
+    def paths(self, prefix=''):
+        """
+        Return the names of studies and of their trials (as `study/trial`)
+        starting with `prefix`, each study followed by its trials.
+
+        """
+        study, slash, trial = prefix.partition('/')
+        if slash:                       # only trials of the one study
+            return [study + '/' + name for name in self.trials(study, trial)]
+        return [study + '/' + name if name else study
+                for study, name in self.db.execute(
+            'SELECT name, \'\' FROM studies WHERE name >= ? AND name < ? '
+            'UNION ALL SELECT study, name FROM trials '
+            'WHERE study >= ? AND study < ? ORDER BY 1, 2',
+            prefix_range(prefix) * 2)]
+
+    def has_study(self, name):
+        return self.db.execute('SELECT 1 FROM studies WHERE name = ?',
+                               (name,)).fetchone() is not None
+
+    def has_trial(self, study, name):
+        return self.db.execute(
+            'SELECT 1 FROM trials WHERE study = ? AND name = ?',
+            (study, name)).fetchone() is not None
+
+    def counts(self):
+        "Return the number of studies and of trials in the catalog."
+        return (self.db.execute('SELECT COUNT(*) FROM studies').fetchone()[0],
+                self.db.execute('SELECT COUNT(*) FROM trials').fetchone()[0])
@@ -0,0 +1,80 @@
+import io
+import os
+import hashlib
+from multiprocessing.pool import ThreadPool
+
+
+ALGORITHMS = ('md5', 'sha256')  # digests computed for each file
+CHUNK_SIZE = 8 * 1024 * 1024    # bytes read per chunk
+WORKERS = 4                     # files hashed concurrently
+
+
+def digest(path, algorithms=ALGORITHMS, chunk_size=CHUNK_SIZE):
+    """
+    Hash the file at `path` with each of the given `algorithms` in a
+    single pass, returning a dict with the file's byte `size` and a
+    hex digest per algorithm (e.g. `{'size': 3, 'md5': ..., ...}`).
+
+    The file is read in large chunks into a reusable buffer, so no
+    per-chunk copies are made.  Both the reads and the hashing release
+    the GIL, so this can run in a background thread while the user is
+    being prompted.
+
+    """
+    hashes = [hashlib.new(name) for name in algorithms]
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    size = 0
+    with io.open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            for h in hashes:
+                h.update(view[:n])
+            size += n
+    result = dict(zip(algorithms, [h.hexdigest() for h in hashes]))
+    result['size'] = size
+    return result
+
+
+class Checksummer:
+    """
+    Hashes a list of files in a background pool of worker threads.
+
+    Hashing starts as soon as the checksummer is created.  Calling it
+    with a path waits for (and returns) that file's digest dict.
+
+    If a `cache` is given (a `ContentIndex`), files whose digests are
+    cached (and that haven't changed since) aren't read again, and new
+    digests are added to the cache.
+
+    """
+    def __init__(self, paths, workers=WORKERS, cache=None):
+        self.cache = cache
+        self.digests = {}                   # cached digests by path
+        self.stats = {}                     # stat of each file hashed
+        self.pending = {}
+        for path in paths:
+            self.stats[path] = st = os.stat(path)
+            cached = cache and cache.cached(path, st)
+            if cached:
+                self.digests[path] = cached
+        hashing = [path for path in paths if path not in self.digests]
+        self.pool = ThreadPool(max(1, min(workers, len(hashing))))
+        for path in hashing:                # hash in the given order
+            self.pending[path] = self.pool.apply_async(digest, (path,))
+        self.pool.close()
+
+    def ready(self, path):
+        "Return True if the digest of `path` is available."
+        return path in self.digests or self.pending[path].ready()
+
+    def __call__(self, path):
+        "Return the digest dict of `path` (waiting for it if needed)."
+        if path not in self.digests:
+            # a timeout keeps the wait interruptible with ctrl-c
+            self.digests[path] = self.pending[path].get(timeout=24 * 60 * 60)
+            if self.cache:
+                self.cache.remember(path, self.digests[path], self.stats[path])
+        return self.digests[path]
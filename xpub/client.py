@@ -0,0 +1,100 @@
+import json
+import zlib
+
+
+TIMEOUT = (5, 60)       # connect and read timeouts (in seconds)
+RETRIES = 3             # retries on connection errors and 5xx responses
+BACKOFF = 0.5           # backoff factor: sleep 0.5, 1, 2, ... between retries
+POOL_SIZE = 8           # max connections kept alive per host
+BULK_SIZE = 100         # max records per bulk request
+GZIP_MIN = 1024         # only compress request bodies at least this big
+
+
+def gzip(data):
+    "Compress `data` (a string) in gzip format."
+    z = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return z.compress(data) + z.flush()
+
+
+class Client:
+    """
+    An http client for getting and posting json from/to the portal.
+
+    A client keeps a pool of keep-alive connections (shared by all
+    threads using it), and retries requests with exponential backoff
+    on connection errors and 5xx responses.  Request bodies are gzipped
+    if `compress` is True.
+
+    """
+    def __init__(self, timeout=TIMEOUT, retries=RETRIES, backoff=BACKOFF,
+                       pool_size=POOL_SIZE, compress=True):
+        import requests                     # (imported on first use)
+        from requests.adapters import HTTPAdapter
+        from requests.packages.urllib3.util.retry import Retry
+        self.timeout = timeout
+        self.compress = compress
+        retry = dict(total=retries, backoff_factor=backoff,
+                     status_forcelist=(500, 502, 503, 504),
+                     raise_on_status=False)
+        try:                                # retry posts too
+            retry = Retry(allowed_methods=False, **retry)
+        except TypeError:                   # (older urllib3 versions)
+            retry = Retry(method_whitelist=False, **retry)
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size,
+                              max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def post(self, url, data, headers={}):
+        """
+        Post `data` as json to `url`, returning the response.
+
+        Raises a `requests.HTTPError` if the final response (after
+        any retries) is an error.
+
+        """
+        body = json.dumps(data)
+        headers = dict(headers, **{'Content-Type': 'application/json'})
+        if self.compress and len(body) >= GZIP_MIN:
+            body = gzip(body)
+            headers['Content-Encoding'] = 'gzip'
+        resp = self.session.post(url, data=body, headers=headers,
+                                 timeout=self.timeout)
+        resp.raise_for_status()
+        return resp
+
+    def get(self, url, params=None, headers={}):
+        """
+        Get `url` (with query `params`), returning the response.
+
+        Raises a `requests.HTTPError` if the final response (after
+        any retries) is an error.  (A `304 Not Modified` response to
+        a conditional request isn't an error.)
+
+        """
+        resp = self.session.get(url, params=params, headers=headers,
+                                timeout=self.timeout)
+        resp.raise_for_status()
+        return resp
+
+    def post_many(self, url, records, size=BULK_SIZE):
+        """
+        Post a list of `records` to `url` in bulk, as json arrays of up
+        to `size` records per request (sent over the same connection).
+        Returns the list of responses.
+
+        """
+        return [self.post(url, records[i:i + size])
+                for i in range(0, len(records), size)]
+
+
+_client = None
+
+def get_client():
+    "Return the shared client (created on first use)."
+    global _client
+    if _client is None:
+        _client = Client()
+    return _client
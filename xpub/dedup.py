@@ -0,0 +1,112 @@
+import os
+import json
+import sqlite3
+from datetime import datetime
+from settings import state_path
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS hashes (
+    path   TEXT PRIMARY KEY,
+    size   INTEGER,
+    mtime  REAL,
+    digest TEXT
+);
+CREATE TABLE IF NOT EXISTS published (
+    sha256           TEXT,
+    size             INTEGER,
+    submission_id    TEXT,
+    task_id          TEXT,
+    source_path      TEXT,
+    destination_path TEXT,
+    record           TEXT,
+    created_at       TEXT,
+    PRIMARY KEY (sha256, size)
+);
+CREATE INDEX IF NOT EXISTS published_submission ON published (submission_id);
+'''
+
+
+def now():
+    return datetime.now().isoformat() + 'Z'
+
+
+class ContentIndex:
+    """
+    A local index of file contents: a cache of the digests of files
+    (keyed by path and valid while their size and mtime are unchanged),
+    and a record of the content (sha256 digest and size) of each file
+    transferred, with the task, destination path and metadata record
+    it was transferred with.
+
+    """
+    def __init__(self, path=None):
+        self.path = path or state_path('dedup.db')
+        self.db = sqlite3.connect(self.path, timeout=30)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def cached(self, path, st=None):
+        """
+        Return the cached digest dict of the file at `path` (with stat
+        result `st`), or None if it isn't cached or the file changed.
+
+        """
+        st = st or os.stat(path)
+        row = self.db.execute('SELECT * FROM hashes WHERE path = ?',
+                              (path,)).fetchone()
+        if row and row['size'] == st.st_size and row['mtime'] == st.st_mtime:
+            return json.loads(row['digest'])
+        return None
+
+    def remember(self, path, digest, st):
+        "Cache the `digest` dict of the file at `path` with stat result `st`."
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO hashes VALUES (?,?,?,?)',
+                            (path, st.st_size, st.st_mtime, json.dumps(digest)))
+
+    def lookup(self, sha256, size):
+        """
+        Return the record of an earlier transfer of this content, if
+        any (only those of tasks that globus accepted count).
+
+        """
+        return self.db.execute(
+            'SELECT * FROM published WHERE sha256 = ? AND size = ? '
+            'AND task_id IS NOT NULL', (sha256, size)).fetchone()
+
+    def publish(self, submission_id, files):
+        """
+        Record the content of the `files` transferred by a task (as
+        `(results, destination path)` pairs, where `results` has the
+        file's digests).  The content of a task that was never accepted
+        is recorded again for the new one.
+
+        """
+        files = [(results, dest) for results, dest in files
+                 if results.get('file_sha256')]
+        with self.db:
+            self.db.executemany(
+                'DELETE FROM published WHERE sha256 = ? AND size = ? '
+                'AND task_id IS NULL', [
+                    (results['file_sha256'], results['file_size'])
+                    for results, dest in files])
+            self.db.executemany(
+                'INSERT OR IGNORE INTO published VALUES (?,?,?,?,?,?,?,?)', [
+                    (results['file_sha256'], results['file_size'],
+                     submission_id, None, results['file_abs_path'], dest,
+                     json.dumps(results), now())
+                    for results, dest in files])
+
+    def submitted(self, submission_id, task_id):
+        "Set the task id of the files transferred by a task."
+        with self.db:
+            self.db.execute(
+                'UPDATE published SET task_id = ? WHERE submission_id = ?',
+                (task_id, submission_id))
+
+    def failed(self, task_id):
+        "Forget the content of a task that failed (so it's sent again)."
+        with self.db:
+            self.db.execute('DELETE FROM published WHERE task_id = ?',
+                            (task_id,))
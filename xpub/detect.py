@@ -0,0 +1,165 @@
+"""
+Detection of the mediatype of files from their names and contents.
+
+The kind of a file is told by its magic bytes (read from the first few
+KB of the file), or else by its extension.  Each kind of file maps to
+the mediatypes it may be, the first being assumed unless the file's
+name hints at another (e.g. a cine file named `grid-cam1.cine`).  Kinds
+that may be several mediatypes with no assumed one are ambiguous.
+
+Labs can add their own rules in `detect.json` in the config dir, as a
+list of `[pattern, mediatype]` pairs matched against file names, such
+as ...
+
+    {"rules": [["*_bead*.cine", "calib"], ["*.c3d", "emg"]]}
+
+"""
+import os
+import re
+import json
+import fnmatch
+from multiprocessing.pool import ThreadPool
+from settings import CONFIG_DIR
+
+
+HEAD_BYTES = 4096               # bytes read from the start of each file
+WORKERS = 8                     # files read concurrently
+
+XRAY = ['xray', 'grid', 'calib']        # (mediatypes of xray videos)
+
+# kind of file -> the mediatypes it may be (and whether the first is assumed)
+KINDS = {
+    'nsx':       (['NSx'], True),
+    'nev':       (['NEV'], True),
+    'cine':      (XRAY, True),
+    'video':     (['video'] + XRAY, True),
+    'tiff':      (['vol'] + XRAY, False),
+    'volume':    (['vol'], True),
+}
+
+# magic bytes: (offset, bytes, kind), checked in order
+MAGIC = [
+    (0, 'NEURALCD', 'nsx'),             # NSx 2.2 / 2.3
+    (0, 'NEURALSG', 'nsx'),             # NSx 2.1
+    (0, 'BRSMPGRP', 'nsx'),             # NSx 3.x
+    (0, 'NEURALEV', 'nev'),             # NEV 2.x
+    (0, 'BREVENTS', 'nev'),             # NEV 3.x
+    (0, 'CI,\x00', 'cine'),             # phantom cine (type, header size)
+    (8, 'AVI ', 'video'),               # RIFF avi
+    (4, 'ftyp', 'video'),               # mp4 / quicktime
+    (4, 'moov', 'video'),
+    (4, 'mdat', 'video'),
+    (4, 'wide', 'video'),
+    (0, '\x00\x00\x01\xba', 'video'),   # mpeg program stream
+    (0, '\x1a\x45\xdf\xa3', 'video'),   # matroska / webm
+    (0, '\x30\x26\xb2\x75', 'video'),   # asf / wmv
+    (0, 'II*\x00', 'tiff'),
+    (0, 'MM\x00*', 'tiff'),
+    (128, 'DICM', 'volume'),            # dicom
+    (344, 'n+1\x00', 'volume'),         # nifti
+    (0, 'NRRD', 'volume'),
+]
+
+# (lowercased) file extension -> kind of file
+EXTENSIONS = {
+    '.nev': 'nev',
+    '.cine': 'cine', '.cin': 'cine',
+    '.avi': 'video', '.mov': 'video', '.mp4': 'video', '.m4v': 'video',
+    '.mpg': 'video', '.mpeg': 'video', '.mkv': 'video', '.wmv': 'video',
+    '.tif': 'tiff', '.tiff': 'tiff',
+    '.dcm': 'volume', '.nii': 'volume', '.nrrd': 'volume', '.nhdr': 'volume',
+}
+EXTENSIONS.update(('.ns{}'.format(i), 'nsx') for i in range(1, 10))
+
+# words in file names hinting at a mediatype (by prefix)
+HINTS = [
+    ('grid', 'grid'), ('undist', 'grid'),
+    ('calib', 'calib'), ('cube', 'calib'),
+    ('undtform', 'proc'), ('mdlt', 'proc'), ('mayacam', 'proc'),
+]
+
+separators = re.compile(r'[\W_]+')
+
+
+def load_rules(config_dir=CONFIG_DIR):
+    "Return the lab's `[pattern, mediatype]` rules (from `detect.json`)."
+    path = os.path.join(config_dir, 'detect.json')
+    if not os.path.isfile(path):
+        return []
+    return json.load(open(path)).get('rules', [])
+
+
+def available(config_dir=CONFIG_DIR):
+    "Return the mediatypes with a config in `config_dir`."
+    dir = os.path.join(config_dir, 'mediatypes')
+    return sorted(os.path.splitext(name)[0] for name in os.listdir(dir)
+                  if name.endswith('.json'))
+
+
+def kind(path, head):
+    "Return the kind of the file at `path` starting with `head`, or None."
+    for offset, magic, name in MAGIC:
+        if head[offset:offset + len(magic)] == magic:
+            return name
+    name = os.path.basename(path).lower()
+    if name.endswith('.gz'):                        # (e.g. `.nii.gz`)
+        name = name[:-3]
+    return EXTENSIONS.get(os.path.splitext(name)[1])
+
+
+def hints(path):
+    "Return the mediatypes hinted at by the words of a file's name."
+    name = os.path.splitext(os.path.basename(path))[0].lower()
+    words = [w for w in separators.split(name) if w]
+    return [mt for prefix, mt in HINTS
+            if any(w.startswith(prefix) for w in words)]
+
+
+class Detector:
+    """
+    Detects the mediatype of files (see above).
+
+    Calling a detector with a file path returns a pair of the file's
+    mediatype (or None if it's ambiguous) and the mediatypes it may
+    be (to choose from when it's ambiguous).  Only mediatypes with a
+    config are detected.  Any `rules` given are checked before the
+    lab's rules.
+
+    """
+    def __init__(self, rules=(), config_dir=CONFIG_DIR):
+        self.rules = list(rules) + load_rules(config_dir)
+        self.mediatypes = available(config_dir)
+
+    def __call__(self, path):
+        name = os.path.basename(path).lower()
+        for pattern, mt in self.rules:
+            if fnmatch.fnmatchcase(name, pattern.lower()):
+                return mt, [mt]
+        try:
+            with open(path, 'rb') as f:
+                head = f.read(HEAD_BYTES)
+        except IOError:
+            head = ''
+        candidates, assumed = KINDS.get(kind(path, head),
+                                        (self.mediatypes, False))
+        candidates = [mt for mt in candidates if mt in self.mediatypes]
+        hinted = [mt for mt in hints(path) if mt in candidates]
+        if len(hinted) == 1:
+            return hinted[0], candidates
+        if len(candidates) == 1 or (candidates and assumed and not hinted):
+            return candidates[0], candidates
+        return None, candidates
+
+    def classify(self, paths, workers=WORKERS):
+        """
+        Detect the mediatype of each of `paths` (reading them in a pool
+        of worker threads), returning a dict of paths to their results.
+
+        """
+        if not paths:
+            return {}
+        pool = ThreadPool(max(1, min(workers, len(paths))))
+        try:
+            return dict(zip(paths, pool.map(self, paths)))
+        finally:
+            pool.close()
@@ -0,0 +1,139 @@
+"""
+A local hatabase of macaque health records.
+
+Run `xpub --import-health FILE` to import the health records in a
+spreadsheet export (CSV, tab-separated or JSON lines, with columns
+named after the prompt keys of `macaque_health_record.json`).
+
+"""
+import os
+import json
+import sqlite3
+import hashlib
+from datetime import datetime
+from manifest import Rejects, rejects_path, rows
+from settings import state_path
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS health_records (
+    digest       TEXT PRIMARY KEY,
+    subject_name TEXT,
+    date         TEXT,
+    study        TEXT,
+    version      TEXT,
+    data         TEXT,
+    source       TEXT,
+    created_at   TEXT
+);
+CREATE INDEX IF NOT EXISTS health_records_subject
+    ON health_records (subject_name, date);
+CREATE INDEX IF NOT EXISTS health_records_date ON health_records (date);
+'''
+
+BATCH_SIZE = 1000               # records written per transaction
+
+
+def now():
+    return datetime.now().isoformat() + 'Z'
+
+
+class Hatabase:
+    """
+    A local SQLite store of health records, indexed by animal (the
+    `subject_name`) and date, so the records of an animal over a
+    period are found without a scan.
+
+    Each record is keyed by a digest of its data, so importing the
+    same export again (or one that overlaps it) adds no duplicates.
+
+    """
+    def __init__(self, path=None):
+        self.path = path or state_path('hatabase.db')
+        self.db = sqlite3.connect(self.path, timeout=30)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def add(self, batch, source=None):
+        """
+        Add a batch of health record results in a single transaction,
+        returning the number added (records already there are skipped).
+
+        """
+        values = []
+        for results in batch:
+            data = json.dumps(results['data'], sort_keys=True)
+            values.append((hashlib.sha1(data).hexdigest(),
+                           results['data'].get('subject_name'),
+                           results['data'].get('date'),
+                           results['data'].get('study'),
+                           results.get('version'), data, source, now()))
+        before = self.db.total_changes
+        with self.db:
+            self.db.executemany('INSERT OR IGNORE INTO health_records '
+                                'VALUES (?,?,?,?,?,?,?,?)', values)
+        return self.db.total_changes - before
+
+    def records(self, subject=None, start=None, end=None):
+        """
+        Return the data of the records of an animal (`subject`), or of
+        all animals, from the `start` to the `end` date (`YYYY-MM-DD`,
+        inclusive), ordered by animal and date.
+
+        """
+        where, args = [], []
+        for sql, value in [('subject_name = ?', subject),
+                           ('date >= ?', start), ('date <= ?', end)]:
+            if value is not None:
+                where.append(sql)
+                args.append(value)
+        cursor = self.db.execute(
+            'SELECT data FROM health_records {} '
+            'ORDER BY subject_name, date'.format(
+                'WHERE ' + ' AND '.join(where) if where else ''), args)
+        return [json.loads(row['data']) for row in cursor]
+
+    def count(self):
+        return self.db.execute(
+            'SELECT COUNT(*) FROM health_records').fetchone()[0]
+
+
+def import_records(path, configure, hatabase=None, required=False,
+                   batch_size=BATCH_SIZE):
+    """
+    Import the health records in the export at `path` into the
+    `hatabase`, returning the number of rows rejected.
+
+    The export is streamed rather than loaded, each row being validated
+    against the health record prompts (`configure(row)` should return
+    the loaded config and its prompts, see `manifest.rows`), and the
+    valid records are written `batch_size` at a time, each batch in a
+    single transaction.  Rows with errors are written to the reject
+    file (see `manifest.rejects_path`).
+
+    """
+    hatabase = hatabase or Hatabase()
+    rejects = Rejects(rejects_path(path))
+    if os.path.exists(rejects.path):
+        os.remove(rejects.path)             # from an earlier import
+    source = os.path.abspath(path)
+    batch = []
+    read = added = 0
+    try:
+        for results, _ in rows(path, configure, rejects, required=required):
+            batch.append(results)
+            if len(batch) >= batch_size:
+                added += hatabase.add(batch, source)
+                read += len(batch)
+                batch = []
+        if batch:
+            added += hatabase.add(batch, source)
+            read += len(batch)
+    finally:
+        rejects.close()
+
+    print "{} record(s) imported into {} ({} already there)".format(
+        added, hatabase.path, read - added)
+    if rejects.count:
+        print "{} row(s) rejected: see {}".format(rejects.count, rejects.path)
+    return rejects.count
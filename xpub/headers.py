@@ -0,0 +1,468 @@
+"""
+Extraction of metadata from the headers of data files.
+
+An extractor reads the header of a file of some mediatype and returns
+a dict of the values found, keyed by the prompt keys of the mediatype's
+config (e.g. `sampling_rate`), so they can be offered for the user to
+confirm rather than type.  Other values (e.g. `frame_count`) are added
+to the file's results.
+
+The headers of neural recordings are read through a read-only `mmap`
+of the file, unpacking just the header fields (and the odd packet
+header).  Those of videos are read with seeks and small reads.  Either
+way, the data sections of large files are never read.
+
+"""
+import os
+import mmap
+import struct
+from array import array
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
+
+
+WORKERS = 4                     # files read concurrently
+
+CLOCK = 30000                   # blackrock sample clock (Hz)
+
+
+class HeaderError(ValueError):
+    "Raised for a file whose header can't be read."
+
+
+def mapped(path):
+    "Return a read-only mmap of the file at `path`."
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            raise HeaderError('empty file')
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def unpack(fmt, buf, offset):
+    "Unpack little-endian `fmt` from `buf` at `offset`."
+    try:
+        return struct.unpack_from('<' + fmt, buf, offset)
+    except struct.error:
+        raise HeaderError('truncated header')
+
+
+def text(value):
+    "Return a null-padded header string as text."
+    return value.split('\0', 1)[0].strip().decode('latin-1')
+
+
+def systemtime(buf, offset):
+    "Return the windows SYSTEMTIME at `offset` as an ISO date/time string."
+    year, month, weekday, day, hour, minute, second, ms = \
+        unpack('8H', buf, offset)
+    try:
+        return datetime(year, month, day, hour, minute, second,
+                        ms * 1000).isoformat()
+    except ValueError:                  # (not set)
+        return None
+
+
+def rate(hz):
+    "Return a sampling rate in the style of the config's options (`2 kHz`)."
+    if hz >= 1000:
+        return '{:g} kHz'.format(hz / 1000.0)
+    return '{:g} Hz'.format(hz)
+
+
+def labels(names):
+    "Return a list of electrode labels as a comma-separated string."
+    return ', '.join(name for name in names if name) or None
+
+
+def nsx(path):
+    """
+    Return the values in the header of a blackrock NSx file (continuous
+    data, file spec 2.1, 2.2, 2.3 or 3.x).
+
+    """
+    mm = mapped(path)
+    try:
+        file_id = mm[:8]
+        if file_id == 'NEURALSG':               # (2.1)
+            period, count = unpack('II', mm, 24)
+            if not period:
+                raise HeaderError('no sampling period')
+            ids = array('I', mm[32:32 + 4 * count])
+            if len(ids) < count:
+                raise HeaderError('truncated header')
+            samples = (len(mm) - 32 - 4 * count) // (2 * count or 1)
+            return {
+                'sampling_rate': rate(CLOCK / float(period)),
+                'channel_count': count,
+                'duration': round(samples * period / float(CLOCK), 3),
+                'electrode_labels': labels(str(i) for i in ids),
+            }
+        if file_id not in ('NEURALCD', 'BRSMPGRP'):
+            raise HeaderError('not an NSx file')
+
+        major, minor, header_bytes = unpack('BBI', mm, 8)
+        period, resolution = unpack('II', mm, 286)
+        if not (period and resolution):
+            raise HeaderError('no sampling period')
+        count, = unpack('I', mm, 310)
+        names = [text(unpack('16s', mm, 314 + 66 * i + 4)[0])
+                 for i in range(count)]
+
+        # data packets: header byte, timestamp and number of points
+        ts = 'Q' if major >= 3 else 'I'
+        head = struct.calcsize('<B' + ts + 'I')
+        offset = header_bytes
+        start = last = points = 0
+        while offset + head <= len(mm):
+            flag, timestamp, n = unpack('B' + ts + 'I', mm, offset)
+            if offset == header_bytes:
+                start = timestamp
+            if n == 1 and major >= 3:   # (a sample per packet: skip to last)
+                size = head + 2 * count
+                packets = (len(mm) - offset) // size    # (whole packets)
+                if packets > 1:
+                    offset += (packets - 1) * size
+                    flag, timestamp, n = unpack('B' + ts + 'I', mm, offset)
+            if offset + head + 2 * count * n > len(mm):
+                raise HeaderError('truncated data')     # (a partial packet)
+            last, points = timestamp, n
+            offset += head + 2 * count * n
+        if offset < len(mm):
+            raise HeaderError('truncated data')         # (a partial header)
+        if offset == header_bytes:
+            duration = 0
+        else:
+            duration = (last - start) / float(resolution) + \
+                       points * period / float(CLOCK)
+        return {
+            'sampling_rate': rate(CLOCK / float(period)),
+            'channel_count': count,
+            'duration': round(duration, 3),
+            'time_origin': systemtime(mm, 294),
+            'electrode_labels': labels(names),
+        }
+    finally:
+        mm.close()
+
+
+def nev(path):
+    "Return the values in the header of a blackrock NEV file (events)."
+    mm = mapped(path)
+    try:
+        if mm[:8] not in ('NEURALEV', 'BREVENTS'):
+            raise HeaderError('not a NEV file')
+        major, minor, flags, header_bytes, packet_bytes, resolution, \
+            sample_rate = unpack('BBHIIII', mm, 8)
+        if not resolution:
+            raise HeaderError('no timestamp resolution')
+        extended, = unpack('I', mm, 332)
+
+        # extended headers: 8 byte id, then 24 bytes of fields
+        electrodes = {}
+        names = {}
+        for i in range(extended):
+            offset = 336 + 32 * i
+            header_id, electrode = unpack('8sH', mm, offset)
+            if header_id == 'NEUEVWAV':
+                electrodes[electrode] = None
+            elif header_id == 'NEUEVLBL':
+                names[electrode] = text(unpack('16s', mm, offset + 10)[0])
+
+        # the last data packet starts with the latest timestamp
+        packets = (len(mm) - header_bytes) // (packet_bytes or 1)
+        duration = 0
+        if packets:
+            offset = header_bytes + (packets - 1) * packet_bytes
+            last, = unpack('Q' if major >= 3 else 'I', mm, offset)
+            duration = last / float(resolution)
+        return {
+            'channel_count': len(electrodes),
+            'duration': round(duration, 3),
+            'time_origin': systemtime(mm, 28),
+            'electrode_labels': labels(names.get(e, str(e))
+                                       for e in sorted(electrodes)),
+        }
+    finally:
+        mm.close()
+
+
+def read_at(f, offset, size):
+    "Return `size` bytes of file `f` from `offset`."
+    f.seek(offset)
+    data = f.read(size)
+    if len(data) < size:
+        raise HeaderError('truncated header')
+    return data
+
+
+def cine(f, size):
+    "Return the values in the header of a phantom cine file."
+    (cine_type, header_size, compression, version, first_image, total,
+     first_number, count, bitmap, setup, offsets) = \
+        struct.unpack('<2sHHHiIiIIII', read_at(f, 0, 36))
+    bitmap_size, width, height = \
+        struct.unpack('<Iii', read_at(f, bitmap, 12))
+    # the setup has a 16 bit frame rate up front, and the full one later
+    rate, = struct.unpack('<H', read_at(f, setup, 2))
+    if setup + 772 <= offsets:
+        rate = struct.unpack('<I', read_at(f, setup + 768, 4))[0] or rate
+    return {
+        'camera_make': 'Phantom',
+        'frame_rate': rate or None,
+        'frame_count': count,
+        'duration': round(count / float(rate), 3) if rate else None,
+        'width': width,
+        'height': abs(height),          # (negative if stored top-down)
+    }
+
+
+def chunks(f, start, stop):
+    "Yield the id, data offset and size of each RIFF chunk in a range."
+    offset = start
+    while offset + 8 <= stop:
+        chunk_id, size = struct.unpack('<4sI', read_at(f, offset, 8))
+        yield chunk_id, offset + 8, size
+        offset += 8 + size + (size & 1)
+
+
+def avi(f, size):
+    "Return the values in the header list (`hdrl`) of an AVI file."
+    for chunk_id, start, length in chunks(f, 12, size):
+        if chunk_id == 'LIST' and read_at(f, start, 4) == 'hdrl':
+            break
+    else:
+        raise HeaderError('no AVI header')
+
+    main = {}                           # from the main header
+    video = {}                          # from the video stream's header
+    def walk(start, stop):
+        for chunk_id, offset, length in chunks(f, start, stop):
+            if chunk_id == 'LIST':
+                walk(offset + 4, offset + length)
+            elif chunk_id == 'avih':
+                fields = struct.unpack('<10I', read_at(f, offset, 40))
+                if fields[0]:
+                    main['rate'] = 1e6 / fields[0]
+                main['count'] = fields[4]
+                main['width'], main['height'] = fields[8:10]
+            elif chunk_id == 'strh' and not video:
+                fields = struct.unpack('<4s4sIHHIIIII',
+                                       read_at(f, offset, 36))
+                if fields[0] == 'vids' and fields[6]:
+                    video['rate'] = fields[7] / float(fields[6])
+                    video['count'] = fields[9]
+            elif chunk_id == 'dmlh':    # (frames in all RIFF lists)
+                main['total'], = struct.unpack('<I', read_at(f, offset, 4))
+    walk(start + 4, start + length)
+
+    rate = video.get('rate') or main.get('rate')
+    count = main.get('total') or video.get('count') or main.get('count')
+    return {
+        'frame_rate': round(rate, 3) if rate else None,
+        'frame_count': count,
+        'duration': round(count / rate, 3) if rate else None,
+        'width': main.get('width'),
+        'height': main.get('height'),
+    }
+
+
+def atoms(f, start, stop):
+    "Yield the type, data offset and end of each quicktime atom in a range."
+    offset = start
+    while offset + 8 <= stop:
+        size, atom_type = struct.unpack('>I4s', read_at(f, offset, 8))
+        header = 8
+        if size == 1:                   # (64 bit size)
+            size, = struct.unpack('>Q', read_at(f, offset + 8, 8))
+            header = 16
+        elif size == 0:                 # (to the end of the file)
+            size = stop - offset
+        if size < header:
+            raise HeaderError('invalid atom size')
+        yield atom_type, offset + header, offset + size
+        offset += size
+
+
+def child(f, start, stop, path):
+    "Return the data offset and end of the atom at `path` in a range."
+    for atom_type in path.split('.'):
+        for found, start, stop in atoms(f, start, stop):
+            if found == atom_type:
+                break
+        else:
+            return None
+    return start, stop
+
+
+def quicktime(f, size):
+    "Return the values in the movie atom of a quicktime or MP4 file."
+    moov = child(f, 0, size, 'moov')    # (skipping over the media data)
+    if not moov:
+        raise HeaderError('no movie atom')
+    for atom_type, start, stop in atoms(f, *moov):
+        if atom_type != 'trak':
+            continue
+        hdlr = child(f, start, stop, 'mdia.hdlr')
+        if not hdlr or read_at(f, hdlr[0] + 8, 4) != 'vide':
+            continue                    # (not the video track)
+
+        tkhd = child(f, start, stop, 'tkhd')
+        mdhd = child(f, start, stop, 'mdia.mdhd')
+        if not (tkhd and mdhd):
+            raise HeaderError('no track header')
+        offset = tkhd[0] + (88 if read_at(f, tkhd[0], 1) == '\x01' else 76)
+        width, height = struct.unpack('>II', read_at(f, offset, 8))
+
+        if read_at(f, mdhd[0], 1) == '\x01':
+            scale, duration = struct.unpack('>IQ',
+                                            read_at(f, mdhd[0] + 20, 12))
+        else:
+            scale, duration = struct.unpack('>II',
+                                            read_at(f, mdhd[0] + 12, 8))
+
+        stsz = child(f, start, stop, 'mdia.minf.stbl.stsz') or \
+               child(f, start, stop, 'mdia.minf.stbl.stz2')
+        count = stsz and struct.unpack('>I', read_at(f, stsz[0] + 8, 4))[0]
+        seconds = duration / float(scale) if scale else 0
+        return {
+            'frame_rate': round(count / seconds, 3) if count and seconds
+                          else None,
+            'frame_count': count,
+            'duration': round(seconds, 3),
+            'width': width >> 16,       # (16.16 fixed point)
+            'height': height >> 16,
+        }
+    raise HeaderError('no video track')
+
+
+def tiff(f, size):
+    "Return the number of pages (frames) of a TIFF stack, and their size."
+    order = '<' if read_at(f, 0, 2) == 'II' else '>'
+    version, = struct.unpack(order + 'H', read_at(f, 2, 2))
+    # sizes of the entry count, an entry, and the offset of the next IFD,
+    # and where an entry's value is
+    if version == 43:                   # (BigTIFF)
+        count, entry, pointer, field = 'Q', 20, 'Q', 12
+        offset, = struct.unpack(order + 'Q', read_at(f, 8, 8))
+    else:
+        count, entry, pointer, field = 'H', 12, 'I', 8
+        offset, = struct.unpack(order + 'I', read_at(f, 4, 4))
+    values = {}
+    pages = 0
+    seen = set()
+    while offset and offset not in seen:    # (follow the chain of IFDs)
+        seen.add(offset)
+        n, = struct.unpack(order + count,
+                           read_at(f, offset, struct.calcsize(count)))
+        entries = offset + struct.calcsize(count)
+        if not pages:                   # (size of the first page)
+            data = read_at(f, entries, n * entry)
+            for i in range(0, len(data), entry):
+                tag, kind = struct.unpack(order + 'HH', data[i:i + 4])
+                if tag in (256, 257) and kind in (3, 4):
+                    fmt = 'H' if kind == 3 else 'I'     # (short or long)
+                    values['width' if tag == 256 else 'height'], = \
+                        struct.unpack_from(order + fmt, data, i + field)
+        offset, = struct.unpack(order + pointer, read_at(
+            f, entries + n * entry, struct.calcsize(pointer)))
+        pages += 1
+    values['frame_count'] = pages
+    return values
+
+
+# container magic bytes: (offset, bytes, parser)
+CONTAINERS = [
+    (0, 'CI,\x00', cine),
+    (8, 'AVI ', avi),
+    (4, 'ftyp', quicktime), (4, 'moov', quicktime), (4, 'mdat', quicktime),
+    (4, 'wide', quicktime), (4, 'free', quicktime), (4, 'skip', quicktime),
+    (0, 'II*\x00', tiff), (0, 'MM\x00*', tiff),
+    (0, 'II+\x00', tiff), (0, 'MM\x00+', tiff),
+]
+
+
+def container(path):
+    """
+    Return the values in the header of a video file or image stack
+    (cine, AVI, quicktime/MP4 or TIFF), read with a few seeks and small
+    reads of its header and index structures (so only kilobytes of
+    even a large video are read, and no frames are decoded).
+
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        head = f.read(12)
+        for offset, magic, parser in CONTAINERS:
+            if head[offset:offset + len(magic)] == magic:
+                try:
+                    return parser(f, size)
+                except struct.error:
+                    raise HeaderError('invalid header')
+    raise HeaderError('unknown container')
+
+
+# mediatype -> extractor
+EXTRACTORS = {
+    'NSx': nsx,
+    'NEV': nev,
+    'xray': container,
+    'video': container,
+    'grid': container,
+    'calib': container,
+}
+
+
+def split(values, prompts):
+    """
+    Split the header `values` of a file into those for the given
+    `prompts` and the rest, which are returned as file info for its
+    results (e.g. `frame_count` as `file_frame_count`).
+
+    """
+    keys = set(p.key for p in prompts)
+    return (dict((k, v) for k, v in values.items() if k in keys),
+            dict(('file_' + k, v) for k, v in values.items() if k not in keys))
+
+
+def extract(path, mediatype):
+    """
+    Return the values in the header of the file at `path` of the given
+    `mediatype` (an empty dict if there's no extractor for it or the
+    header can't be read).
+
+    """
+    extractor = EXTRACTORS.get(mediatype)
+    if not extractor:
+        return {}
+    try:
+        return dict((k, v) for k, v in extractor(path).items()
+                    if v is not None)
+    except (HeaderError, EnvironmentError) as e:
+        print "couldn't read the header of {}: {}".format(path, e)
+        return {}
+
+
+class Headers:
+    """
+    Extracts the header values of a list of files in a background pool
+    of worker threads (like `Checksummer`).
+
+    Extraction starts as soon as the object is created, for each pair
+    of file path and mediatype given.  Calling it with a path and its
+    mediatype waits for (and returns) the file's values, extracting
+    them then if the mediatype wasn't known up front.
+
+    """
+    def __init__(self, files, workers=WORKERS):
+        files = [(path, mt) for path, mt in files if mt in EXTRACTORS]
+        self.pending = {}
+        self.pool = ThreadPool(max(1, min(workers, len(files))))
+        for path, mt in files:
+            self.pending[path, mt] = self.pool.apply_async(extract, (path, mt))
+        self.pool.close()
+
+    def __call__(self, path, mediatype):
+        "Return the header values of `path` (waiting for them if needed)."
+        if (path, mediatype) in self.pending:
+            return self.pending[path, mediatype].get(timeout=24 * 60 * 60)
+        return extract(path, mediatype)
@@ -0,0 +1,112 @@
+import json
+import sqlite3
+from datetime import datetime
+from settings import state_path
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tasks (
+    submission_id TEXT PRIMARY KEY,
+    task_id       TEXT,
+    source        TEXT,
+    destination   TEXT,
+    options       TEXT,
+    status        TEXT,
+    message       TEXT,
+    created_at    TEXT,
+    updated_at    TEXT
+);
+CREATE TABLE IF NOT EXISTS items (
+    submission_id    TEXT,
+    source_path      TEXT,
+    destination_path TEXT,
+    size             INTEGER
+);
+CREATE INDEX IF NOT EXISTS items_submission ON items (submission_id);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status);
+'''
+
+# status of a task recorded in the journal but not (yet) accepted by
+# globus; once accepted, the status is the globus task status
+PENDING = 'pending'
+SUBMITTED = 'submitted'
+
+
+def now():
+    return datetime.now().isoformat() + 'Z'
+
+
+class Journal:
+    """
+    A local journal of the globus transfer tasks submitted by `xpub`.
+
+    Each task is recorded (with its items and their sizes) *before* it
+    is submitted, keyed by its globus submission id.  Since globus
+    treats a re-used submission id as a duplicate of the original
+    request, pending tasks can be resubmitted safely.
+
+    """
+    def __init__(self, path=None):
+        self.path = path or state_path('journal.db')
+        self.db = sqlite3.connect(self.path, timeout=30)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def record(self, transfer, sizes={}, deadline_hours=None):
+        """
+        Record a `Transfer` (with its items) as pending submission,
+        given a dict of the `sizes` of its source files, and the hours
+        it was given to complete (if its deadline was set from them, so
+        the deadline can be set afresh when it's resubmitted).
+
+        """
+        options = dict(transfer.kw, deadline=transfer.deadline,
+                                    sync_level=transfer.sync_level,
+                                    label=transfer.label)
+        if deadline_hours is not None:
+            options['deadline_hours'] = deadline_hours
+        with self.db:
+            self.db.execute('INSERT INTO tasks VALUES (?,?,?,?,?,?,?,?,?)', (
+                transfer.submission_id, None,
+                transfer.source_endpoint, transfer.destination_endpoint,
+                json.dumps(options), PENDING, None, now(), now()))
+            self.db.executemany('INSERT INTO items VALUES (?,?,?,?)', [
+                (transfer.submission_id, item['source_path'],
+                 item['destination_path'], sizes.get(item['source_path']))
+                for item in transfer.items])
+
+    def update(self, submission_id, **fields):
+        "Update the given fields (`status`, `task_id`, ...) of a task."
+        fields['updated_at'] = now()
+        keys = sorted(fields)
+        sql = 'UPDATE tasks SET {} WHERE submission_id = ?'.format(
+            ', '.join('{} = ?'.format(k) for k in keys))
+        with self.db:
+            self.db.execute(sql, [fields[k] for k in keys] + [submission_id])
+
+    def tasks(self, status=None):
+        "Return the recorded tasks (optionally only those with `status`)."
+        sql = '''SELECT t.*, COUNT(i.source_path) AS files,
+                        SUM(i.size) AS bytes
+                 FROM tasks t LEFT JOIN items i USING (submission_id)
+                 {} GROUP BY t.submission_id ORDER BY t.created_at'''
+        if status:
+            return self.db.execute(sql.format('WHERE t.status = ?'),
+                                   (status,)).fetchall()
+        return self.db.execute(sql.format('')).fetchall()
+
+    def items(self, submission_id):
+        "Return the items recorded for a task."
+        return self.db.execute('SELECT * FROM items WHERE submission_id = ?',
+                               (submission_id,)).fetchall()
+
+    def show(self):
+        "Print a summary of the recorded tasks."
+        tasks = self.tasks()
+        if not tasks:
+            print "no transfer tasks recorded in", self.path
+        for task in tasks:
+            print "{}  {:<36}  {:<10}  {:>5} file(s)  {:>14} bytes  {}".format(
+                task['created_at'][:19], task['task_id'] or '-',
+                task['status'], task['files'], task['bytes'] or '?',
+                task['message'] or '')
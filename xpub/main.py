@@ -15,27 +15,84 @@ Examples:
     xpub --study     (create a new study)
     xpub --trial     (create a new trial)
     xpub FILE        (transfer a file)
+    xpub DIR *.cine  (transfer many files as one batch)
+    xpub --watch DIR (transfer new files written to a directory)
+    xpub --trial --manifest trials.csv  (create trials in bulk)
+    xpub --import-health records.csv    (import health records in bulk)
+    xpub --jobs      (list submitted transfer tasks)
+    xpub --monitor   (follow submitted transfer tasks until they're done)
+    xpub --flush     (send any metadata left in the outbox)
+    xpub --sync-cache   (fetch new study/trial names from the portal)
 
 """
 import os
 import json
 import argparse
 from datetime import datetime
-from mediatype import get_mediatype
-from action import prompt_for_action, save_json
+import manifest
+from mediatype import file_resource, mediatype_resource, resource_mediatype
+from action import prompt_for_action, resume, flush
+from answers import Answers
+from overlay import Overlay
+from batch import expand_paths
+from checksum import Checksummer
+from detect import Detector
+from headers import Headers, split
+from dedup import ContentIndex
+from hatabase import import_records
+from journal import Journal
+from monitor import Monitor
+from bundle import Bundle
+from catalog import Catalog
+from sync import sync, auto_sync
+from watch import Session
+from settings import CONFIG_DIR
+from startup import run_profile
 from prompter import Prompt, Prompter
 
 
+def load_config(bundle, config_path, catalog, kind):
+    """
+    Return the resource config at `config_path` (supplemented with the
+    options learned for it and the study/trial names in the `catalog`)
+    and its prompts.  The `kind` of resource should be `trial`, `file`
+    or `` for others.
+
+    Both are taken from the compiled config `bundle` if the config
+    file hasn't changed since it was bundled.
+
+    """
+    def build():
+        config = json.load(open(config_path))   # load resource config file
+        # validate prompt dicts and compile their patterns
+        return config, [Prompt(p) for p in config['prompts']]
+
+    config, prompts = bundle.get(('config', config_path), [config_path], build)
+
+    # add the options learned from earlier input (most used first)
+    learned = Overlay(config_path).options()
+    for prompt in prompts:
+        if prompt.type == 'list':
+            for option in learned.get(prompt.key, []):
+                if not prompt.field.has_option(option):
+                    prompt.field.add_option(option)
+                    prompt.learned.add(option)
+
+    # if creating a trial, add catalogued study names
+    if kind == 'trial':
+        # first prompt should be for name of study
+        prompts[0].field.add_options(catalog.studies())
+
+    # if transferring files, add catalogued study/trial names
+    elif kind == 'file':
+        # first prompt should be for name of study/trial
+        prompts[0].field.add_options(catalog.paths())
+
+    return config, prompts
+
+
 def run():
     
-    # set config dir based on $XROMM_CONFIG env variable if present
-    # otherwise look for a `config` dir in current working dir
-    cwd_config = os.path.join(os.getcwd(), 'config')
-    if not os.path.isfile(cwd_config):
-        pkg_dir = os.path.dirname(os.path.abspath(__file__))
-        cwd_config = os.path.join(pkg_dir, 'config')
-    CONFIG_DIR = os.environ.get('XROMM_CONFIG', cwd_config)
-    
     # setup the argument parser
     parser = argparse.ArgumentParser(version="0.1", description=__doc__)
     parser.add_argument('--required', 
@@ -44,6 +101,10 @@ def run():
     parser.add_argument('--verbose', 
                         action="store_true", 
                         help="Provide additional info when prompting")
+    parser.add_argument('--manifest', 
+                        metavar="FILE",
+                        help="Create records from the rows of a CSV or JSONL "
+                             "file instead of prompting")
     
     group = parser.add_mutually_exclusive_group()
     group.add_argument('--study', 
@@ -52,83 +113,203 @@ def run():
     group.add_argument('--trial', 
                         action="store_true",
                         help="Create a new trial")
-    group.add_argument('file', nargs='?', help="Transfer a file")
+    group.add_argument('files', nargs='*', default=[], metavar='FILE',
+                       help="Transfer files (paths, directories or globs)")
+    group.add_argument('--watch', 
+                       metavar="DIR",
+                       help="Transfer new files written to a directory, "
+                            "in batches, until interrupted")
     group.add_argument('--healthrecord', 
                        action="store_true", 
                        help="Create a heatlh report in the Hatabase")
+    group.add_argument('--import-health', 
+                       metavar="FILE",
+                       help="Import the health records in a CSV or JSONL "
+                            "export into the local hatabase")
+    group.add_argument('--jobs', 
+                       action="store_true", 
+                       help="List the transfer tasks submitted so far")
+    group.add_argument('--monitor', 
+                       action="store_true", 
+                       help="Follow the progress of submitted transfer tasks "
+                            "until they're done (exits non-zero on faults)")
+    group.add_argument('--resume', 
+                       action="store_true", 
+                       help="Resubmit transfer tasks that were not accepted")
+    group.add_argument('--flush', 
+                       action="store_true", 
+                       help="Send any metadata left in the outbox")
+    group.add_argument('--sync-cache', 
+                       action="store_true", 
+                       help="Fetch new study and trial names from the portal")
+    group.add_argument('--startup-profile', 
+                       action="store_true", 
+                       help="Report the import time of each module")
     
     args = parser.parse_args()
 
+    if args.jobs:
+        Journal().show()
+        return
+    if args.monitor:
+        if Monitor()():
+            raise SystemExit(1)
+        return
+    if args.resume:
+        resume()
+        return
+    if args.flush:
+        if flush():
+            raise SystemExit(1)
+        return
+    if args.startup_profile:
+        raise SystemExit(run_profile())
+    if args.sync_cache:
+        catalog = Catalog()
+        try:
+            added = sync(catalog)
+        except Exception as e:
+            print "couldn't sync study/trial names: {}".format(e)
+            raise SystemExit(1)
+        print "{} new name(s): {} studies and {} trials in {}".format(
+            added, *(catalog.counts() + (catalog.path,)))
+        return
+
+    files = []                      # files to collect metadata for
+    checksums = None                # background file hashing
+    resource = None                 # resource config (if not per file)
     if args.study:
         resource = 'study.json'
     elif args.trial:
         resource = 'trial.json'
-    elif args.file:
-        resource = 'file.json'
-        mt = get_mediatype()    # get config for specific mediatype
-        try:                    # set config for selected mediatype
-            mt_config_path = os.path.join(CONFIG_DIR, 'mediatypes', mt + '.json')
-            if os.path.isfile(mt_config_path):
-                resource = os.path.join('mediatypes', mt + '.json')
-        except NameError:
-            pass                # if not found, use default file prompting
     elif args.healthrecord:
         resource = 'macaque_health_record.json'
-    else:
+    elif args.import_health:
+        if args.manifest:
+            parser.error("an export to import can't be given with a manifest")
+        resource = 'macaque_health_record.json'
+    elif args.files:
+        if args.manifest:
+            parser.error("files can't be given with a manifest")
+        files = expand_paths(args.files)
+        if not files:
+            parser.error("no files found")
+        checksums = Checksummer(files,  # hash files while prompting
+                                cache=ContentIndex())
+    elif args.watch:
+        if args.manifest:
+            parser.error("a directory to watch can't be given with a manifest")
+        if not os.path.isdir(args.watch):
+            parser.error("no such directory: {}".format(args.watch))
+    elif not args.manifest:
         parser.print_help()
         raise SystemExit
     
-    config_path = os.path.join(CONFIG_DIR, resource)        # resource config
-    cache_path  = os.path.join(CONFIG_DIR, 'cache.json')    # cached info
-        
-    config = json.load(open(config_path))   # load resource config file
-    cache = json.load(open(cache_path))     # load cached study/trial options
-    
-    
-    # supplement config with cached info if out of date
-    if config['updated_at'] < cache['updated_at']:
-    
-        # if creating a trial, add cached study names
-        if args.trial:
-            # first prompt should be for name of study
-            config['prompts'][0]['options'] = cache['studies'].keys()
-    
-        # if transferring a file, add cached study/trial names 
-        elif args.file:
-            # first prompt should be for name of study/trial
-            options = []
-            for study in cache['studies'].keys():
-                options.append(study)
-                for trial in cache['studies'][study]:
-                    options.append('{}/{}'.format(study, trial))
-            config['prompts'][0]['options'] = options
-    
-    
-    prompt = Prompter(config, verbose=args.verbose,
-                              required=args.required)   # initialize a prompter
-    prompt()                                            # prompt for input
+    bundle = Bundle()               # compiled configs from earlier runs
+    catalog = Catalog()             # known study/trial names
+    auto_sync(catalog)              # (if enabled and due)
+
+    configs = {}                    # loaded resource configs by path
+    learned = {}                    # learned options used by config path
+    kind = 'trial' if args.trial else '' if resource else 'file'
+
+    # return the loaded config (and its prompts) for a resource
+    def configure(resource):
+        config_path = os.path.join(CONFIG_DIR, resource)    # resource config
+        if config_path not in configs:
+            configs[config_path] = load_config(bundle, config_path,
+                                               catalog, kind)
+        return configs[config_path]
+
+    if args.watch:                  # transfer new files as they're written
+        Session(os.path.abspath(args.watch), configure,
+                required=args.required, verbose=args.verbose).run()
+        bundle.save()
+        return
+
+    if args.import_health:          # import health records in bulk
+        rejected = import_records(args.import_health,
+                                  lambda row: configure(resource),
+                                  required=args.required)
+        bundle.save()
+        if rejected:
+            raise SystemExit(1)
+        return
+
+    if args.manifest:               # collect input from manifest rows
+        batch, files = manifest.load(args.manifest,
+            lambda row: configure(resource or 
+                                  mediatype_resource(CONFIG_DIR, row)),
+            required=args.required, files=not resource)
+        if not batch:
+            raise SystemExit(1)
+        if files:
+            checksums = Checksummer(files, cache=ContentIndex())
+
+    else:                           # prompt for input
+        batch = []                  # collected results (one per file)
+        detected = Detector().classify(files)   # mediatype of each file
+        headers = Headers([(path, detected[path][0])  # read file headers
+                           for path in files])
+        answers = {}                # answers given so far by directory
+        for i, path in enumerate(files or [None]):
+            known = {}              # answers known for this file
+            header = {}             # values read from the file's header
+            info = {}               # file info read from it (for results)
+            if path:
+                print "\n=== {} ({} of {})".format(path, i + 1, len(files))
+                mt, candidates = detected[path]
+                if mt:
+                    print "(detected mediatype: {})".format(mt)
+                resource = file_resource(CONFIG_DIR, mt, candidates)
+
+            config, prompts = configure(resource)
+            if path:                # ask shared fields once per directory
+                mt = resource_mediatype(resource)
+                header, info = split(headers(path, mt), prompts)
+                if header:
+                    print "(read from the file: {})".format(
+                        ', '.join(sorted(header)))
+                dir = os.path.dirname(path)
+                if dir not in answers:
+                    answers[dir] = Answers.load(dir)
+                known, prompts = answers[dir].fill(prompts, mt)
+                for key in set(known) & set(header):
+                    known[key] = header[key]    # (the file's own value)
+                if known:
+                    print "(already answered: {})".format(
+                        ', '.join(sorted(known)))
+
+            prompt = Prompter(config, verbose=args.verbose,
+                                      required=args.required,
+                                      prompts=prompts,
+                                      defaults=header)      # initialize a prompter
+            prompt()                                        # prompt for input
+            if path:
+                answers[dir].remember(prompts, prompt.results['data'])
+            prompt.results['data'].update(known)
+            prompt.results.update(info)     # file_frame_count, ...
+            batch.append(prompt.results)
+            if prompt.learned:              # if learned options were used ...
+                options = learned.setdefault(
+                    os.path.join(CONFIG_DIR, resource), {})
+                for key, values in prompt.learned.items():
+                    options.setdefault(key, []).extend(values)
     
+    bundle.save()                   # keep compiled configs for next time
+
     # ok . . . with input collected, what should be done with it?
-    prompt_for_action(prompt.results, args.file)    # view/save/send/discard
-    
-    if prompt.config_revisions:                     # if new input was seen ...
-        save_json(prompt.config, config_path)       # update config
+    prompt_for_action(batch, files, checksums)      # view/save/send/discard
     
-    # cache new study/trial names
-    if args.study:                                  # if study was created ...
-        name = prompt.results['data']['name']       # name entered when prompted
-        if not name in cache['studies']:
-            cache['studies'][name] = []
-            save_json(cache, cache_path)            # update cache
+    for config_path, options in learned.items():
+        Overlay(config_path).record(options)        # learn options
     
-    elif args.trial:                                # if trial was created ...
-        study = prompt.results['data']['study']     # study name entered
-        trial = prompt.results['data']['name']      # trial name entered
-        if not study in cache['studies']:
-            cache['studies'][study] = []
-        if not trial in cache['studies'][study]:
-            cache['studies'][study].append(trial)
-            save_json(cache, cache_path)            # update cache
+    # catalog new study/trial names
+    if args.study:                                  # if studies were created ...
+        catalog.add(studies=[r['data']['name'] for r in batch])
+    elif args.trial:                                # if trials were created ...
+        catalog.add(trials=[(r['data']['study'], r['data']['name'])
+                            for r in batch])
 
 # END run()
 
@@ -0,0 +1,168 @@
+import os
+import csv
+import json
+from prompter import Validator
+
+
+# column giving the path of the file a row describes (for file records)
+FILE_COLUMN = 'file'
+
+
+def is_jsonl(path):
+    return os.path.splitext(path)[1].lower() in ('.jsonl', '.json')
+
+
+def delimiter(path):
+    return ',' if os.path.splitext(path)[1].lower() == '.csv' else '\t'
+
+
+class BadLine(dict):
+    "A manifest line that isn't a row (with its `text` and `error`)."
+    def __init__(self, line, error):
+        dict.__init__(self, text=line.rstrip('\n'))
+        self.error = error
+
+
+def read(path):
+    """
+    Stream the rows of a manifest file, yielding a `(line, row)` pair
+    for each row, where `row` is a dict of column names to values.
+
+    Manifests can be CSV (`.csv`), tab-separated (`.tsv`, `.txt`) or
+    JSON lines (`.jsonl`, `.json`: one json object per line) files.
+    Column names are matched to prompt keys, ignoring case.
+
+    A JSON line that can't be parsed, or isn't an object, is yielded
+    as a `BadLine` (holding its text) rather than a dict.
+
+    """
+    with open(path, 'rU') as f:
+        if is_jsonl(path):
+            for i, line in enumerate(f):
+                if line.strip():
+                    try:
+                        row = json.loads(line)
+                    except ValueError as e:
+                        yield i + 1, BadLine(line,
+                                             'invalid JSON ({})'.format(e))
+                        continue
+                    if not isinstance(row, dict):
+                        yield i + 1, BadLine(line, 'not a JSON object')
+                        continue
+                    yield i + 1, dict((k.strip().lower(), v)
+                                      for k, v in row.items())
+        else:
+            reader = csv.reader(f, delimiter=delimiter(path))
+            header = [name.strip().lower() for name in next(reader)]
+            for row in reader:
+                if any(row):
+                    yield reader.line_num, dict(zip(header, row))
+
+
+class Rejects:
+    """
+    Writes rejected manifest rows (with their errors) to a file in the
+    same format as the manifest, created when the first row is rejected.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.f = self.writer = None
+
+    def write(self, line, row, errors):
+        errors = '; '.join('{}: {}'.format(k, v) for k, v in errors.items())
+        if self.f is None:
+            self.f = open(self.path, 'w')
+        if is_jsonl(self.path):
+            self.f.write(json.dumps(dict(row, line=line, errors=errors)) + '\n')
+        else:
+            if self.writer is None:
+                fields = sorted(row) + ['line', 'errors']
+                self.writer = csv.DictWriter(self.f, fields,
+                                             delimiter=delimiter(self.path),
+                                             extrasaction='ignore')
+                self.writer.writeheader()
+            self.writer.writerow(dict(row, line=line, errors=errors))
+        self.count += 1
+
+    def close(self):
+        if self.f:
+            self.f.close()
+
+
+def rejects_path(path):
+    "Return the path of the reject file for the manifest at `path`."
+    root, ext = os.path.splitext(path)
+    return root + '.rejects' + ext
+
+
+def rows(path, configure, rejects, required=False, files=False):
+    """
+    Stream a results dict for each valid row of the manifest at `path`,
+    yielding a `(results, file_path)` pair for each (where `file_path`
+    is None unless `files` is true).
+
+    `configure(row)` should return the loaded resource config for a
+    row and its Prompt objects.  Each value in the row is validated
+    with the same rules used when prompting for it (by a `Validator`
+    compiled once per config).  Rows with errors are written to
+    `rejects` (a `Rejects` writer).
+
+    If `files` is true, each row describes a file, whose path must be
+    given in its `file` column (relative to the manifest's directory).
+
+    """
+    root = os.path.dirname(os.path.abspath(path))
+    validators = {}             # id(prompts) -> (prompts, Validator)
+    for line, row in read(path):
+        if isinstance(row, BadLine):
+            rejects.write(line, row, {'row': row.error})
+            continue
+        config, prompts = configure(row)
+        if id(prompts) not in validators:
+            validators[id(prompts)] = prompts, Validator(
+                [p.field for p in prompts if p.require or not required])
+        data, errors = validators[id(prompts)][1].validate(row)
+        results = {
+            'resource': config['key'],
+            'version':  config['version'],
+            'data': data
+        }
+        file_path = None
+        if files:
+            file_path = os.path.join(root, row.get(FILE_COLUMN) or '')
+            if not os.path.isfile(file_path):
+                errors[FILE_COLUMN] = 'no such file'
+        if errors:
+            rejects.write(line, row, errors)
+            continue
+        yield results, file_path and os.path.abspath(file_path)
+
+
+def load(path, configure, required=False, files=False):
+    """
+    Build a results dict for each row of the manifest at `path` (see
+    `rows`).  Rows with errors are written to the reject file (see
+    `rejects_path`).
+
+    Returns the list of results for the valid rows and the list of
+    the files they describe (empty unless `files` is true).
+
+    """
+    batch = []
+    paths = []
+    rejects = Rejects(rejects_path(path))
+    if os.path.exists(rejects.path):
+        os.remove(rejects.path)             # from an earlier import
+    for results, file_path in rows(path, configure, rejects,
+                                   required=required, files=files):
+        batch.append(results)
+        if files:
+            paths.append(file_path)
+    rejects.close()
+
+    print "{} valid row(s) read from {}".format(len(batch), path)
+    if rejects.count:
+        print "{} row(s) rejected: see {}".format(rejects.count, rejects.path)
+    return batch, paths
@@ -1,7 +1,8 @@
+import os
 from prompter import Prompt
 
-# prompt user for a particular mediatype
-def get_mediatype(testing=False):
+# prompt user for a particular mediatype (one of the `candidates`, if given)
+def get_mediatype(testing=False, candidates=None):
     config = {  
         "key": "mediatype",
         "text": "What type of file is this?",
@@ -24,12 +25,42 @@ def get_mediatype(testing=False):
         "store": [],
         "regex": ""
     }
+    if candidates:                              # offer just the candidates
+        config['options'] = [o for o in config['options']
+                             if o.split(' ')[0] in candidates + ['other']]
+        config['example'] = config['options'][0]
     prompt = Prompt(config)                     # create prompt based on config
     input = prompt(fixed=True, testing=testing) # prompt for input
     choice = input.split(' ')[0]                # get mediatype from input
     return choice
 
 
+def file_resource(config_dir, mt=None, candidates=None):
+    """
+    Return the path of the resource config to use for a file of the
+    mediatype `mt` (relative to `config_dir`), prompting for the 
+    mediatype (one of the `candidates`, if given) if not given.
+
+    """
+    resource = 'file.json'
+    mt = mt or get_mediatype(candidates=candidates)  # config for mediatype
+    mt_config_path = os.path.join(config_dir, 'mediatypes', mt + '.json')
+    if os.path.isfile(mt_config_path):  # set config for selected mediatype
+        resource = os.path.join('mediatypes', mt + '.json')
+    return resource             # if not found, use default file prompting
+
+
+def resource_mediatype(resource):
+    "Return the mediatype of a file resource config path (None for others)."
+    dir, name = os.path.split(resource)
+    return os.path.splitext(name)[0] if dir == 'mediatypes' else None
+
+
+def mediatype_resource(config_dir, row):
+    "Return the resource config for a manifest `row` describing a file."
+    return file_resource(config_dir, row.get('mediatype') or 'other')
+
+
 if __name__ == '__main__':
 
     # prompt user to select appropriate mediatype
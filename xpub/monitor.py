@@ -0,0 +1,215 @@
+"""
+Monitoring of the transfer tasks submitted by `xpub`.
+
+Run `xpub --monitor` to follow the progress of the tasks recorded in
+the journal until they're done.  It exits non-zero if any of them
+failed or reported faults.
+
+"""
+import time
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+from journal import Journal
+from dedup import ContentIndex
+
+
+POLL = 2                # seconds between polls of a task (at first)
+MAX_POLL = 60           # most seconds between polls (when backing off)
+WORKERS = 8             # tasks polled concurrently
+
+# globus statuses of tasks that are done
+FINAL = ('SUCCEEDED', 'FAILED')
+
+MB = 1000.0 ** 2
+
+
+def eta(seconds):
+    "Return a number of seconds as `h:mm:ss` (or `?` if unknown)."
+    if seconds is None:
+        return '?'
+    return str(timedelta(seconds=int(seconds)))
+
+
+class Progress:
+    "The latest known progress of a transfer task."
+    def __init__(self, task, now):
+        self.task_id = task['task_id']
+        self.submission_id = task['submission_id']
+        self.status = task['status']
+        self.expected = task['bytes'] or 0      # (from the journal)
+        self.files = task['files']
+        self.bytes = 0
+        self.files_done = 0
+        self.files_failed = 0
+        self.faults = 0
+        self.rate = None                        # bytes per second
+        self.error = None                       # of the last poll
+        self.first = None                       # (time, bytes) first seen
+        self.interval = POLL
+        self.due = now
+
+    @property
+    def done(self):
+        return self.status in FINAL
+
+    def update(self, data, now):
+        """
+        Update the progress from a globus task document `data` polled at
+        `now`, returning True if anything changed.
+
+        """
+        before = self.status, self.bytes, self.files_done, self.faults
+        self.status = data.get('status', self.status)
+        self.bytes = data.get('bytes_transferred') or 0
+        self.files = data.get('files') or self.files
+        self.files_done = (data.get('files_transferred') or 0) + \
+                          (data.get('files_skipped') or 0)
+        self.files_failed = data.get('subtasks_failed') or 0
+        self.faults = data.get('faults') or 0
+        if self.first is None:
+            self.first = now, self.bytes
+        if data.get('effective_bytes_per_second'):
+            self.rate = float(data['effective_bytes_per_second'])
+        elif now > self.first[0]:
+            self.rate = (self.bytes - self.first[1]) / (now - self.first[0])
+        self.error = None
+        return (self.status, self.bytes, self.files_done,
+                self.faults) != before
+
+    def eta(self):
+        "Return the seconds left (None if unknown)."
+        if self.done:
+            return 0
+        if self.rate and self.expected:
+            return max(self.expected - self.bytes, 0) / self.rate
+        return None
+
+    def line(self):
+        "Return a line summarizing the progress."
+        return ("{:<36}  {:<9}  {:>9.1f} of {:.1f} MB  {:>7.2f} MB/s  "
+                "{}/{} files  {} failed  {} fault(s)  ETA {}{}").format(
+            self.task_id, self.status, self.bytes / MB, self.expected / MB,
+            (self.rate or 0) / MB, self.files_done, self.files,
+            self.files_failed, self.faults, eta(self.eta()),
+            '  ({})'.format(self.error) if self.error else '')
+
+
+class Monitor:
+    """
+    Polls the transfer tasks submitted by `xpub` (those with a globus
+    task id in the journal that aren't done) until they're all done,
+    printing their progress and the overall progress.
+
+    Tasks are polled concurrently, each at its own interval, which is
+    backed off (doubled, up to `MAX_POLL`) while a task makes no
+    progress or can't be polled, and reset once it progresses.  The
+    final status of each task is recorded in the journal, and the
+    content of the files of failed tasks is dropped from the content
+    `index` (so they aren't skipped as duplicates when sent again).
+
+    `api` is the globus transfer api client to poll with (connected
+    when first needed if not given).  `clock` and `sleep` can be given
+    to run without waiting (e.g. in tests).
+
+    """
+    def __init__(self, journal=None, api=None, clock=time.time,
+                       sleep=time.sleep, workers=WORKERS, index=None):
+        self.journal = journal or Journal()
+        self.index = index
+        self.api = api
+        self.clock = clock
+        self.sleep = sleep
+        self.workers = workers
+
+    def connect(self, tasks):
+        from action import connect
+        endpoints = set()
+        for task in tasks:
+            endpoints.update([task['source'], task['destination']])
+        return connect(*endpoints)
+
+    def poll(self, progress):
+        "Poll a task, returning its task document (or the error raised)."
+        try:
+            code, reason, data = self.api.task(progress.task_id)
+            return data
+        except Exception as e:              # api or network error
+            return e
+
+    def __call__(self):
+        """
+        Monitor the tasks until they're all done (or monitoring is
+        interrupted), returning the number of tasks that failed, that
+        reported faults, or that aren't done.
+
+        """
+        tasks = [task for task in self.journal.tasks()
+                 if task['task_id'] and task['status'] not in FINAL]
+        if not tasks:
+            print "no transfer tasks to monitor"
+            return 0
+        self.api = self.api or self.connect(tasks)
+        now = self.clock()
+        progress = [Progress(task, now) for task in tasks]
+        pool = ThreadPool(max(1, min(self.workers, len(progress))))
+        try:
+            while True:
+                due = [p for p in progress if not p.done and p.due <= now]
+                polled = pool.map(self.poll, due)
+                now = self.clock()
+                for p, data in zip(due, polled):
+                    self.update(p, data, now)
+                if due:
+                    self.show(progress)
+                active = [p for p in progress if not p.done]
+                if not active:
+                    break
+                self.sleep(max(min(p.due for p in active) - now, 0))
+                now = self.clock()
+        except KeyboardInterrupt:
+            print "\nstopped monitoring ({} task(s) not done)".format(
+                len([p for p in progress if not p.done]))
+        finally:
+            pool.close()
+
+        faulty = [p for p in progress if not p.done or
+                  p.status == 'FAILED' or p.files_failed or p.faults]
+        for p in faulty:
+            print "task {} {} ({} file(s) failed, {} fault(s))".format(
+                p.task_id, p.status.lower(), p.files_failed, p.faults)
+        return len(faulty)
+
+    def update(self, progress, data, now):
+        "Update the `progress` of a task from the result of polling it."
+        if isinstance(data, Exception):
+            progress.error = str(data)
+            progress.interval = min(progress.interval * 2, MAX_POLL)
+        elif progress.update(data, now):
+            progress.interval = POLL
+            if progress.done:
+                self.journal.update(progress.submission_id,
+                                    status=progress.status,
+                                    message=data.get('nice_status'))
+                if progress.status == 'FAILED':
+                    self.index = self.index or ContentIndex()
+                    self.index.failed(progress.task_id)
+        else:
+            progress.interval = min(progress.interval * 2, MAX_POLL)
+        progress.due = now + progress.interval
+
+    def show(self, progress):
+        "Print the progress of each task and overall."
+        print
+        for p in progress:
+            print p.line()
+        done = sum(p.bytes for p in progress)
+        expected = sum(p.expected for p in progress)
+        rate = sum(p.rate or 0 for p in progress if not p.done)
+        left = [p.eta() for p in progress]
+        print ("overall: {:.1f} of {:.1f} MB  {:.2f} MB/s  {}/{} files  "
+               "{} failed  ETA {}").format(
+            done / MB, expected / MB, rate / MB,
+            sum(p.files_done for p in progress),
+            sum(p.files for p in progress),
+            sum(p.files_failed for p in progress),
+            eta(None if None in left else max(left)))
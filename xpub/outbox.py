@@ -0,0 +1,160 @@
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from client import get_client, BULK_SIZE
+from settings import state_path
+from atomic import locked, write
+
+
+WORKERS = 4                 # requests in flight when flushing
+
+
+def record_key(url, results):
+    """
+    Return the idempotency key for sending `results` to `url`.
+
+    The key is derived from the content of the record, so a record
+    that is queued (or retried) more than once keeps the same key and
+    the portal can recognize it as a duplicate.
+
+    """
+    data = dict((k, v) for k, v in results.items()
+                if k not in ('updated_at', 'idempotency_key'))
+    content = url + json.dumps(data, sort_keys=True)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class Outbox:
+    """
+    A durable outbox for results to be sent to the portal.
+
+    The outbox is an append-only spool file with one json line per
+    event: a `put` line for each queued record and an `ack` line
+    for each record the portal has accepted.  Records are sent when
+    the outbox is flushed, and stay queued until they're acked.
+
+    Appends and compactions hold the spool file's lock, so sessions
+    sharing the outbox don't lose each other's entries.
+
+    """
+    def __init__(self, path=None):
+        self.path = path or state_path('outbox.jsonl')
+        self.lock = threading.Lock()
+
+    def append(self, entries):
+        "Append `entries` to the spool file, syncing them to disk."
+        with self.lock, locked(self.path):
+            with open(self.path, 'a') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def read(self):
+        "Return a dict of queued records and a set of acked keys."
+        records = OrderedDict()
+        acked = set()
+        if not os.path.isfile(self.path):
+            return records, acked
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:          # partially written line
+                    continue
+                if entry['op'] == 'put':
+                    records[entry['key']] = entry
+                elif entry['op'] == 'ack':
+                    acked.add(entry['key'])
+        return records, acked
+
+    def pending(self):
+        "Return the list of queued records not yet acked."
+        records, acked = self.read()
+        return [r for key, r in records.items() if key not in acked]
+
+    def put(self, url, batch):
+        """
+        Queue each results dict in `batch` to be sent to `url`,
+        skipping any already in the outbox.  Returns the number of
+        records queued.
+
+        """
+        records, acked = self.read()
+        entries = []
+        for results in batch:
+            key = record_key(url, results)
+            if key in records:
+                continue
+            records[key] = True
+            entries.append({
+                'op': 'put',
+                'key': key,
+                'url': url,
+                'data': dict(results, idempotency_key=key),
+                'created_at': datetime.now().isoformat() + 'Z'
+            })
+        self.append(entries)
+        return len(entries)
+
+    def flush(self, client=None, workers=WORKERS, size=BULK_SIZE, keys=None):
+        """
+        Send all pending records (or just those with the given `keys`),
+        posting bulk requests of up to `size` records per url
+        concurrently over `workers` threads.  Records that are accepted
+        are acked.  Returns the number of records sent and the number
+        (of those to be sent) still pending.
+
+        """
+        client = client or get_client()
+        pending = self.pending()
+        if keys is not None:
+            keys = set(keys)
+            pending = [r for r in pending if r['key'] in keys]
+        chunks = []                         # (url, records) per request
+        by_url = OrderedDict()
+        for record in pending:
+            by_url.setdefault(record['url'], []).append(record)
+        for url, records in by_url.items():
+            for i in range(0, len(records), size):
+                chunks.append((url, records[i:i + size]))
+
+        def send(chunk):
+            url, records = chunk
+            try:
+                if len(records) == 1:
+                    key = records[0]['key']
+                    client.post(url, records[0]['data'],
+                                headers={'Idempotency-Key': key})
+                else:
+                    client.post(url, [r['data'] for r in records])
+            except Exception as e:          # http or connection error
+                print "failed sending", len(records), "record(s) to", url
+                print "   ", e
+                return 0
+            self.append([{'op': 'ack', 'key': r['key']} for r in records])
+            print "sent", len(records), "record(s) to", url
+            return len(records)
+
+        if not chunks:
+            return 0, 0
+        pool = ThreadPool(min(workers, len(chunks)))
+        try:
+            sent = sum(pool.map(send, chunks))
+        finally:
+            pool.close()
+        if sent == len(pending):
+            self.compact()
+        return sent, len(pending) - sent
+
+    def compact(self):
+        "Drop acked records from the spool file."
+        with self.lock, locked(self.path):
+            records, acked = self.read()
+            pending = [r for key, r in records.items() if key not in acked]
+            write(self.path, ''.join(json.dumps(record) + '\n'
+                                     for record in pending))
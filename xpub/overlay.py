@@ -0,0 +1,131 @@
+import os
+import json
+import time
+from settings import CONFIG_DIR, state_path
+from atomic import locked, write
+
+
+# most learned options kept per prompt (the most used), 0 for no limit
+MAX_OPTIONS = int(os.environ.get('XROMM_LEARNED_MAX', 0))
+
+# days a learned option is kept after it was last used, 0 for ever
+MAX_AGE = int(os.environ.get('XROMM_LEARNED_DAYS', 0))
+
+COMPACT_LINES = 1000    # repeated lines in the log before it's compacted
+
+
+def overlay_path(config_path):
+    "Return the path of the overlay log for the config at `config_path`."
+    name = os.path.relpath(config_path, CONFIG_DIR)
+    name = os.path.splitext(name)[0].replace(os.sep, '.')
+    return state_path(os.path.join('learned', name + '.jsonl'))
+
+
+class Overlay:
+    """
+    An append-only log of the options learned for the list prompts of
+    a resource config (i.e. new values typed when prompting), which
+    are merged into the config's prompts when it's loaded.  The config
+    file itself is never rewritten.
+
+    The log has a json line per use of a learned option, such as ...
+
+        {"key": "study", "option": "pig-study", "count": 1, "at": 1441100000}
+
+    Uses of an option are summed when the log is read, so options are
+    offered most used first.  Options can be capped to the `max_options`
+    most used per prompt and expired `max_age` days after their last
+    use.  Once the log has `COMPACT_LINES` more lines than options, it's
+    compacted to a line per option (dropping capped and expired options).
+
+    """
+    def __init__(self, config_path, path=None, max_options=MAX_OPTIONS,
+                       max_age=MAX_AGE):
+        self.path = path or overlay_path(config_path)
+        self.max_options = max_options
+        self.max_age = max_age
+
+    def read(self):
+        """
+        Return a dict of prompt keys to dicts of their learned options
+        to `[count, last used]`, and the number of lines in the log.
+
+        """
+        learned = {}
+        lines = 0
+        if not os.path.isfile(self.path):
+            return learned, lines
+        with open(self.path) as f:
+            for line in f:
+                lines += 1
+                try:
+                    entry = json.loads(line)
+                except ValueError:          # partially written line
+                    continue
+                stats = learned.setdefault(entry['key'], {}).setdefault(
+                    entry['option'], [0, 0])
+                stats[0] += entry.get('count', 1)
+                stats[1] = max(stats[1], entry['at'])
+        return learned, lines
+
+    def ranked(self, options):
+        """
+        Return the learned `options` (a dict of options to their use
+        stats) that are kept, as a list of `(option, count, last used)`
+        tuples, most used first.
+
+        """
+        ranked = sorted(((option, count, at)
+                         for option, (count, at) in options.items()),
+                        key=lambda r: (-r[1], -r[2]))
+        if self.max_age:
+            oldest = time.time() - self.max_age * 24 * 60 * 60
+            ranked = [r for r in ranked if r[2] >= oldest]
+        if self.max_options:
+            ranked = ranked[:self.max_options]
+        return ranked
+
+    def options(self):
+        "Return a dict of prompt keys to their learned options."
+        learned, lines = self.read()
+        return dict((key, [option for option, count, at
+                           in self.ranked(options)])
+                    for key, options in learned.items())
+
+    def record(self, learned):
+        """
+        Record a use of each option in `learned` (a dict of prompt keys
+        to lists of options), compacting the log if it's grown long.
+
+        """
+        now = int(time.time())
+        entries = [{'key': key, 'option': option, 'count': 1, 'at': now}
+                   for key, options in sorted(learned.items())
+                   for option in options]
+        if not entries:
+            return
+        dir = os.path.dirname(self.path)
+        if not os.path.isdir(dir):
+            try:
+                os.makedirs(dir)
+            except OSError:                 # (made by another session)
+                pass
+        with locked(self.path):
+            with open(self.path, 'a') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        learned, lines = self.read()
+        if lines - sum(map(len, learned.values())) >= COMPACT_LINES:
+            self.compact()              # (once there are many repeats)
+
+    def compact(self):
+        "Rewrite the log with a line per kept option."
+        with locked(self.path):
+            learned, lines = self.read()
+            write(self.path, ''.join(
+                json.dumps({'key': key, 'option': option,
+                            'count': count, 'at': at}) + '\n'
+                for key in sorted(learned)
+                for option, count, at in self.ranked(learned[key])))
@@ -0,0 +1,90 @@
+import os
+import glob
+import json
+from datetime import datetime, timedelta
+from settings import CONFIG_DIR
+
+
+# globus sync levels: transfer a file unless the destination file ...
+SYNC_LEVELS = {
+    'exists': 0,        # exists
+    'size': 1,          # has the same size
+    'mtime': 2,         # is at least as new (and the same size)
+    'checksum': 3       # has the same checksum
+}
+
+# keys of a transfer profile (the `transfer` dict of a resource config)
+PROFILE_KEYS = ('sync_level', 'verify_checksum', 'encrypt_data',
+                'deadline', 'preserve_timestamp')
+
+
+def transfer_options(profile):
+    """
+    Return the options of a globus `Transfer` for a transfer `profile`,
+    a dict which may give ...
+
+      `sync_level`         - only transfer files that have changed, by
+                             `exists`, `size`, `mtime` or `checksum`
+      `verify_checksum`    - true to verify checksums after transfer
+      `encrypt_data`       - true to encrypt data in transit
+      `deadline`           - hours a task has to complete
+      `preserve_timestamp` - true to keep file modification times
+
+    """
+    for key in profile:
+        if key not in PROFILE_KEYS:
+            msg = '`{}` | transfer profiles can only give: {}'
+            raise ValueError(msg.format(key, ', '.join(PROFILE_KEYS)))
+    options = dict((k, v) for k, v in profile.items() if v is not None)
+    if 'sync_level' in options:
+        level = options['sync_level']
+        if level not in SYNC_LEVELS:
+            msg = 'sync_level={} | `sync_level` should be one of: {}'
+            raise ValueError(msg.format(level, ', '.join(sorted(SYNC_LEVELS))))
+        options['sync_level'] = SYNC_LEVELS[level]
+    if 'deadline' in options:
+        options['deadline'] = deadline(options['deadline'])
+    return options
+
+
+def deadline(hours):
+    "Return the globus deadline of a task that has `hours` to complete."
+    deadline = datetime.utcnow() + timedelta(hours=hours)
+    return deadline.strftime('%Y-%m-%d %H:%M:%S+00:00')
+
+
+def resume_options(options):
+    """
+    Return the options of a journaled task for resubmitting it: its
+    deadline is recomputed from the hours it was given (those recorded
+    without the hours keep their deadline, unless it has passed).
+
+    """
+    options = dict(options)
+    hours = options.pop('deadline_hours', None)
+    if hours is not None:
+        options['deadline'] = deadline(hours)
+    elif options.get('deadline') and options['deadline'] <= deadline(0):
+        del options['deadline']             # (globus would reject it)
+    return options
+
+
+def load_profiles(config_dir=CONFIG_DIR):
+    """
+    Return the transfer profiles given by the file configs in
+    `config_dir`, keyed by the resource key of each config.  The profile
+    in `file.json` is the default for every mediatype, and each setting
+    can be overridden by the profile of a mediatype's config.
+
+    """
+    def load(path):
+        return json.load(open(path)) if os.path.isfile(path) else {}
+
+    default = load(os.path.join(config_dir, 'file.json'))
+    profiles = {default.get('key', 'file'): default.get('transfer', {})}
+    for path in sorted(glob.glob(os.path.join(config_dir, 'mediatypes',
+                                              '*.json'))):
+        config = load(path)
+        profiles[config['key']] = dict(default.get('transfer', {}),
+                                       **config.get('transfer', {}))
+    return profiles
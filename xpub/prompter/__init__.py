@@ -1 +1,2 @@
 from .main import Prompter, Prompt
+from .validator import Validator, Field
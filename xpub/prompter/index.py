@@ -0,0 +1,101 @@
+import re
+import difflib
+
+
+# characters separating the words of an option (e.g. `pig-study/trial-1`)
+separators = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def words(text):
+    "Return the (lowercased) words of `text`."
+    return [w for w in separators.split(text.lower()) if w]
+
+
+class OptionIndex:
+    """
+    An index of the options of a list prompt, for narrowing thousands
+    of options down to those matching a typed fragment.
+
+    Each option is split into words, and each distinct word is mapped
+    to the options containing it.  The words themselves are kept in a
+    prefix trie, so the options matching a fragment are those with a
+    word starting with each word of the fragment.  A fragment word that
+    doesn't start any word is matched loosely against similar words
+    instead (to allow for typos).
+
+    Options are only ever appended to the prompt's list, so the index
+    catches up with new options incrementally.
+
+    """
+    def __init__(self, options):
+        self.options = options      # (the prompt's list of options)
+        self.count = 0              # number of options indexed
+        self.postings = {}          # word -> indices of options with it
+        self.trie = {}              # char -> node, None -> words below
+        self.update()
+
+    def update(self):
+        "Index any options added since the last update."
+        for i in range(self.count, len(self.options)):
+            for word in set(words(self.options[i])):
+                if word not in self.postings:
+                    self.postings[word] = []
+                    self.insert(word)
+                self.postings[word].append(i)
+        self.count = len(self.options)
+
+    def insert(self, word):
+        "Add a new `word` to the trie."
+        node = self.trie
+        for c in word:
+            node = node.setdefault(c, {})
+            node.setdefault(None, []).append(word)
+
+    def starting(self, prefix):
+        "Return the indexed words starting with `prefix`."
+        node = self.trie
+        for c in prefix:
+            node = node.get(c)
+            if node is None:
+                return []
+        return node.get(None, [])
+
+    def similar(self, word):
+        "Return the indexed words similar to (e.g. misspellings of) `word`."
+        return difflib.get_close_matches(word, self.postings, n=10, cutoff=0.7)
+
+    def search(self, fragment):
+        """
+        Return the options matching `fragment`, best matches first:
+        those starting with the fragment, then those with words starting
+        with each of its words, then loose matches (each in the order
+        of the options).
+
+        """
+        self.update()
+        fragment = fragment.strip().lower()
+        if not fragment:
+            return self.options[:]
+
+        matches = None              # indices of options matching so far
+        loose = False
+        for word in words(fragment):
+            found = self.starting(word)
+            if not found:
+                found = self.similar(word)
+                loose = True
+            ids = set()
+            for w in found:
+                ids.update(self.postings[w])
+            matches = ids if matches is None else matches & ids
+            if not matches:
+                return []
+        if matches is None:         # (fragment was all separators)
+            return self.options[:]
+
+        def rank(i):
+            if loose:
+                return 2, i
+            return (0 if self.options[i].lower().startswith(fragment)
+                      else 1), i
+        return [self.options[i] for i in sorted(matches, key=rank)]
@@ -1,5 +1,6 @@
-import re
 import datetime 
+from .validator import Field, to_number, yyyy_mm_dd
+from .index import OptionIndex
 
 
 class Prompt:
@@ -7,6 +8,18 @@ class Prompt:
     Returns a Prompt object given a prompt dictionary.
     
     """
+    # messages presented when input of each type is invalid
+    retry_messages = {
+        'bool': "\nPlease specify `y` for yes or `n` for no!",
+        'number': "\nInvalid numeric input. Please re-enter value",
+        'date': "\nInvalid date input. Please use `YYYY-MM-DD` format.",
+        'text': "Invalid input"
+    }
+
+    page_size = 20      # options listed at a time (when there are more)
+    index = None        # index of options, built when first needed
+    per_file = False    # true if asked for each file (not once per session)
+
     def __init__(self, p): 
         """
         Initialize a Prompt object.
@@ -21,6 +34,8 @@ class Prompt:
           `type`    - indicating type of prompt
           `store`   - array of backend persistence targets
           `regex`   - optional regex pattern to validate input
+          `per_file` - optional, true if the input differs for each file
+                       (so it's asked for each file in a session)
 
         The value of `p['type']` should be a string indicating the 
         type of the input value expected. The type options are ...
@@ -68,14 +83,18 @@ class Prompt:
             msg += ', '.join(type_options)
             raise ValueError(msg)
 
-        # regex for checking date format
-        self.yyyy_mm_dd = re.compile(r'^20\d\d-[0-2]\d-[0-3]\d$')
-
         # make the dict keys of `p` accessible as properties: `self.name`
         self.__dict__.update(**p)
 
+        # compile the validation rules for input once, up front
+        self.field = Field(p)
+        self.options = self.field.options
+        self.pattern = self.field.pattern
+        self.learned = set()    # options learned from input (not config)
+
 
-    def __call__(self, verbose=False, testing=False, fixed=False):
+    def __call__(self, verbose=False, testing=False, fixed=False,
+                       default=None):
         """
         Run the prompt and return input response (or the supplied
         prompt example if testing).
@@ -88,6 +107,9 @@ class Prompt:
         If `fixed` is true, users can only specify one of the
         enumerated options for prompts of type `list`.
 
+        If a `default` is given (e.g. a value read from the file), it's
+        returned if the user just hits return (to confirm it).
+
         """
         if testing:
             return self.example
@@ -102,56 +124,51 @@ class Prompt:
             text += " (`y` or `n`)"
 
         # for date inputs, provide today's date as default option
-        if self.type == 'date':
+        if self.type == 'date' and default is None:
             text += " (hit return for `{}`)".format(self.today())
 
+        # offer a known value to confirm (unless the options are paged)
+        if default is not None and len(self.options) <= self.page_size:
+            text += " (hit return for `{}`)".format(default)
+        else:
+            default = None
+
         print("\n{}\n".format(text))
 
         # if prompt has options, enumerate them
         if self.options:
-            return self.enumerate_options(fixed)
+            return self.enumerate_options(fixed, default)
 
         # ... otherwise, for other prompt types ...
         resp = self.get_input()
 
-        # return null response if no input given and not required
-        if not(self.require) and not(resp):
-            return None
+        if default is not None and not resp:
+            return default
 
-        # for booleans, convert y/n response to t/f
-        if self.type == 'bool':
-            if resp == 'y':
-                return True
-            elif resp == 'n':
-                return False
-            else:
-                print("\nPlease specify `y` for yes or `n` for no!")
-                return self.__call__(verbose, testing)
+        # for dates, today's date is the default
+        if self.type == 'date' and not resp:
+            return self.today()
 
-        # for numbers, convert response to a number (int or float)
-        if self.type == 'number':
-            try:
-                return self.to_number(resp)
-            except ValueError:
-                print("\nInvalid numeric input. Please re-enter value")
-                return self.__call__(verbose, testing)
+        # convert (and check) the response, e.g. y/n to t/f for booleans
+        try:
+            return self.field(resp)
+        except ValueError as e:
+            print(self.retry_messages.get(self.type, e))
+            return self.__call__(verbose, testing, default=default)
 
-        if self.type == 'date':
-            if resp and not self.valid_date(resp):
-                print("\nInvalid date input. Please use `YYYY-MM-DD` format.")
-                return self.__call__(verbose, testing)
-            else:
-                return self.today()
 
-        # finally, check response against any supplied regex pattern
-        if self.regex:
-            rgx = re.compile(self.regex)
-            if rgx.match(resp):
-                return resp
-            print("Invalid input")
-            return self.__call__(verbose, testing)
+    def validate(self, value, fixed=False):
+        """
+        Validate and convert a value given for this prompt without
+        prompting (e.g. a value read from a file), applying the same
+        rules as when prompting.  Returns the converted value, or
+        raises a ValueError describing why the value is invalid.
 
-        return resp
+        If `fixed` is true, values of `list` prompts must be one of
+        the enumerated options.
+
+        """
+        return self.field(value, fixed)
 
 
     def get_input(self):
@@ -167,12 +184,7 @@ class Prompt:
         Convert input to number.
 
         """
-        try:
-            n = int(input)
-            return n
-        except ValueError:
-            n = float(input)
-            return n
+        return to_number(input)
 
 
     def today(self):
@@ -188,17 +200,21 @@ class Prompt:
         Check that input is in valid date format (YYYY-MM-DD).
 
         """
-        return self.yyyy_mm_dd.match(input)
+        return yyyy_mm_dd.match(input)
 
 
-    def enumerate_options(self, fixed=False):
+    def enumerate_options(self, fixed=False, default=None):
         """
         Enumerate provided options for user to select.
         
         If `fixed` is True, do not include option to specify
-        alternative input.
+        alternative input.  The `default` is returned if no option
+        is chosen.
 
         """
+        if len(self.options) > self.page_size:
+            return self.search_options(fixed)
+
         options = self.options[:]           # create a copy of options
         if not fixed:
             options.append('Specify other') # permit other input
@@ -208,6 +224,9 @@ class Prompt:
         print
         resp = self.get_input()
 
+        if default is not None and not resp:
+            return default
+
         try:
             choice = int(resp)
         except ValueError:
@@ -228,7 +247,76 @@ class Prompt:
             return result
 
         print("Please specify the number of one of the listed options!")
-        return self.__call__()
+        return self.__call__(default=default)
+
+
+    def search_options(self, fixed=False):
+        """
+        Select from a long list of options by narrowing it down: typing
+        part of an option lists only the matching options, a page at a
+        time, and typing more narrows them further.  Typing `/` clears
+        the fragments typed so far (e.g. after a typo), listing all the
+        options again.  Options are numbered from 1, with `0` to specify
+        another value (unless `fixed` is True).
+
+        """
+        if self.index is None:
+            self.index = OptionIndex(self.options)
+
+        query = ''                          # fragments typed so far
+        matches = self.options[:]
+        start = 0
+        while True:
+            page = matches[start:start + self.page_size]
+            if not fixed:
+                print("\t0 - Specify other")
+            for (i, opt) in enumerate(page, start + 1):
+                print("\t{} - {}".format(i, opt))
+            print("\n({}-{} of {} options: type part of a name to narrow "
+                  "the list, `/` to start over, or hit return for "
+                  "more)".format(
+                      start + 1 if page else 0, start + len(page), 
+                      len(matches)))
+            resp = self.get_input().strip()
+
+            if not resp:                    # next page (or back to 1st)
+                start += self.page_size
+                if start >= len(matches):
+                    start = 0
+                continue
+
+            if resp == '/':                 # start over (all the options)
+                query = ''
+                matches = self.options[:]
+                start = 0
+                continue
+
+            try:
+                choice = int(resp)
+            except ValueError:
+                choice = None
+
+            if choice == 0 and not fixed:
+                print("\n{}\n".format(self.text))
+                result = self.get_input()
+                if not result and self.require:
+                    print("\nResponse required!")
+                    continue
+                return result or None
+
+            if choice is not None and 0 < choice <= len(matches):
+                return matches[choice - 1]
+
+            if self.field.has_option(resp): # an option given in full
+                return resp
+
+            found = self.index.search(query + ' ' + resp)
+            if found:
+                query += ' ' + resp
+                matches = found
+                start = 0
+            else:
+                print("\nNo options match `{}`".format(resp))
 
 
 class Prompter:
@@ -237,15 +325,27 @@ class Prompter:
     config file.
     
     """
-    def __init__(self, config, verbose=False, testing=False, required=False):
+    def __init__(self, config, verbose=False, testing=False, required=False,
+                       prompts=None, defaults=None):
         """
-        Initializes a Prompter given a path to a resource config file.
+        Initializes a Prompter given a loaded resource config file.
+
+        If `prompts` is given, it should be the list of Prompt objects
+        already built from `config['prompts']` (so they aren't built 
+        and validated again).
+
+        If `defaults` is given, it should be a dict of values already
+        known for some prompts (e.g. read from the file's header), which
+        are offered for the user to confirm.  Those known for prompts
+        that are skipped (not required) are kept as they are.
 
         """
         self.testing = testing              # true if testing
         self.verbose = verbose              # true for extra prompt info
         self.config_revisions = False       # true with new input options
+        self.learned = {}                   # learned options used by key
         self.config = config
+        self.defaults = defaults or {}      # known values by key
 
         # input will be collected for this resource under `data` key
         self.results = {
@@ -256,12 +356,16 @@ class Prompter:
 
         # try initializing prompt dicts from loaded resource config file
         try:
+            if prompts is None:
+                prompts = [Prompt(p) for p in config['prompts']]
+
             if required:                    # only include required prompts
-                self.prompts = [Prompt(p) for p in config['prompts'] 
-                                                    if p['require']]
+                for p in prompts:
+                    if not p.require and p.key in self.defaults:
+                        self.set(p.key, self.defaults[p.key])
+                prompts = [p for p in prompts if p.require]
 
-            else:                           # include all prompts
-                self.prompts = [Prompt(p) for p in config['prompts']]
+            self.prompts = prompts
 
         except ValueError, KeyError:
             err = "\nError initializing prompt dicts in {} config!\n"
@@ -273,14 +377,19 @@ class Prompter:
         Run each prompt and set value of each key to the collected input.
         
         """
-        for i, prompt in enumerate(self.prompts):
-            result = prompt(testing=self.testing)
-
-            # check for new input options to cache
-            if result and prompt.type == 'list' \
-                      and result not in prompt.options:
-                self.config['prompts'][i]['options'].append(result)
-                self.config_revisions = True
+        for prompt in self.prompts:
+            result = prompt(testing=self.testing,
+                            default=self.defaults.get(prompt.key))
+
+            # check for new input options to learn, and note each use
+            # of a learned option (so they can be ranked by use)
+            if result and prompt.type == 'list':
+                if not prompt.field.has_option(result):
+                    prompt.field.add_option(result)
+                    prompt.learned.add(result)
+                    self.config_revisions = True
+                if result in prompt.learned:
+                    self.learned.setdefault(prompt.key, []).append(result)
                 
             self.set(prompt.key, result)
 
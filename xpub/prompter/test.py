@@ -2,6 +2,8 @@ import os
 import json
 from nose.tools import raises
 from .main import Prompt, Prompter
+from .validator import Validator, Field
+from .index import OptionIndex
 
 # valid prompt dicts of various types for testing
 valid_prompt_dicts = {
@@ -276,3 +278,159 @@ def test_prompter_required():
     prompt()
     print prompt.results
     assert prompt.results == expected
+
+def test_validate():
+    """Testing validation of values given without prompting"""
+    prompt = Prompt(valid_prompt_dicts['public'])
+    assert prompt.validate('y') is True
+    assert prompt.validate('No') is False
+    assert prompt.validate(True) is True
+
+    prompt = Prompt(valid_prompt_dicts['years'])
+    assert prompt.validate(' 5 ') == 5
+    assert prompt.validate(2.5) == 2.5
+
+    prompt = Prompt(valid_prompt_dicts['leader'])
+    assert prompt.validate('Someone Else') == 'Someone Else'
+    assert prompt.validate('Callum Ross', fixed=True) == 'Callum Ross'
+
+    prompt = Prompt(valid_prompt_dicts['study'])
+    assert prompt.validate('pig-study') == 'pig-study'
+
+    trial_config = json.load(open(os.path.join(CONFIG_DIR, 'trial.json')))
+    date = Prompt(trial_config['prompts'][3])
+    assert date.validate('2015-04-28') == '2015-04-28'
+    notes = Prompt(trial_config['prompts'][4])
+    assert notes.validate('') is None, "optional values can be left out"
+
+def test_validate_err():
+    """Testing validation errors"""
+    invalid = [
+        ('public', 'maybe'),
+        ('years', 'five'),
+        ('leader', 'Someone Else'),     # (when fixed)
+        ('study', 'a'),                 # doesn't match `\w{3}`
+        ('study', ''),                  # required
+    ]
+    errors = 0
+    for name, value in invalid:
+        try:
+            Prompt(valid_prompt_dicts[name]).validate(value, fixed=True)
+        except ValueError:
+            errors += 1
+    assert errors == len(invalid), "each value should raise a ValueError"
+
+def test_validator():
+    """Testing validation of a batch of records against a config"""
+    years = dict(valid_prompt_dicts['years'], require=False)
+    config = {'key': 'study', 'version': '1',
+              'prompts': [valid_prompt_dicts['study'],
+                          valid_prompt_dicts['leader'],
+                          valid_prompt_dicts['public'], years]}
+    validator = Validator.compile(config)
+    records = [
+        {'Name': 'pig-study', 'leader': 'Callum Ross', 'meta_public': 'y'},
+        {'name': 'a', 'leader': 'Someone Else', 'years': 'two',
+         'meta_public': 'maybe'},
+    ]
+    (data, errors), (_, bad) = validator.validate_batch(records, fixed=True)
+    assert errors == {}
+    assert data == {'name': 'pig-study', 'leader': 'Callum Ross',
+                    'meta_public': True, 'years': None}
+    assert sorted(bad) == ['leader', 'meta_public', 'name', 'years'], \
+           "each invalid field should have an error"
+
+    required = Validator.compile(config, required=True)
+    assert [f.key for f in required.fields] == ['name', 'leader',
+                                                'meta_public']
+
+    leader = validator.fields[1]
+    assert leader.has_option('Callum Ross')
+    leader.add_option('Someone Else')
+    assert leader.has_option('Someone Else')
+    assert leader.options[-1] == 'Someone Else', "options list is updated"
+
+def test_validator_types():
+    """Testing validation of non-string values (e.g. from JSON records)"""
+    config = {'key': 'study', 'version': '1',
+              'prompts': [valid_prompt_dicts['study'],
+                          valid_prompt_dicts['public'],
+                          valid_prompt_dicts['years']]}
+    validator = Validator.compile(config)
+    data, errors = validator.validate({'name': 123, 'meta_public': True,
+                                       'years': 2})
+    assert errors == {} and data['name'] == '123'
+    data, errors = validator.validate({'name': ['pig'], 'meta_public': 1,
+                                       'years': {'n': 2}})
+    assert sorted(errors) == ['meta_public', 'name', 'years'], errors
+    date = Field({'key': 'date', 'type': 'date', 'require': True})
+    try:
+        date(20150428)
+        assert False, "a ValueError is expected"
+    except ValueError:
+        pass
+
+def test_option_index():
+    """Testing narrowing of options by a typed fragment"""
+    options = ['pig-chewing-study', 'pig-chewing-study/trial-1',
+               'cow-chewing-study/trial-1', 'cow-study/pig-trial']
+    index = OptionIndex(options)
+    assert index.search('') == options
+    assert index.search('PIG') == ['pig-chewing-study',
+                                   'pig-chewing-study/trial-1',
+                                   'cow-study/pig-trial'], \
+           "options starting with the fragment come first"
+    assert index.search('cow tri') == ['cow-chewing-study/trial-1',
+                                       'cow-study/pig-trial']
+    assert index.search('chewnig') == options[:3], "typos are allowed"
+    assert index.search('rat') == []
+
+    options.append('rat-study')
+    assert index.search('rat') == ['rat-study'], "new options are indexed"
+
+def test_search_options():
+    """Testing selection from a long, paged list of options"""
+    options = ['study-{}/trial-{}'.format(s, t)
+               for s in range(20) for t in range(3)]
+    p = dict(valid_prompt_dicts['leader'], options=options)
+
+    prompt = Prompt(p)
+    prompt.get_input = iter(['', '25']).next    # next page, then choose
+    assert prompt() == options[24]
+
+    prompt = Prompt(p)
+    prompt.get_input = iter(['study-7', 'trial-2', '1']).next
+    assert prompt() == 'study-7/trial-2'
+
+    prompt = Prompt(p)
+    prompt.get_input = iter(['nope', '0', 'study-99']).next
+    assert prompt() == 'study-99', "other values can be specified"
+
+    prompt = Prompt(p)
+    prompt.get_input = iter(['study-7', 'trail-2', '/', 'study-8',
+                             'trial-1', '1']).next
+    assert prompt() == 'study-8/trial-1', "`/` starts the search over"
+
+def test_default():
+    """Testing confirmation of known values"""
+    prompt = Prompt(valid_prompt_dicts['leader'])
+    prompt.get_input = iter(['']).next
+    assert prompt(default='Callum Ross') == 'Callum Ross'
+    prompt.get_input = iter(['1']).next
+    assert prompt(default='Callum Ross') == 'Kazutaka Takashi'
+
+    prompt = Prompt(valid_prompt_dicts['study'])
+    prompt.get_input = iter(['']).next
+    assert prompt(default='rat-study') == 'rat-study'
+
+    prompter = Prompter({'key': 'study', 'version': '1',
+                         'prompts': [valid_prompt_dicts['study'],
+                                     dict(valid_prompt_dicts['study'],
+                                          key='other', require=False)]},
+                        required=True, defaults={'name': 'a-study',
+                                                 'other': 'b-study'})
+    prompter.prompts[0].get_input = iter(['']).next
+    prompter()
+    assert prompter.results['data'] == {'name': 'a-study',
+                                        'other': 'b-study'}, \
+           "known values of skipped prompts are kept"
@@ -0,0 +1,173 @@
+import re
+
+
+# regex for checking date format
+yyyy_mm_dd = re.compile(r'^20\d\d-[0-2]\d-[0-3]\d$')
+
+
+def to_number(value):
+    "Convert value to a number (int or float)."
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def to_text(value):
+    "Return a value as text (numbers, e.g. from a JSON record, included)."
+    if isinstance(value, basestring):
+        return value
+    if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+        return str(value)
+    raise ValueError('expected text')
+
+
+# converters for each prompt type, given a non-empty value ...
+
+def check_bool(field, value):
+    if isinstance(value, bool):
+        return value
+    if not isinstance(value, basestring):
+        raise ValueError('expected `y` for yes or `n` for no')
+    value = value.lower()
+    if value in ('y', 'yes', 'true'):
+        return True
+    if value in ('n', 'no', 'false'):
+        return False
+    raise ValueError('expected `y` for yes or `n` for no')
+
+def check_number(field, value):
+    if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+        return value
+    try:
+        return to_number(value)
+    except (ValueError, TypeError):
+        raise ValueError('expected a number')
+
+def check_date(field, value):
+    if not (isinstance(value, basestring) and yyyy_mm_dd.match(value)):
+        raise ValueError('expected a date in `YYYY-MM-DD` format')
+    return value
+
+def check_list(field, value):
+    return to_text(value)
+
+def check_text(field, value):
+    value = to_text(value)
+    if field.pattern and not field.pattern.match(value):
+        raise ValueError('invalid input')
+    return value
+
+checkers = {
+    'bool': check_bool,
+    'number': check_number,
+    'date': check_date,
+    'list': check_list,
+    'text': check_text
+}
+
+
+class Field:
+    """
+    A validator for a single prompt dict, compiled once: its regex
+    pattern is precompiled, its type checker is looked up up front,
+    and its options are indexed in a set.
+
+    """
+    def __init__(self, p):
+        self.key = p['key']
+        self.type = p['type']
+        self.require = p['require']
+        self.options = p.get('options', [])     # (shared with the dict)
+        self.option_set = set(self.options)
+        self.pattern = re.compile(p['regex']) if p.get('regex') else None
+        self.check = checkers[self.type]
+
+    def __call__(self, value, fixed=False):
+        """
+        Validate and convert a value for this field.  Returns the
+        converted value, or raises a ValueError describing why the
+        value is invalid.
+
+        If `fixed` is true, values of `list` fields must be one of
+        the enumerated options.
+
+        """
+        if isinstance(value, basestring):
+            value = value.strip()
+
+        # return null value if none given and not required
+        if value is None or value == '':
+            if self.require:
+                raise ValueError('a value is required')
+            return None
+
+        value = self.check(self, value)
+
+        if fixed and self.type == 'list' and value not in self.option_set:
+            raise ValueError('expected one of the listed options')
+
+        return value
+
+    def has_option(self, value):
+        "Return True if `value` is one of the enumerated options."
+        return value in self.option_set
+
+    def add_option(self, value):
+        "Add `value` to the enumerated options."
+        if value not in self.option_set:
+            self.option_set.add(value)
+            self.options.append(value)
+
+    def add_options(self, values):
+        "Add each of `values` (in order) to the enumerated options."
+        for value in values:
+            self.add_option(value)
+
+
+class Validator:
+    """
+    Validates records (dicts of prompt keys to values) against the
+    prompts of a resource config, compiled once into `Field`s.
+
+    Keys of records are matched to prompt keys ignoring case.
+
+    """
+    def __init__(self, fields):
+        self.fields = fields
+        self.keys = [(f, f.key.lower()) for f in fields]
+
+    @classmethod
+    def compile(cls, config, required=False):
+        """
+        Compile a validator for a resource `config` (only for its
+        required prompts if `required` is true).
+
+        """
+        return cls([Field(p) for p in config['prompts']
+                    if p['require'] or not required])
+
+    def validate(self, record, fixed=False):
+        """
+        Validate a record, returning a dict of its converted values
+        and a dict of error messages for any invalid fields.
+
+        """
+        values = dict((k.lower(), v) for k, v in record.items())
+        data = {}
+        errors = {}
+        for field, key in self.keys:
+            try:
+                data[field.key] = field(values.get(key), fixed)
+            except ValueError as e:
+                errors[field.key] = str(e)
+        return data, errors
+
+    def validate_batch(self, records, fixed=False):
+        """
+        Validate a batch of records in one pass, returning a list of
+        `(data, errors)` pairs (one per record).
+
+        """
+        validate = self.validate
+        return [validate(record, fixed) for record in records]
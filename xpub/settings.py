@@ -0,0 +1,18 @@
+import os
+
+# set config dir based on $XROMM_CONFIG env variable if present
+# otherwise look for a `config` dir in current working dir
+cwd_config = os.path.join(os.getcwd(), 'config')
+if not os.path.isfile(cwd_config):
+    pkg_dir = os.path.dirname(os.path.abspath(__file__))
+    cwd_config = os.path.join(pkg_dir, 'config')
+CONFIG_DIR = os.environ.get('XROMM_CONFIG', cwd_config)
+
+# local state kept by xpub (journals, caches, etc.) lives alongside
+# the config files unless $XROMM_STATE is set
+STATE_DIR = os.environ.get('XROMM_STATE', CONFIG_DIR)
+
+
+def state_path(name):
+    "Return the path of a local state file named `name`."
+    return os.path.join(STATE_DIR, name)
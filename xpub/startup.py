@@ -0,0 +1,124 @@
+"""
+Profiling of `xpub` startup time.
+
+Run `xpub --startup-profile` to see what each module costs to import,
+both for the `xpub` entry point itself and for the (lazily imported)
+dependencies of each action.
+
+"""
+import os
+import sys
+import imp
+import time
+import subprocess
+
+
+BUDGET = 0.1        # seconds allowed for importing the entry point
+TOP = 15            # modules listed per import group
+
+# imports to time: the entry point, then what each action loads lazily
+GROUPS = [
+    ('entry point', ['xpub.main']),
+    ('send', ['requests']),
+    ('transfer', ['globusonline.transfer.api_client',
+                  'globusonline.transfer.api_client.goauth']),
+]
+
+
+class ImportTimer(object):
+    """
+    A `sys.meta_path` importer that times the loading of each module.
+
+    For each module loaded while installed, `times[name]` is set to a
+    pair of its inclusive load time (including the modules it imports)
+    and its self time (excluding them).
+
+    """
+    def __init__(self):
+        self.times = {}
+        self.stack = []             # child time of each load in progress
+        self.found = {}             # name -> imp.find_module result
+
+    def find_module(self, fullname, path=None):
+        try:
+            self.found[fullname] = imp.find_module(
+                fullname.rpartition('.')[2], path)
+        except ImportError:
+            return None             # leave it to the default importer
+        return self
+
+    def load_module(self, fullname):
+        if fullname in sys.modules:
+            return sys.modules[fullname]
+        f, path, description = self.found.pop(fullname)
+        self.stack.append(0.0)
+        start = time.time()
+        try:
+            return imp.load_module(fullname, f, path, description)
+        finally:
+            if f:
+                f.close()
+            elapsed = time.time() - start
+            children = self.stack.pop()
+            self.times[fullname] = elapsed, elapsed - children
+            if self.stack:
+                self.stack[-1] += elapsed
+
+    def __enter__(self):
+        sys.meta_path.insert(0, self)
+        return self
+
+    def __exit__(self, *exc):
+        sys.meta_path.remove(self)
+
+
+def profile(groups=GROUPS):
+    """
+    Import each group of modules in turn, printing the modules that
+    were loaded by each, with their inclusive and self import times.
+    Returns the total time spent importing the entry point.
+
+    """
+    totals = {}
+    for label, names in groups:
+        timer = ImportTimer()
+        start = time.time()
+        with timer:
+            for name in names:
+                try:
+                    __import__(name)
+                except ImportError as e:
+                    print "(could not import {}: {})".format(name, e)
+        totals[label] = time.time() - start
+
+        print "\n{} ({:.1f} ms, {} modules)".format(
+            label, totals[label] * 1000, len(timer.times))
+        print "    {:>10}  {:>10}  module".format('total ms', 'self ms')
+        ranked = sorted(timer.times.items(), key=lambda item: -item[1][0])
+        for name, (total, own) in ranked[:TOP]:
+            print "    {:>10.1f}  {:>10.1f}  {}".format(
+                total * 1000, own * 1000, name)
+    return totals[groups[0][0]]
+
+
+def main():
+    entry = profile()
+    status = 'ok' if entry <= BUDGET else 'OVER BUDGET'
+    print "\nentry point import: {:.1f} ms (budget {:.0f} ms): {}".format(
+        entry * 1000, BUDGET * 1000, status)
+    if entry > BUDGET:
+        raise SystemExit(1)
+
+
+def run_profile():
+    """
+    Profile startup in a fresh interpreter (since this one has already
+    imported most of `xpub`), returning its exit status.
+
+    """
+    pkg_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [pkg_parent] + filter(None, [env.get('PYTHONPATH')]))
+    return subprocess.call([sys.executable, '-c',
+                            'from xpub.startup import main; main()'], env=env)
@@ -0,0 +1,237 @@
+"""
+Routing of collected results to the backends that store them.
+
+Each prompt of a resource config declares the backends its value is
+stored in (its `store`): the `xromm` portal, the Ross lab's `ross_db`
+or the `hatabase`.  When results are sent, each is split into a
+payload per backend holding only that backend's fields, and the
+payloads are written through each backend concurrently.
+
+A backend is any object with a `write(batch)` method that stores a
+list of payloads (results dicts), returning the number written, or
+raising an exception if they can't be written.
+
+"""
+import os
+import json
+import glob
+import sqlite3
+import hashlib
+from datetime import datetime
+from collections import OrderedDict, defaultdict as dd
+from multiprocessing.pool import ThreadPool
+from hatabase import Hatabase
+from outbox import Outbox, record_key
+from settings import CONFIG_DIR, state_path
+
+
+# backend of values that no prompt declares a store for
+DEFAULT = 'xromm'
+
+# keys of the results that identify a record, given to every backend
+IDENTITY = ('resource', 'version', 'file_name', 'file_sha256')
+
+# resource of the records kept in the hatabase's own health record table
+HEALTH_RECORD = 'macaque_health_record'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS records (
+    digest     TEXT PRIMARY KEY,
+    resource   TEXT,
+    version    TEXT,
+    data       TEXT,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS records_resource ON records (resource, created_at);
+'''
+
+
+def now():
+    return datetime.now().isoformat() + 'Z'
+
+
+def load_stores(config_dir=CONFIG_DIR):
+    """
+    Return the backends of each field of each resource, as a dict of
+    resource keys to dicts of prompt keys to their `store` lists, read
+    from the resource configs in `config_dir` (and its `mediatypes`).
+
+    """
+    stores = {}
+    paths = glob.glob(os.path.join(config_dir, '*.json')) + \
+            glob.glob(os.path.join(config_dir, 'mediatypes', '*.json'))
+    for path in sorted(paths):
+        config = json.load(open(path))
+        if 'prompts' in config:             # (not cache.json, ...)
+            stores[config['key']] = dict((p['key'], p['store'])
+                                         for p in config['prompts'])
+    return stores
+
+
+def by_backend(results, stores):
+    """
+    Split a results dict into a payload for each of its backends (a
+    dict of payloads by backend name), given the `stores` of each
+    field (see `load_stores`).
+
+    Each payload holds just the fields of `data` stored in its backend,
+    and the keys that identify the record (`IDENTITY`: its resource
+    and version, and the name and sha256 digest of a file).  Values no
+    prompt declares a store for, in `data` or not (such as the rest of
+    a file's info), are sent to the portal, as they were before being
+    routed.
+
+    """
+    fields = stores.get(results['resource'], {})
+    identity = dict((k, results[k]) for k in IDENTITY if k in results)
+    payloads = OrderedDict()
+    for key, value in sorted(results['data'].items()):
+        for backend in fields.get(key, [DEFAULT]):
+            if backend not in payloads:
+                payloads[backend] = dict(identity, data={})
+            payloads[backend]['data'][key] = value
+    rest = dict((k, v) for k, v in results.items()
+                if k not in IDENTITY and k != 'data')
+    if rest:
+        payloads.setdefault(DEFAULT, dict(identity, data={})).update(rest)
+    return payloads
+
+
+def route(batch, backends, stores=None):
+    """
+    Split a batch of results by backend (see `by_backend`) and write the
+    payloads of each backend through it, returning a dict of the
+    errors raised by the backends that failed (by backend name).
+
+    `backends` should be a dict of backends by name.  They're written
+    concurrently, each in its own thread, so a slow backend doesn't
+    hold up the others, and the outcome for each is reported as soon
+    as it's known.
+
+    """
+    stores = load_stores() if stores is None else stores
+    payloads = OrderedDict()                # payloads by backend name
+    for results in batch:
+        for name, payload in by_backend(results, stores).items():
+            payloads.setdefault(name, []).append(payload)
+    if not payloads:
+        print "nothing to send"
+        return {}
+
+    def write(name):
+        try:
+            return name, backends[name].write(payloads[name]), None
+        except Exception as e:              # backend (or missing backend)
+            return name, None, e
+
+    failed = {}
+    pool = ThreadPool(len(payloads))
+    try:
+        for name, count, error in pool.imap_unordered(write, payloads):
+            if error is None:
+                print "{}: {} record(s) written".format(name, count)
+            else:
+                print "{}: failed writing {} record(s): {}".format(
+                    name, len(payloads[name]), str(error) or repr(error))
+                failed[name] = error
+    finally:
+        pool.close()
+    return failed
+
+
+class Portal:
+    """
+    The `xromm` portal backend: payloads are queued in the outbox for
+    the url given by `url_for(results)` and then sent from it.  Any
+    left in the outbox (to be sent by `xpub --flush`) count as failed.
+    Only the payloads of a write are sent by it: records left in the
+    outbox by earlier runs are just reported.
+
+    """
+    def __init__(self, url_for, outbox=None, client=None):
+        self.url_for = url_for
+        self.outbox = outbox
+        self.client = client
+
+    def write(self, batch):
+        outbox = self.outbox or Outbox()
+        records = dd(list)                  # payloads for each url
+        urls = []                           # urls in order sent
+        for results in batch:
+            url = self.url_for(results)
+            if url not in records:
+                urls.append(url)
+            records[url].append(results)
+        keys = []                           # outbox keys of the payloads
+        for url in urls:
+            outbox.put(url, records[url])   # queue for sending
+            keys.extend(record_key(url, results) for results in records[url])
+        sent, unsent = outbox.flush(self.client, keys=keys)
+        earlier = len(outbox.pending()) - unsent
+        if earlier:
+            print "{} earlier record(s) are still in the outbox (run " \
+                  "`xpub --flush` to send them)".format(earlier)
+        if unsent:
+            raise IOError("{} record(s) left in the outbox (run "
+                          "`xpub --flush` to send them)".format(unsent))
+        return len(batch)
+
+
+class Local:
+    """
+    A backend kept in a local SQLite database (`NAME.db` in the state
+    dir), e.g. for the `ross_db`.  Each payload is recorded with its
+    resource, keyed by a digest of its content, so a payload that's
+    written again isn't duplicated.
+
+    """
+    def __init__(self, name, path=None):
+        self.name = name
+        self.path = path or state_path(name + '.db')
+
+    def connect(self):
+        # (connected by the thread writing, as connections can't be shared)
+        db = sqlite3.connect(self.path, timeout=30)
+        db.executescript(SCHEMA)
+        return db
+
+    def write(self, batch):
+        values = []
+        for results in batch:
+            data = json.dumps(results, sort_keys=True)
+            values.append((hashlib.sha1(data).hexdigest(),
+                           results['resource'], results.get('version'),
+                           data, now()))
+        db = self.connect()
+        try:
+            with db:
+                db.executemany('INSERT OR IGNORE INTO records '
+                               'VALUES (?,?,?,?,?)', values)
+        finally:
+            db.close()
+        return len(batch)
+
+
+class LocalHatabase(Local):
+    """
+    The local `hatabase` backend (`hatabase.db`): health records go to
+    its health record table (see `hatabase.Hatabase`), indexed by
+    animal and date, and the payloads of other resources to its table
+    of records.
+
+    """
+    def __init__(self, path=None):
+        Local.__init__(self, 'hatabase', path)
+
+    def write(self, batch):
+        health = [r for r in batch if r['resource'] == HEALTH_RECORD]
+        rest = [r for r in batch if r['resource'] != HEALTH_RECORD]
+        if health:
+            hatabase = Hatabase(self.path)
+            try:
+                hatabase.add(health)
+            finally:
+                hatabase.db.close()
+        if rest:
+            Local.write(self, rest)
+        return len(batch)
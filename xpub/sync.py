@@ -0,0 +1,89 @@
+import os
+import time
+from action import API_URL
+
+
+# where changes to the portal's study/trial names are fetched from
+SYNC_URL = os.environ.get('XROMM_SYNC_URL', API_URL + 'v1/catalog/')
+
+# seconds after a sync before `xpub` syncs again on startup (0 for never)
+SYNC_TTL = int(os.environ.get('XROMM_SYNC_TTL', 0))
+
+AUTO_TIMEOUT = (2, 10)  # timeouts for syncing on startup (in seconds)
+
+
+def sync(catalog, client=None, url=SYNC_URL):
+    """
+    Fetch the study/trial names added to the portal since the last sync
+    (or since the `catalog` was seeded) and add them to the catalog.
+    Returns the number of new names.
+
+    The first request is conditional on the ETag and Last-Modified time
+    of the last sync, so an unchanged catalog costs a `304` response.
+    Otherwise, changes are returned a page at a time, as json objects
+    such as ...
+
+        {"updated_at": "2015-09-01T10:00:00Z",  (as of the first page)
+         "studies": ["pig-chewing-study", ...],
+         "trials": [["pig-chewing-study", "trial-1"], ...],
+         "next": "<url of next page>" or null}
+
+    Each page is merged in its own transaction.  The sync position is
+    only advanced once every page has been merged, so an interrupted
+    sync is simply repeated.
+
+    """
+    if client is None:
+        from client import Client
+        client = Client()
+
+    headers = {}
+    if catalog.get_meta('etag'):
+        headers['If-None-Match'] = catalog.get_meta('etag')
+    if catalog.get_meta('last_modified'):
+        headers['If-Modified-Since'] = catalog.get_meta('last_modified')
+    params = {'since': catalog.get_meta('sync_since') or ''}
+
+    resp = client.get(url, params=params, headers=headers)
+    first = resp
+    added = 0
+    while resp.status_code != 304:
+        page = resp.json()
+        added += catalog.add(page.get('studies', []),
+                             [tuple(t) for t in page.get('trials', [])])
+        if not page.get('next'):
+            break
+        resp = client.get(page['next'])
+
+    with catalog.db:
+        if first.status_code != 304:
+            catalog.set_meta('sync_since', first.json()['updated_at'])
+            catalog.set_meta('etag', first.headers.get('ETag'))
+            catalog.set_meta('last_modified',
+                             first.headers.get('Last-Modified'))
+        catalog.set_meta('synced_at', repr(time.time()))
+    return added
+
+
+def due(catalog, ttl=SYNC_TTL):
+    "Return True if the `catalog` hasn't been synced in `ttl` seconds."
+    synced_at = float(catalog.get_meta('synced_at') or 0)
+    return time.time() - synced_at >= ttl
+
+
+def auto_sync(catalog, ttl=SYNC_TTL):
+    """
+    Sync the `catalog` on startup if syncing is enabled (`ttl` isn't 0)
+    and it's due.  Failures are reported but otherwise ignored (names
+    will be synced on a later run).
+
+    """
+    if not ttl or not due(catalog, ttl):
+        return
+    from client import Client
+    try:
+        added = sync(catalog, Client(timeout=AUTO_TIMEOUT, retries=0))
+        if added:
+            print "{} new study/trial name(s) synced".format(added)
+    except Exception as e:
+        print "couldn't sync study/trial names: {}".format(e)
@@ -0,0 +1,1155 @@
+import os
+import sys
+import csv
+import json
+import zlib
+import shutil
+import posixpath
+import struct
+import hashlib
+import tempfile
+import threading
+import SocketServer
+import BaseHTTPServer
+from datetime import datetime
+import requests
+from nose.tools import raises
+from globusonline.transfer.api_client import Transfer
+from . import atomic, checksum, manifest
+from .answers import Answers
+from .action import submit, skip_duplicates, transfer_items, add_file_info, \
+                    DEST_DIR, SIDECAR_SUFFIX
+from .batch import expand_paths, partition
+from .bundle import Bundle
+from .catalog import Catalog
+from .checksum import Checksummer
+from .client import Client
+from .dedup import ContentIndex
+from .detect import Detector
+from .hatabase import Hatabase, import_records
+from .headers import extract, split, nsx, HeaderError
+from .journal import Journal, PENDING, SUBMITTED
+from .monitor import Monitor
+from .outbox import Outbox
+from .overlay import Overlay
+from .profiles import load_profiles, transfer_options, resume_options
+from .prompter import Prompt
+from .settings import CONFIG_DIR
+from .startup import ImportTimer
+from .stores import load_stores, by_backend, route, Portal, Local, LocalHatabase
+from .sync import sync, due
+from .watch import Watcher, Batch, Session, SETTINGS_NAME
+
+
+def make_files(sizes):
+    '''Create a temp dir with a file of each given size: `f0`, `f1`, ...'''
+    d = tempfile.mkdtemp()
+    for i, size in enumerate(sizes):
+        with open(os.path.join(d, 'f{}'.format(i)), 'wb') as f:
+            f.write('x' * size)
+    return d
+
+def test_expand_paths():
+    '''Testing expansion of files, directories and globs'''
+    d = make_files([1, 2, 3])
+    try:
+        os.mkdir(os.path.join(d, 'sub'))
+        open(os.path.join(d, 'sub', 'g0'), 'w').close()
+        open(os.path.join(d, '.hidden'), 'w').close()
+        open(os.path.join(d, 'f0' + SIDECAR_SUFFIX), 'w').close()
+        f0 = os.path.join(d, 'f0')
+
+        paths = expand_paths([f0, d])
+        assert paths[0] == f0, "given order is preserved"
+        assert len(paths) == 4, "duplicates, hidden files and sidecars " \
+                                "are dropped"
+        assert os.path.join(d, 'sub', 'g0') in paths, "dirs are walked"
+
+        paths = expand_paths([os.path.join(d, 'f*')])
+        assert [os.path.basename(p) for p in paths] == ['f0', 'f1', 'f2']
+
+        assert expand_paths([os.path.join(d, 'nope')]) == []
+    finally:
+        shutil.rmtree(d)
+
+def test_partition():
+    '''Testing size-balanced partitioning of a batch into tasks'''
+    d = make_files([50, 40, 30, 20, 10, 10])
+    try:
+        paths = expand_paths([d])
+        assert partition(paths) == [paths], "one task when under limits"
+
+        groups = partition(paths, max_bytes=100)
+        assert len(groups) == 2
+        sizes = [sum(os.path.getsize(p) for p in g) for g in groups]
+        assert sorted(sizes) == [80, 80], "tasks are size-balanced"
+
+        groups = partition(paths, max_items=2)
+        assert len(groups) == 3
+        assert all(len(g) == 2 for g in groups), "item limit is respected"
+    finally:
+        shutil.rmtree(d)
+
+def test_checksummer():
+    '''Testing background checksumming of files'''
+    d = make_files([0, 5, 3 * 1024])
+    try:
+        paths = expand_paths([d])
+        checksums = Checksummer(paths)
+        for path in paths:
+            data = open(path, 'rb').read()
+            digest = checksums(path)
+            assert checksums.ready(path)
+            assert digest['size'] == len(data)
+            assert digest['md5'] == hashlib.md5(data).hexdigest()
+            assert digest['sha256'] == hashlib.sha256(data).hexdigest()
+
+        # small chunks exercise the buffered read loop
+        digest = checksum.digest(paths[2], ('sha256',), chunk_size=1000)
+        assert digest['sha256'] == hashlib.sha256('x' * 3 * 1024).hexdigest()
+        assert 'md5' not in digest
+    finally:
+        shutil.rmtree(d)
+
+class FakeTransferAPI:
+    '''
+    Stands in for a globus `TransferAPIClient` when submitting and
+    polling tasks.  The documents returned when polling each task are
+    given in `tasks` (the last one is repeated, and errors are raised).
+
+    '''
+    def __init__(self, fail=False, tasks={}):
+        self.fail = fail
+        self.submitted = []
+        self.tasks = dict((k, list(v)) for k, v in tasks.items())
+        self.polled = []
+
+    def transfer(self, transfer):
+        if self.fail:
+            raise IOError('connection refused')
+        self.submitted.append(transfer)
+        return 202, 'Accepted', {'code': 'Accepted', 'task_id': 'task-1'}
+
+    def task(self, task_id):
+        docs = self.tasks[task_id]
+        doc = docs.pop(0) if len(docs) > 1 else docs[0]
+        self.polled.append(task_id)
+        if isinstance(doc, Exception):
+            raise doc
+        return 200, 'OK', doc
+
+def test_journal():
+    '''Testing journaling of submitted transfer tasks'''
+    d = make_files([10, 20])
+    try:
+        paths = expand_paths([d])
+        journal = Journal(os.path.join(d, 'journal.db'))
+        t = Transfer('sub-1', 'src#ep', 'dst#ep', sync_level=3)
+        for path in paths:
+            t.add_item(path, '/dest/' + os.path.basename(path))
+        journal.record(t, dict((p, os.path.getsize(p)) for p in paths))
+
+        task, = journal.tasks(PENDING)
+        assert task['files'] == 2 and task['bytes'] == 30
+        assert json.loads(task['options'])['sync_level'] == 3
+
+        assert submit(FakeTransferAPI(fail=True), journal, t) is None
+        assert len(journal.tasks(PENDING)) == 1, "failed task stays pending"
+
+        api = FakeTransferAPI()
+        assert submit(api, journal, t) == 'task-1'
+        assert api.submitted == [t]
+        assert journal.tasks(PENDING) == []
+        task, = journal.tasks(SUBMITTED)
+        assert task['task_id'] == 'task-1'
+        assert len(journal.items('sub-1')) == 2
+    finally:
+        shutil.rmtree(d)
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Request handler for a local stand-in of the portal.
+
+    Each request is recorded as `(method, path, headers, data)` in the
+    server's `requests` list, and answered with the next status code
+    from the server's `statuses` list (or 200 once it's exhausted).
+
+    '''
+    protocol_version = 'HTTP/1.1'           # keep connections alive
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        self.respond(json.loads(body))
+
+    def respond(self, data):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.command, self.path,
+                                    dict(self.headers), data))
+            server.ports.add(self.client_address[1])
+            status = server.statuses.pop(0) if server.statuses else 200
+        body = json.dumps({'ok': status < 400})
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+def stub_server(statuses=(), handler=StubHandler):
+    '''Start a stand-in server on a free local port, returning it and its url.'''
+    server = StubServer(('127.0.0.1', 0), handler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.ports = set()                    # client ports seen
+    server.statuses = list(statuses)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:{}/api/'.format(server.server_port)
+
+def test_client_retries():
+    '''Testing client retries with backoff on 5xx responses'''
+    server, url = stub_server(statuses=[503, 502])
+    try:
+        resp = Client(backoff=0).post(url, {'name': 'pig-chewing-study'})
+        assert resp.json() == {'ok': True}
+        assert len(server.requests) == 3, "retried twice before success"
+        method, path, headers, data = server.requests[-1]
+        assert data == {'name': 'pig-chewing-study'}
+    finally:
+        server.shutdown()
+
+@raises(requests.HTTPError)
+def test_client_gives_up():
+    '''Testing client error once retries are exhausted: HTTPError expected'''
+    server, url = stub_server(statuses=[500] * 10)
+    try:
+        Client(retries=2, backoff=0).post(url, {})
+    finally:
+        server.shutdown()
+
+def test_client_bulk():
+    '''Testing gzipped bulk posts over a pooled connection'''
+    server, url = stub_server()
+    try:
+        records = [{'note': 'x' * 500, 'i': i} for i in range(5)]
+        client = Client()
+        resps = client.post_many(url, records, size=2)
+        assert len(resps) == 3, "5 records in bulk requests of 2"
+        assert [r for req in server.requests for r in req[3]] == records
+        assert server.requests[0][2]['content-encoding'] == 'gzip'
+        assert 'content-encoding' not in server.requests[2][2], \
+               "small bodies are not compressed"
+        assert len(server.ports) == 1, "one connection is re-used"
+    finally:
+        server.shutdown()
+
+def test_outbox():
+    '''Testing queueing and concurrent flushing of the outbox'''
+    d = tempfile.mkdtemp()
+    server, url = stub_server(statuses=[500])
+    try:
+        outbox = Outbox(os.path.join(d, 'outbox.jsonl'))
+        client = Client(retries=0)
+        batch = [{'resource': 'trial', 'data': {'name': str(i)}}
+                 for i in range(5)]
+        assert outbox.put(url, batch) == 5
+        assert outbox.put(url, batch[:2]) == 0, "no duplicate records"
+        assert outbox.put(url + 'other/', batch[:1]) == 1
+
+        sent, unsent = outbox.flush(client, size=2)
+        assert (sent, unsent) in [(4, 2), (5, 1)], "one request failed"
+        assert len(outbox.pending()) == unsent
+
+        sent, unsent = Outbox(outbox.path).flush(client, size=2)
+        assert unsent == 0 and outbox.pending() == []
+        assert os.path.getsize(outbox.path) == 0, "spool is compacted"
+
+        keys = set()
+        for method, path, headers, data in server.requests[1:]:
+            records = data if isinstance(data, list) else [data]
+            keys.update(r['idempotency_key'] for r in records)
+        assert len(keys) == 6, "each record has its own idempotency key"
+    finally:
+        server.shutdown()
+        shutil.rmtree(d)
+
+def test_bundle():
+    '''Testing the compiled config bundle'''
+    d = tempfile.mkdtemp()
+    try:
+        config_path = os.path.join(d, 'study.json')
+        shutil.copy(os.path.join(CONFIG_DIR, 'study.json'), config_path)
+        builds = []
+        def build():
+            builds.append(1)
+            config = json.load(open(config_path))
+            return config, [Prompt(p) for p in config['prompts']]
+
+        bundle = Bundle(os.path.join(d, 'bundle.pickle'))
+        config, prompts = bundle.get('study', [config_path], build)
+        prompts[0].options.append('changed')    # shouldn't affect bundle
+        bundle.save()
+
+        bundle = Bundle(bundle.path)
+        config, prompts = bundle.get('study', [config_path], build)
+        assert len(builds) == 1, "warm start skips the build"
+        assert prompts[0].options == []
+        assert prompts[0].pattern.match('pig'), "patterns are compiled"
+        assert prompts[2].options is config['prompts'][2]['options']
+
+        os.utime(config_path, (0, 0))           # touched, not changed
+        bundle.get('study', [config_path], build)
+        assert len(builds) == 1
+
+        with open(config_path, 'a') as f:
+            f.write('\n')
+        bundle.get('study', [config_path], build)
+        assert len(builds) == 2, "rebuilt when a source changes"
+    finally:
+        shutil.rmtree(d)
+
+def test_import_timer():
+    '''Testing the import timer used to profile startup'''
+    sys.modules.pop('colorsys', None)
+    with ImportTimer() as timer:
+        import colorsys
+    total, own = timer.times['colorsys']
+    assert 0 <= own <= total
+    assert timer not in sys.meta_path
+
+def test_manifest():
+    '''Testing creation of records from a manifest'''
+    d = tempfile.mkdtemp()
+    try:
+        path = os.path.join(d, 'trials.csv')
+        with open(path, 'w') as f:
+            f.write('Study,name,date,subject_grams,extra\n'
+                    'pig-chewing-study,markers_1,2015-04-01,300,x\n'
+                    'pig-chewing-study,m,2015-4-1,abc,x\n'
+                    '\n'
+                    'cow-chewing-study,markers_2,2015-04-02,,x\n')
+        config = json.load(open(os.path.join(CONFIG_DIR, 'trial.json')))
+        prompts = [Prompt(p) for p in config['prompts']]
+
+        batch, files = manifest.load(path, lambda row: (config, prompts))
+        assert files == []
+        assert [r['data']['name'] for r in batch] == ['markers_1', 'markers_2']
+        assert batch[0]['resource'] == 'trial'
+        assert batch[0]['data']['subject_grams'] == 300
+        assert batch[1]['data']['subject_grams'] is None
+
+        rejects = list(csv.DictReader(open(manifest.rejects_path(path))))
+        assert len(rejects) == 1 and rejects[0]['line'] == '3'
+        assert 'date:' in rejects[0]['errors']
+        assert 'subject_grams:' in rejects[0]['errors']
+
+        path = os.path.join(d, 'files.jsonl')
+        open(os.path.join(d, 'a.cine'), 'w').close()
+        with open(path, 'w') as f:
+            for row in [{'file': 'a.cine', 'study_trial': 'pig/trial-1'},
+                        {'file': 'a.cine', 'note': 'no study/trial'},
+                        {'file': 'b.cine', 'study_trial': 'pig/trial-1'}]:
+                f.write(json.dumps(row) + '\n')
+        config = json.load(open(os.path.join(CONFIG_DIR, 'file.json')))
+        prompts = [Prompt(p) for p in config['prompts']]
+        batch, files = manifest.load(path, lambda row: (config, prompts),
+                                     files=True)
+        assert files == [os.path.join(d, 'a.cine')]
+        assert batch[0]['data'] == {'study_trial': 'pig/trial-1', 'note': None}
+        rejects = [json.loads(line)
+                   for line in open(manifest.rejects_path(path))]
+        assert [r['line'] for r in rejects] == [2, 3]
+        assert rejects[1]['errors'] == 'file: no such file'
+
+        # lines that aren't json objects are rejected, not fatal
+        path = os.path.join(d, 'bad.jsonl')
+        with open(path, 'w') as f:
+            f.write('{"file": "a.cine", "study_trial": "pig/trial-1"}\n'
+                    '{"file": "a.cine", \n'
+                    '["a.cine"]\n'
+                    '{"file": "a.cine", "study_trial": 123}\n')
+        batch, files = manifest.load(path, lambda row: (config, prompts),
+                                     files=True)
+        assert [r['data']['study_trial'] for r in batch] == ['pig/trial-1',
+                                                             '123']
+        rejects = [json.loads(line)
+                   for line in open(manifest.rejects_path(path))]
+        assert [r['line'] for r in rejects] == [2, 3]
+        assert rejects[0]['errors'].startswith('row: invalid JSON')
+        assert rejects[1]['errors'] == 'row: not a JSON object'
+        assert rejects[1]['text'] == '["a.cine"]'
+    finally:
+        shutil.rmtree(d)
+
+
+def test_hatabase():
+    '''Testing bulk import of health records into the hatabase'''
+    d = tempfile.mkdtemp()
+    try:
+        path = os.path.join(d, 'health.csv')
+        fields = ('study,date,subject_name,trainerA,subject_grams,'
+                  'drinker_supp,chair_start,play_start,play_end,chair_end,'
+                  'psych,skin,gums,urine,feces,headclean')
+        rest = ('Kazutaka Takahashi,9000,50,09:00,10:00,10:30,11:00,BAR,'
+                'elastic,"pink, moist",none observed,none observed,head clean')
+        with open(path, 'w') as f:
+            f.write(fields + '\n')
+            for study, date, subject in [('test study', '2014-12-31', 'Kiki'),
+                                         ('test study', '2015-03-01', 'Kiki'),
+                                         ('test study', '2015-3-1', 'Kiki'),
+                                         ('test study', '2015-06-01', 'none'),
+                                         ('test study', '2015-09-01', 'Kiki')]:
+                f.write('{},{},{},{}\n'.format(study, date, subject, rest))
+        config = json.load(open(os.path.join(CONFIG_DIR,
+                                             'macaque_health_record.json')))
+        prompts = [Prompt(p) for p in config['prompts']]
+        hatabase = Hatabase(os.path.join(d, 'hatabase.db'))
+
+        assert import_records(path, lambda row: (config, prompts),
+                              hatabase, batch_size=2) == 1
+        assert hatabase.count() == 4
+        records = hatabase.records('Kiki', '2015-01-01', '2015-12-31')
+        assert [r['date'] for r in records] == ['2015-03-01', '2015-09-01']
+        assert records[0]['subject_grams'] == 9000
+        assert [r['subject_name'] for r in hatabase.records()] == \
+               ['Kiki', 'Kiki', 'Kiki', 'none']
+
+        rejects = list(csv.DictReader(open(manifest.rejects_path(path))))
+        assert len(rejects) == 1 and rejects[0]['line'] == '4'
+        assert 'date:' in rejects[0]['errors']
+
+        plan = hatabase.db.execute(
+            'EXPLAIN QUERY PLAN SELECT data FROM health_records '
+            'WHERE subject_name = ? AND date >= ?', ('Kiki', '2015')).fetchall()
+        assert 'health_records_subject' in str([tuple(r) for r in plan])
+
+        # importing the same export again adds nothing
+        import_records(path, lambda row: (config, prompts), hatabase)
+        assert hatabase.count() == 4
+    finally:
+        shutil.rmtree(d)
+
+
+def test_catalog():
+    '''Testing the indexed catalog of study/trial names'''
+    d = tempfile.mkdtemp()
+    try:
+        seed = os.path.join(CONFIG_DIR, 'cache.json')
+        catalog = Catalog(os.path.join(d, 'catalog.db'), seed=seed)
+        assert catalog.counts() == (2, 5), "seeded from the flat cache"
+        assert catalog.updated_at == json.load(open(seed))['updated_at']
+
+        assert catalog.add_study('pig-drinking-study')
+        assert not catalog.add_study('pig-drinking-study')
+        assert catalog.add_trial('rat-study', 'trial-1'), "adds the study too"
+        assert catalog.has_study('rat-study')
+        assert catalog.has_trial('rat-study', 'trial-1')
+        assert not catalog.has_trial('rat-study', 'trial-2')
+        assert catalog.add(trials=[('rat-study', 't-%d' % i)
+                                   for i in range(1000)]) == 1000
+
+        assert catalog.studies('pig') == ['pig-chewing-study',
+                                          'pig-drinking-study']
+        assert catalog.trials('pig-chewing-study') == ['trial-1', 'trial-2']
+        assert catalog.paths('pig-c') == ['pig-chewing-study',
+                                          'pig-chewing-study/trial-1',
+                                          'pig-chewing-study/trial-2']
+        assert catalog.paths('rat-study/t-99') == ['rat-study/t-99'] + [
+            'rat-study/t-99%d' % i for i in range(10)]
+        assert len(catalog.paths()) == sum(catalog.counts()) == 4 + 1006
+
+        catalog = Catalog(catalog.path, seed=seed)
+        assert catalog.counts() == (4, 1006), "isn't seeded again"
+    finally:
+        shutil.rmtree(d)
+
+
+class CatalogHandler(StubHandler):
+    '''
+    Serves the server's `pages` of catalog changes (in turn, from the
+    one given by the `page` parameter), with the server's `etag`.
+
+    '''
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        params = dict(p.split('=', 1) for p in query.split('&') if p)
+        server = self.server
+        with server.lock:
+            server.requests.append((self.command, self.path,
+                                    dict(self.headers), params))
+        if self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        page = int(params.get('page', 0))
+        data = dict(server.pages[page], updated_at='2016-01-01T00:00:00Z',
+                    next=None)
+        if page + 1 < len(server.pages):
+            data['next'] = 'http://127.0.0.1:{}{}?page={}'.format(
+                server.server_port, path, page + 1)
+        body = json.dumps(data)
+        self.send_response(200)
+        self.send_header('ETag', server.etag)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def test_sync():
+    '''Testing incremental sync of the catalog from the portal'''
+    d = tempfile.mkdtemp()
+    server, url = stub_server(handler=CatalogHandler)
+    try:
+        server.etag = '"v1"'
+        server.pages = [
+            {'studies': ['rat-study'], 'trials': [['rat-study', 'trial-1']]},
+            {'trials': [['pig-chewing-study', 'trial-3'],
+                        ['pig-chewing-study', 'trial-1']]},
+        ]
+        seed = os.path.join(CONFIG_DIR, 'cache.json')
+        catalog = Catalog(os.path.join(d, 'catalog.db'), seed=seed)
+        assert due(catalog, ttl=60), "never synced"
+        client = Client(backoff=0)
+
+        assert sync(catalog, client, url) == 3
+        assert catalog.has_trial('pig-chewing-study', 'trial-3')
+        assert catalog.counts() == (3, 7)
+        method, path, headers, params = server.requests[0]
+        assert params['since'] == json.load(open(seed))['updated_at'] \
+                                      .replace(':', '%3A')
+        assert 'if-none-match' not in headers
+        assert len(server.requests) == 2, "both pages fetched"
+        assert not due(catalog, ttl=60)
+
+        assert sync(catalog, client, url) == 0, "not modified"
+        method, path, headers, params = server.requests[-1]
+        assert headers['if-none-match'] == '"v1"'
+        assert params['since'] == '2016-01-01T00%3A00%3A00Z'
+        assert len(server.requests) == 3
+
+        server.etag = '"v2"'
+        server.pages = [{'studies': ['cow-study']}]
+        assert sync(catalog, client, url) == 1
+        assert catalog.counts() == (4, 7)
+    finally:
+        server.shutdown()
+        shutil.rmtree(d)
+
+
+def test_atomic():
+    '''Testing atomic writes and locked read-merge-writes'''
+    d = tempfile.mkdtemp()
+    try:
+        path = os.path.join(d, 'config.json')
+        atomic.dump_json({'options': []}, path)
+        os.chmod(path, 0600)
+        atomic.write(path, json.dumps({'options': ['a']}))
+        assert json.load(open(path)) == {'options': ['a']}
+        assert os.stat(path).st_mode & 0777 == 0600, "mode is kept"
+
+        def learn(option):
+            with atomic.locked(path):
+                data = json.load(open(path))
+                data['options'].append(option)
+                atomic.dump_json(data, path)
+        threads = [threading.Thread(target=learn, args=(str(i),))
+                   for i in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        data = json.load(open(path))
+        assert sorted(data['options']) == sorted(
+            ['a'] + [str(i) for i in range(20)]), "no updates are lost"
+        assert sorted(os.listdir(d)) == ['config.json', 'config.json.lock']
+    finally:
+        shutil.rmtree(d)
+
+
+def test_overlay():
+    '''Testing the append-only log of learned options'''
+    d = tempfile.mkdtemp()
+    try:
+        path = os.path.join(d, 'learned', 'trial.jsonl')
+        overlay = Overlay('trial.json', path)
+        assert overlay.options() == {}
+        overlay.record({'study': ['rat-study']})
+        overlay.record({'study': ['cow-study', 'rat-study'],
+                        'subject_name': ['Oliver']})
+        assert overlay.options() == {'study': ['rat-study', 'cow-study'],
+                                     'subject_name': ['Oliver']}, \
+               "most used first"
+
+        learned, lines = overlay.read()
+        assert learned['study']['rat-study'][0] == 2 and lines == 4
+        overlay.compact()
+        assert overlay.read() == (learned, 3), "a line per option"
+
+        with open(path, 'a') as f:          # an option last used long ago
+            f.write(json.dumps({'key': 'study', 'option': 'old-study',
+                                'at': 0}) + '\n')
+        assert 'old-study' in overlay.options()['study']
+        capped = Overlay('trial.json', path, max_options=1, max_age=30)
+        assert capped.options()['study'] == ['rat-study']
+        capped.compact()
+        assert capped.read()[1] == 2, "capped and expired options dropped"
+    finally:
+        shutil.rmtree(d)
+
+
+def test_transfer_items():
+    '''Testing metadata sidecars sent with transferred files'''
+    d = make_files([10, 20])
+    try:
+        paths = expand_paths([d])
+        batch = [{'resource': 'file', 'data': {'study_trial': 'pig-study'},
+                  'file_name': os.path.basename(path),
+                  'file_abs_path': path, 'file_size': 10 * (i + 1)}
+                 for i, path in enumerate(paths)]
+        items = transfer_items(batch)
+        assert len(items) == 2
+        (src, dest, size), (sidecar, sidecar_dest, sidecar_size) = items[1]
+        assert (src, size) == (paths[1], 20)
+        assert open(src).read() == 'x' * 20, "data file isn't touched"
+        assert sidecar == paths[1] + SIDECAR_SUFFIX
+        assert sidecar_dest == dest + SIDECAR_SUFFIX
+        assert json.load(open(sidecar))['data'] == batch[1]['data']
+        assert sidecar_size == os.path.getsize(sidecar)
+        assert expand_paths([d]) == paths, "sidecars aren't transferred again"
+
+        # same-named files in different dirs keep their relative paths
+        for sub in ('s1', 's2'):
+            os.makedirs(os.path.join(d, 'trials', sub))
+            with open(os.path.join(d, 'trials', sub, 'trial.cine'), 'w') as f:
+                f.write(sub)
+        paths = expand_paths([os.path.join(d, 'trials')])
+        batch = [{'resource': 'file', 'data': {}} for path in paths]
+        add_file_info(batch, paths)
+        assert [r['file_rel_path'] for r in batch] == \
+               [os.path.join('s1', 'trial.cine'),
+                os.path.join('s2', 'trial.cine')]
+        dests = [item[0][1] for item in transfer_items(batch)]
+        assert dests == [posixpath.join(DEST_DIR, 's1', 'trial.cine'),
+                         posixpath.join(DEST_DIR, 's2', 'trial.cine')]
+        for results in batch:
+            del results['file_rel_path']
+        try:
+            transfer_items(batch)
+            assert False, "a ValueError is expected"
+        except ValueError as e:
+            assert 'both be transferred to' in str(e)
+    finally:
+        shutil.rmtree(d)
+
+
+def test_profiles():
+    '''Testing per-mediatype transfer profiles'''
+    profiles = load_profiles()
+    assert profiles['file_proc']['sync_level'] == 'checksum'
+    assert profiles['file_emg'] == profiles['file'], "file.json is the default"
+    assert profiles['file_xray']['deadline'] == 48
+
+    options = transfer_options(profiles['file_xray'])
+    assert options['sync_level'] == 2
+    assert options['verify_checksum'] is True
+    assert options['preserve_timestamp'] is True
+    assert options['deadline'] > datetime.utcnow().isoformat(' ')
+    assert transfer_options({}) == {}
+
+    t = Transfer('sub-1', 'src#ep', 'dst#ep', **options)
+    assert t.as_data()['verify_checksum'] is True
+
+    # resumed tasks get a fresh deadline (and never one that's passed)
+    d = tempfile.mkdtemp()
+    try:
+        journal = Journal(os.path.join(d, 'journal.db'))
+        journal.record(t, deadline_hours=48)
+        options = json.loads(journal.tasks(PENDING)[0]['options'])
+        options['deadline'] = '2015-08-18 14:02:31+00:00'   # (long ago)
+        options = resume_options(options)
+        assert 'deadline_hours' not in options
+        assert options['deadline'] > transfer_options({'deadline': 47})[
+            'deadline']
+        assert 'deadline' not in resume_options(
+            {'deadline': '2015-08-18 14:02:31+00:00', 'sync_level': 2})
+        Transfer('sub-1', 'src#ep', 'dst#ep', **options)
+    finally:
+        shutil.rmtree(d)
+
+@raises(ValueError)
+def test_profile_err():
+    '''Testing invalid transfer profiles'''
+    transfer_options({'sync_level': 'sometimes'})
+
+
+def test_dedup():
+    '''Testing reuse of cached digests and skipping of duplicate files'''
+    d = make_files([10, 10, 20])
+    try:
+        paths = expand_paths([d])
+        index = ContentIndex(os.path.join(d, '.dedup.db'))
+        checksums = Checksummer(paths, cache=index)
+        digests = [checksums(path) for path in paths]
+
+        checksums = Checksummer(paths, cache=index)
+        assert checksums.pending == {}, "cached digests aren't recomputed"
+        assert [checksums(path) for path in paths] == digests
+        os.utime(paths[2], (0, 0))
+        checksums = Checksummer(paths, cache=index)
+        assert checksums.pending.keys() == [paths[2]], "changed files are"
+
+        batch = [dict([('file_' + k, v) for k, v in digest.items()],
+                      file_name=os.path.basename(path), file_abs_path=path)
+                 for path, digest in zip(paths, digests)]
+        rest, saved = skip_duplicates(batch, index)
+        assert rest == [batch[0], batch[2]] and saved == 10, \
+               "duplicates in a batch are skipped"
+        assert batch[1]['file_duplicate_of']['task_id'] is None
+
+        index.publish('sub-1', [(batch[2], '/dest/f2')])
+        index.submitted('sub-1', 'task-1')
+        for results in batch:
+            results.pop('file_duplicate_of', None)
+        rest, saved = skip_duplicates(batch, index)
+        assert rest == [batch[0]] and saved == 30
+        assert batch[2]['file_duplicate_of'] == {
+            'task_id': 'task-1', 'destination_path': '/dest/f2'}
+
+        # content of a submission globus never accepted isn't skipped
+        index.publish('sub-2', [(batch[0], '/dest/f0')])
+        batch = [dict(batch[0])]
+        api = FakeTransferAPI(fail=True)
+        journal = Journal(os.path.join(d, '.journal.db'))
+        t = Transfer('sub-2', 'src#ep', 'dst#ep')
+        journal.record(t)
+        assert submit(api, journal, t) is None
+        rest, saved = skip_duplicates(batch, index)
+        assert rest == batch and saved == 0
+        index.publish('sub-3', [(batch[0], '/dest/f0')])
+        index.submitted('sub-3', 'task-3')
+        assert index.lookup(batch[0]['file_sha256'], 10)['task_id'] == 'task-3'
+        index.failed('task-3')
+        assert index.lookup(batch[0]['file_sha256'], 10) is None
+    finally:
+        shutil.rmtree(d)
+
+
+def test_watch():
+    '''Testing detection of finished files and batching when watching'''
+    d = make_files([10, 20])
+    clock = [1000.0]
+    try:
+        watcher = Watcher(d, settle=10, clock=lambda: clock[0])
+        f0, f1 = expand_paths([d])
+        assert watcher.ready() == [], "new files aren't ready at once"
+        clock[0] += 5
+        with open(f1, 'ab') as f:
+            f.write('x' * 10)
+        os.utime(f1, (0, 0))
+        assert watcher.ready() == []
+        clock[0] += 5
+        assert watcher.ready() == [f0], "files ready once unchanged"
+        clock[0] += 10
+        assert watcher.ready() == [f1], "changes restart the wait"
+        clock[0] += 10
+        assert watcher.ready() == [], "finished files are ready once"
+
+        batch = Batch(started=clock[0])
+        batch.add(f0, {})
+        batch.add(f1, {})
+        assert batch.bytes == 40
+        assert not batch.due(clock[0], max_bytes=100, max_seconds=60)
+        assert batch.due(clock[0], max_bytes=40, max_seconds=60)
+        assert batch.due(clock[0] + 60, max_bytes=100, max_seconds=60)
+
+        with open(os.path.join(d, SETTINGS_NAME), 'w') as f:
+            json.dump({'rules': [['*.CINE', 'xray'], ['*', 'nope']]}, f)
+        session = Session(d, configure=None)
+        assert session.resource('/data/T1.cine') == \
+               os.path.join('mediatypes', 'xray.json'), "rules match names"
+        assert session.resource('/data/T1.avi') == 'file.json'
+
+        # shared fields are asked once, `per_file` ones for each file
+        config = {'key': 'file_xray', 'version': '1', 'prompts': [
+            {'key': 'study_trial', 'text': 'Which study/trial?', 'info': '',
+             'example': '', 'type': 'text', 'require': True, 'regex': '',
+             'store': ['xromm']},
+            {'key': 'camera_number', 'text': 'Which camera?', 'info': '',
+             'example': '', 'type': 'number', 'require': True, 'regex': '',
+             'store': ['xromm'], 'per_file': True}]}
+        prompts = [Prompt(p) for p in config['prompts']]
+        prompts[0].get_input = iter(['pig/trial-1']).next
+        prompts[1].get_input = iter(['1', '2']).next
+        session = Session(d, configure=lambda resource: (config, prompts))
+        assert [session.describe(path)[1]['data'] for path in (f0, f1)] == [
+            {'study_trial': 'pig/trial-1', 'camera_number': 1},
+            {'study_trial': 'pig/trial-1', 'camera_number': 2}]
+
+        # a batch that can't be transferred is kept and retried later
+        sent = []
+        def transfer(results):
+            if not sent:
+                sent.append(None)
+                raise IOError('token expired')
+            sent.append([r['file_name'] for r in results])
+        session = Session(d, configure=None, clock=lambda: clock[0],
+                          transfer=transfer,
+                          index=ContentIndex(os.path.join(d, '.dedup.db')))
+        session.batches['xray'] = Batch(started=clock[0])
+        session.batches['xray'].add(f0, {})
+        clock[0] += 15 * 60
+        session.submit_due()
+        assert sent == [None] and 'xray' in session.batches
+        session.batches['xray'].add(f1, {})
+        clock[0] += 29
+        session.submit_due()
+        assert sent == [None], "retries back off"
+        clock[0] += 1
+        session.submit_due()
+        assert sent == [None, ['f0', 'f1']] and session.batches == {}
+    finally:
+        shutil.rmtree(d)
+
+
+def test_detect():
+    '''Testing detection of mediatypes from names and magic bytes'''
+    d = tempfile.mkdtemp()
+    files = {
+        'rec.ns5': 'NEURALCD' + '\x00' * 100,
+        'rec.dat': 'NEURALEV' + '\x00' * 100,  # (magic beats extension)
+        'cam1.cine': 'CI,\x00' + '\x00' * 40,
+        'grid-cam1.cine': 'CI,\x00' + '\x00' * 40,
+        'clip.mov': '\x00\x00\x00\x14ftypqt  ',
+        'cam2.avi': '',                         # (by extension)
+        'slices.tif': 'II*\x00',
+        'MDLT_points.csv': 'x,y',
+        'notes.txt': 'hi',
+        'beads.cine': 'CI,\x00',
+    }
+    try:
+        paths = []
+        for name, head in sorted(files.items()):
+            paths.append(os.path.join(d, name))
+            with open(paths[-1], 'wb') as f:
+                f.write(head)
+        detected = Detector([['bead*', 'calib']]).classify(paths)
+        found = dict((os.path.basename(path), mt)
+                     for path, (mt, candidates) in detected.items())
+        assert found == {
+            'rec.ns5': 'NSx', 'rec.dat': 'NEV', 'cam1.cine': 'xray',
+            'grid-cam1.cine': 'grid', 'clip.mov': 'video', 'cam2.avi': 'video',
+            'slices.tif': None, 'MDLT_points.csv': 'proc', 'notes.txt': None,
+            'beads.cine': 'calib'}, found
+        assert detected[os.path.join(d, 'slices.tif')][1] == \
+               ['vol', 'xray', 'grid', 'calib'], "ambiguous files have options"
+    finally:
+        shutil.rmtree(d)
+
+
+def test_answers():
+    '''Testing answers given once and applied to matching prompts'''
+    def prompts(mt):
+        path = os.path.join(CONFIG_DIR, 'mediatypes', mt + '.json')
+        return [Prompt(p) for p in json.load(open(path))['prompts']]
+    xray, video = prompts('xray'), prompts('video')
+    answers = Answers({'camera_make': 'Phantom', 'sid_cm': 'far',
+                       'mediatypes': {'video': {'camera_make': 'Photron'}}})
+
+    data, ask = answers.fill(xray, 'xray')
+    assert data == {'camera_make': 'Phantom'}, "invalid defaults are asked"
+    keys = [p.key for p in ask]
+    assert 'study_trial' in keys and 'sid_cm' in keys
+    answers.remember(ask, {'study_trial': 'pig/trial-1', 'camera_number': 1,
+                           'frame_rate': 250, 'note': None})
+
+    data, ask = answers.fill(video, 'video')
+    assert data == {'study_trial': 'pig/trial-1', 'frame_rate': 250,
+                    'camera_make': 'Photron'}, data
+    assert [p.key for p in ask] == ['camera_number', 'shutter_speed', 'note'], \
+           "per-file and unanswered fields are asked"
+
+
+def nsx_header(channels, period=30, spec=(2, 3), packets=((0, 10),)):
+    '''Return an NSx 2.x/3.x file with the given channels and packets'''
+    major = spec[0]
+    ts = 'Q' if major >= 3 else 'I'
+    size = 314 + 66 * len(channels)
+    header = struct.pack('<8sBBI16s256sII8HI',
+                         'BRSMPGRP' if major >= 3 else 'NEURALCD',
+                         major, spec[1], size, 'label', '', period,
+                         1000000000 if major >= 3 else 30000,
+                         2015, 8, 2, 18, 14, 2, 31, 0, len(channels))
+    for i, name in enumerate(channels):
+        header += struct.pack('<2sH16s', 'CC', i + 1, name) + '\x00' * 46
+    for timestamp, n in packets:
+        header += struct.pack('<B' + ts + 'I', 1, timestamp, n)
+        header += '\x00' * (2 * len(channels) * n)
+    return header
+
+def test_headers():
+    '''Testing extraction of values from NSx and NEV headers'''
+    d = tempfile.mkdtemp()
+    def extracted(name, data, mt):
+        path = os.path.join(d, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return extract(path, mt)
+    try:
+        values = extracted('a.ns5', nsx_header(['elec1', 'elec2'], period=1,
+            packets=[(0, 30000), (60000, 15000)]), 'NSx')
+        assert values == {'sampling_rate': '30 kHz', 'channel_count': 2,
+                          'duration': 2.5, 'time_origin': '2015-08-18T14:02:31',
+                          'electrode_labels': 'elec1, elec2'}, values
+
+        values = extracted('b.ns2', nsx_header(['a', 'b', 'c'], period=30,
+            spec=(3, 0), packets=[(i * 10 ** 6, 1) for i in range(1000)]),
+            'NSx')
+        assert values['sampling_rate'] == '1 kHz'
+        assert values['duration'] == 1.0, "3.x single-sample packets"
+
+        # crashed recordings: a header-only or partial last packet
+        data = nsx_header(['a', 'b', 'c'], spec=(3, 0),
+                          packets=[(i * 10 ** 6, 1) for i in range(10)])
+        for truncated in [data + struct.pack('<BQI', 1, 10 ** 7, 1),
+                          data[:-3], data[:-13]]:
+            path = os.path.join(d, 'truncated.ns2')
+            with open(path, 'wb') as f:
+                f.write(truncated)
+            try:
+                nsx(path)
+                assert False, "truncated data expected"
+            except HeaderError as e:
+                assert str(e) == 'truncated data'
+        assert extract(path, 'NSx') == {}
+
+        values = extracted('c.ns1', struct.pack('<8s16sII3I', 'NEURALSG', '',
+            60, 3, 1, 2, 3) + '\x00' * 6 * 500, 'NSx')
+        assert values == {'sampling_rate': '500 Hz', 'channel_count': 3,
+                          'duration': 1.0, 'electrode_labels': '1, 2, 3'}
+
+        nev = struct.pack('<8sBBHIIII8H32s256sI', 'NEURALEV', 2, 3, 0,
+                          336 + 32 * 3, 104, 30000, 30000,
+                          2015, 8, 2, 18, 14, 2, 31, 0, 'app', '', 3)
+        nev += struct.pack('<8sH', 'NEUEVWAV', 1) + '\x00' * 22
+        nev += struct.pack('<8sH', 'NEUEVWAV', 2) + '\x00' * 22
+        nev += struct.pack('<8sH16s', 'NEUEVLBL', 2, 'chan2') + '\x00' * 6
+        nev += struct.pack('<I', 300) + '\x00' * 100
+        nev += struct.pack('<I', 90000) + '\x00' * 100
+        values = extracted('d.nev', nev, 'NEV')
+        assert values == {'channel_count': 2, 'duration': 3.0,
+                          'time_origin': '2015-08-18T14:02:31',
+                          'electrode_labels': '1, chan2'}, values
+
+        assert extracted('e.ns5', 'NEURALCD', 'NSx') == {}, "bad headers"
+        assert extracted('f.avi', 'RIFF', 'video') == {}
+    finally:
+        shutil.rmtree(d)
+
+
+def atom(kind, *children):
+    '''Return a quicktime atom of the given type and contents'''
+    data = ''.join(children)
+    return struct.pack('>I4s', 8 + len(data), kind) + data
+
+def test_containers():
+    '''Testing extraction of values from video and image stack headers'''
+    d = tempfile.mkdtemp()
+    def extracted(name, data, mt='xray', size=None):
+        path = os.path.join(d, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+            if size:
+                f.truncate(size)                # (sparse media data)
+        return extract(path, mt)
+    try:
+        setup = '\x00' * 768 + struct.pack('<I', 250)
+        values = extracted('a.cine', struct.pack('<2sHHHiIiIIIIQ', 'CI', 44,
+            0, 1, 0, 1000, 0, 1000, 44, 84, 84 + len(setup), 0) +
+            struct.pack('<Iii', 40, 1024, -768) + '\x00' * 28 + setup)
+        assert values == {'camera_make': 'Phantom', 'frame_rate': 250,
+                          'frame_count': 1000, 'duration': 4.0,
+                          'width': 1024, 'height': 768}, values
+
+        avih = struct.pack('<10I', 40000, 0, 0, 0, 50, 0, 1, 0, 640, 480)
+        strh = struct.pack('<4s4sIHHIIIII', 'vids', 'MJPG', 0, 0, 0, 0,
+                           1, 30, 0, 60) + '\x00' * 20
+        hdrl = ('hdrl' + struct.pack('<4sI', 'avih', len(avih)) + avih +
+                struct.pack('<4sI', 'LIST', 4 + 8 + len(strh)) + 'strl' +
+                struct.pack('<4sI', 'strh', len(strh)) + strh)
+        values = extracted('b.avi', 'RIFF\x00\x00\x00\x00AVI ' +
+            struct.pack('<4sI', 'LIST', len(hdrl)) + hdrl, 'video')
+        assert values == {'frame_rate': 30.0, 'frame_count': 60,
+                          'duration': 2.0, 'width': 640, 'height': 480}, values
+
+        trak = atom('trak',
+            atom('tkhd', '\x00' * 76, struct.pack('>II', 1920 << 16,
+                                                   1080 << 16)),
+            atom('mdia',
+                atom('mdhd', '\x00' * 12, struct.pack('>II', 600, 3000)),
+                atom('hdlr', '\x00' * 8, 'vide', '\x00' * 12),
+                atom('minf', atom('stbl',
+                    atom('stsz', '\x00' * 8, struct.pack('>I', 600))))))
+        mdat = struct.pack('>I4sQ', 1, 'mdat', 10 ** 8 + 16)
+        data = atom('ftyp', 'isom') + mdat
+        values = extracted('c.mp4', data, 'video', size=len(data) + 10 ** 8)
+        assert values == {}, "no movie atom"
+        with open(os.path.join(d, 'c.mp4'), 'ab') as f:
+            f.write(atom('moov', atom('mvhd', '\x00' * 100), trak))
+        values = extract(os.path.join(d, 'c.mp4'), 'video')
+        assert values == {'frame_rate': 120.0, 'frame_count': 600,
+                          'duration': 5.0, 'width': 1920, 'height': 1080}, \
+               values
+
+        bare = atom('trak', atom('mdia',
+            atom('hdlr', '\x00' * 8, 'vide', '\x00' * 12)))
+        values = extracted('e.mp4', atom('ftyp', 'isom') + atom('moov', bare),
+                           'video')
+        assert values == {}, "no track header"
+
+        def ifd(next):
+            return (struct.pack('<H', 2) +
+                    struct.pack('<HHIHH', 256, 3, 1, 512, 0) +
+                    struct.pack('<HHII', 257, 4, 1, 256) +
+                    struct.pack('<I', next))
+        values = extracted('d.tif', 'II*\x00' + struct.pack('<I', 8) +
+            ifd(38) + ifd(68) + ifd(0), 'grid')
+        assert values == {'frame_count': 3, 'width': 512, 'height': 256}
+
+        header, info = split(values, [Prompt(p) for p in json.load(open(
+            os.path.join(CONFIG_DIR, 'mediatypes', 'video.json')))['prompts']])
+        assert info == {'file_frame_count': 3, 'file_width': 512,
+                        'file_height': 256}, "the rest goes to the results"
+    finally:
+        shutil.rmtree(d)
+
+
+def test_monitor():
+    '''Testing polling of submitted transfer tasks until they're done'''
+    d = tempfile.mkdtemp()
+    try:
+        journal = Journal(os.path.join(d, 'journal.db'))
+        for i in (1, 2, 3):
+            t = Transfer('sub-{}'.format(i), 'src#ep', 'dst#ep')
+            t.add_item('/src/f{}'.format(i), '/dest/f{}'.format(i))
+            journal.record(t, {'/src/f{}'.format(i): 4 * 10 ** 6})
+            if i < 3:
+                journal.update(t.submission_id, task_id='task-{}'.format(i),
+                               status=SUBMITTED)
+        active = {'status': 'ACTIVE', 'bytes_transferred': 10 ** 6,
+                  'files': 1, 'files_transferred': 0}
+        api = FakeTransferAPI(tasks={
+            'task-1': [active, active, active,
+                       dict(active, status='SUCCEEDED', files_transferred=1,
+                            bytes_transferred=4 * 10 ** 6)],
+            'task-2': [IOError('timed out'),
+                       dict(active, status='FAILED', subtasks_failed=1,
+                            faults=3, nice_status='PERMISSION_DENIED')],
+        })
+        clock = [0]
+        waits = []
+        def sleep(seconds):
+            waits.append(seconds)
+            clock[0] += seconds
+        index = ContentIndex(os.path.join(d, 'dedup.db'))
+        for i in (1, 2):
+            index.publish('sub-{}'.format(i), [({
+                'file_sha256': str(i), 'file_size': 4 * 10 ** 6,
+                'file_abs_path': '/src/f{}'.format(i)}, '/dest/f{}'.format(i))])
+            index.submitted('sub-{}'.format(i), 'task-{}'.format(i))
+        monitor = Monitor(journal, api, clock=lambda: clock[0], sleep=sleep,
+                          index=index)
+        assert monitor() == 1, "failed tasks are counted"
+        assert index.lookup('1', 4 * 10 ** 6)
+        assert not index.lookup('2', 4 * 10 ** 6), "failed content is dropped"
+        assert api.polled.count('task-1') == 4
+        assert api.polled.count('task-2') == 2, "errors are retried"
+        assert waits == [2, 2, 2, 8], "polls back off while nothing changes"
+        statuses = dict((t['submission_id'], t['status'])
+                        for t in journal.tasks())
+        assert statuses == {'sub-1': 'SUCCEEDED', 'sub-2': 'FAILED',
+                            'sub-3': PENDING}, statuses
+        assert monitor() == 0, "done tasks aren't polled again"
+    finally:
+        shutil.rmtree(d)
+
+def test_stores():
+    '''Testing routing of results to the backends of their fields'''
+    stores = load_stores(CONFIG_DIR)
+    assert stores['file_nsx']['daq'] == ['xromm', 'hatabase']
+    assert stores['file_nsx']['note'] == ['xromm']
+    results = {'resource': 'file_nsx', 'version': '1.0.0',
+               'file_name': 'a.ns5', 'file_sha256': 'abc',
+               'file_abs_path': '/data/a.ns5', 'file_size': 10,
+               'data': {'daq': 'Cerebus 1', 'note': 'n', 'other': 1}}
+    payloads = by_backend(results, stores)
+    assert payloads['xromm'] == results
+    assert payloads['hatabase'] == {
+        'resource': 'file_nsx', 'version': '1.0.0', 'file_name': 'a.ns5',
+        'file_sha256': 'abc', 'data': {'daq': 'Cerebus 1'}}, \
+        "other backends only get their own fields (and the record's identity)"
+    assert set(payloads) == set(['xromm', 'hatabase'])
+
+    class Backend:
+        def __init__(self, wait=None, done=None, error=None):
+            self.wait, self.done, self.error = wait, done, error
+            self.batch = None
+            self.waited = None
+        def write(self, batch):
+            if self.wait:           # (only finishes once `wait` is set)
+                self.waited = self.wait.wait(5)
+            self.batch = batch
+            if self.done:
+                self.done.set()
+            if self.error:
+                raise self.error
+            return len(batch)
+
+    fast = threading.Event()
+    backends = {'xromm': Backend(wait=fast),
+                'ross_db': Backend(error=IOError('unavailable')),
+                'hatabase': Backend(done=fast)}
+    stores = {'r': {'a': ['xromm'], 'b': ['ross_db', 'hatabase'], 'c': []}}
+    batch = [{'resource': 'r', 'version': '1', 'data': {'a': i, 'b': i, 'c': i}}
+             for i in range(3)]
+    failed = route(batch, backends, stores)
+    assert failed.keys() == ['ross_db'], "partial failure reported"
+    assert backends['xromm'].waited, "slow backend didn't hold up the rest"
+    assert [r['data'] for r in backends['xromm'].batch] == \
+           [{'a': i} for i in range(3)]
+    assert [r['data'] for r in backends['hatabase'].batch] == \
+           [{'b': i} for i in range(3)]
+
+    d = tempfile.mkdtemp()
+    server, url = stub_server()
+    try:
+        outbox = Outbox(os.path.join(d, 'outbox.jsonl'))
+        outbox.put('http://127.0.0.1:9/api/', [{'resource': 'earlier'}])
+        portal = Portal(lambda results: url, outbox, Client(retries=0))
+        assert portal.write(batch) == 3, "earlier records aren't failures"
+        assert len(server.requests) == 1
+        assert [r['data']['resource'] for r in outbox.pending()] == \
+               ['earlier'], "earlier records aren't sent by the write"
+
+        path = os.path.join(d, 'hatabase.db')
+        health = {'resource': 'macaque_health_record', 'version': '1.0.0',
+                  'data': {'subject_name': 'Kiki', 'date': '2015-01-02'}}
+        nsx = dict(payloads['hatabase'], file_name='b.ns5')
+        for i in range(2):          # (written twice, stored once)
+            LocalHatabase(path).write([health, payloads['hatabase'], nsx])
+        assert Hatabase(path).records('Kiki') == [health['data']]
+        assert Local('hatabase', path).connect().execute(
+            'SELECT COUNT(*) FROM records').fetchone()[0] == 2
+    finally:
+        server.shutdown()
+        shutil.rmtree(d)
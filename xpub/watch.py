@@ -0,0 +1,335 @@
+"""
+Watching of a directory for new files to transfer.
+
+Run `xpub --watch DIR` to transfer the files written to `DIR` (e.g. by
+an acquisition rig) as they're finished, in periodic batches.
+
+"""
+import os
+import json
+import time
+from action import add_file_info, transferfile
+from answers import Answers, load_defaults
+from batch import expand_paths, SIDECAR_SUFFIX
+from checksum import Checksummer
+from dedup import ContentIndex
+from detect import Detector
+from headers import extract, split
+from mediatype import file_resource, resource_mediatype
+from overlay import Overlay
+from prompter import Prompter
+from settings import CONFIG_DIR
+
+
+SETTINGS_NAME = '.xpub-watch.json'  # settings file in a watched dir
+
+SETTLE = 10                     # seconds a file's size must be unchanged
+INTERVAL = 2                    # seconds between checks for new files
+BATCH_BYTES = 50 * 1024 ** 3    # bytes of files per batch (at most)
+BATCH_SECONDS = 15 * 60         # seconds a batch is held open (at most)
+RETRY = 30                      # seconds before retrying a failed batch
+MAX_RETRY = 15 * 60             # most seconds between retries (backing off)
+
+
+def load_settings(dir):
+    """
+    Return the watch settings for `dir`, given by its (optional)
+    `.xpub-watch.json` file, which may give ...
+
+      `rules`         - list of `[pattern, mediatype]` pairs: the
+                        mediatype of files whose names match a (glob)
+                        pattern, e.g. `["*.cine", "xray"]` (checked
+                        before detecting the mediatype)
+      `defaults`      - dict of prompt keys to the values to use for
+                        every file, e.g. `{"study_trial": "pig/trial-1"}`
+                        (over those in the dir's `.xpub-defaults.json`)
+      `settle`        - seconds a file must be unchanged to be finished
+      `batch_bytes`   - most bytes of files in a batch
+      `batch_seconds` - most seconds a batch is held open
+
+    """
+    settings = dict(rules=[], defaults={}, settle=SETTLE,
+                    batch_bytes=BATCH_BYTES, batch_seconds=BATCH_SECONDS)
+    path = os.path.join(dir, SETTINGS_NAME)
+    if os.path.isfile(path):
+        settings.update(json.load(open(path)))
+    return settings
+
+
+def wanted(path):
+    "Return True unless `path` is a hidden file or a metadata sidecar."
+    name = os.path.basename(path)
+    return not (name.startswith('.') or name.endswith(SIDECAR_SUFFIX))
+
+
+class Watcher:
+    """
+    Finds the files under a directory that are new (or changed) and
+    have finished being written, by polling.
+
+    A file is finished once its size and mtime have been unchanged for
+    `settle` seconds.  Files already in the directory count as new.
+
+    """
+    def __init__(self, dir, settle=SETTLE, clock=time.time):
+        self.dir = dir
+        self.settle = settle
+        self.clock = clock
+        self.done = {}              # path -> (size, mtime) once finished
+        self.checking = {}          # path -> (size, mtime, unchanged since)
+
+    def changed(self):
+        "Return the paths of files that may be new or changed."
+        return expand_paths([self.dir])
+
+    def wait(self, timeout):
+        "Wait up to `timeout` seconds for files to change."
+        time.sleep(timeout)
+
+    def ready(self):
+        "Return the paths of the files finished since the last call."
+        now = self.clock()
+        for path in self.changed():
+            self.checking.setdefault(path, None)
+        ready = []
+        for path, last in self.checking.items():
+            try:
+                st = os.stat(path)
+            except OSError:             # (removed or renamed)
+                del self.checking[path]
+                continue
+            sig = st.st_size, st.st_mtime
+            if self.done.get(path) == sig:
+                del self.checking[path]
+            elif last is None or last[:2] != sig:
+                self.checking[path] = sig + (now,)
+            elif now - last[2] >= self.settle:
+                self.done[path] = sig
+                del self.checking[path]
+                ready.append(path)
+        return sorted(ready)
+
+
+class InotifyWatcher(Watcher):
+    """
+    A `Watcher` notified of changes to files by inotify (instead of
+    polling the whole directory).  Needs the `pyinotify` package.
+
+    """
+    def __init__(self, dir, settle=SETTLE, clock=time.time):
+        import pyinotify
+        Watcher.__init__(self, dir, settle, clock)
+        self.events = set(expand_paths([dir]))  # (files already there)
+        mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | \
+               pyinotify.IN_MODIFY | pyinotify.IN_CREATE
+        manager = pyinotify.WatchManager()
+        manager.add_watch(dir, mask, proc_fun=self.event, rec=True,
+                          auto_add=True)
+        self.notifier = pyinotify.Notifier(manager)
+
+    def event(self, event):
+        if not event.dir and wanted(event.pathname):
+            self.events.add(event.pathname)
+
+    def changed(self):
+        changed, self.events = self.events, set()
+        return changed
+
+    def wait(self, timeout):
+        if self.notifier.check_events(timeout * 1000):
+            self.notifier.read_events()
+            self.notifier.process_events()
+
+
+def watcher(dir, settle=SETTLE):
+    "Return an inotify watcher for `dir` if possible, else a polling one."
+    try:
+        return InotifyWatcher(dir, settle)
+    except (ImportError, OSError):
+        print "(pyinotify isn't available: polling for new files)"
+        return Watcher(dir, settle)
+
+
+class Batch:
+    "Files (and their results) collected to be transferred together."
+    def __init__(self, started):
+        self.started = started
+        self.paths = []
+        self.results = []
+        self.bytes = 0
+        self.failures = 0           # failed attempts to transfer it
+        self.retry_at = None        # time of the next attempt (if failed)
+
+    def add(self, path, results):
+        self.paths.append(path)
+        self.results.append(results)
+        self.bytes += os.path.getsize(path)
+
+    def due(self, now, max_bytes=BATCH_BYTES, max_seconds=BATCH_SECONDS):
+        """
+        Return True if the batch is full or has been open long enough
+        (and, if it failed to transfer, it's time to retry it).
+
+        """
+        if self.retry_at is not None:
+            return now >= self.retry_at
+        return self.bytes >= max_bytes or now - self.started >= max_seconds
+
+    def failed(self, now):
+        "Note a failed transfer, backing off the next attempt."
+        self.failures += 1
+        self.retry_at = now + min(RETRY * 2 ** (self.failures - 1), MAX_RETRY)
+
+
+class Session:
+    """
+    Transfers the files written to a directory in periodic batches.
+
+    The mediatype of each file is given by the settings' rules or is
+    detected (see `detect`), and is only asked for if it's ambiguous.
+    The metadata of each file is given by the settings' defaults (see
+    `answers`) and by its header (see `headers`), and the user is only
+    prompted for the fields that aren't given, once per mediatype for
+    the whole session (shared fields just once in all), except for
+    those marked `per_file`, which are asked for each file.  Files of
+    each mediatype are batched separately, and each batch is
+    transferred as a single task (using its mediatype's transfer
+    profile).  A batch
+    that can't be transferred (e.g. while globus can't be reached) is
+    kept, still taking new files, and retried later, backing off.
+
+    `configure(resource)` should return the loaded resource config for
+    a resource and its Prompt objects.  `transfer` (a function given
+    a list of results to transfer) and `index` (the content index used
+    when hashing files) can be given to run without globus (in tests).
+
+    """
+    def __init__(self, dir, configure, required=False, verbose=False,
+                       clock=time.time, transfer=transferfile, index=None):
+        self.dir = dir
+        self.configure = configure
+        self.required = required
+        self.verbose = verbose
+        self.clock = clock
+        self.transfer = transfer
+        self.index = index
+        self.settings = load_settings(dir)
+        self.detect = Detector(self.settings['rules'])
+        defaults = load_defaults(dir)
+        defaults.update(self.settings['defaults'])
+        self.shared = Answers(defaults)     # shared answers (and defaults)
+        self.answers = {}           # data answered by resource
+        self.batches = {}           # open batch by resource
+
+    def resource(self, path):
+        "Return the resource config for the file at `path`."
+        mt, candidates = self.detect(path)
+        if not mt:                          # (ask if it's ambiguous)
+            print "\n=== {}".format(path)
+        return file_resource(CONFIG_DIR, mt, candidates)
+
+    def describe(self, path):
+        "Return the resource of the file at `path` and its results dict."
+        resource = self.resource(path)
+        config, prompts = self.configure(resource)
+        header, info = split(extract(path, resource_mediatype(resource)),
+                             prompts)       # (read for each file)
+        prompts = [p for p in prompts if p.key not in header]
+        if resource not in self.answers:    # (just once per mediatype)
+            self.answers[resource] = self.ask(
+                resource, config, [p for p in prompts if not p.per_file],
+                path)
+        data = dict(self.answers[resource])
+        data.update(self.ask(resource, config,      # (for each file)
+                             [p for p in prompts if p.per_file], path,
+                             per_file=True))
+        data.update(header)
+        results = {'resource': config['key'],
+                   'version': config['version'],
+                   'data': data}
+        results.update(info)
+        return resource, results
+
+    def ask(self, resource, config, prompts, path, per_file=False):
+        """
+        Return the data for files of `resource` (or, if `per_file`, for
+        the file at `path`): the defaults and shared answers for its
+        prompts, and the user's input for the rest.
+
+        """
+        data, ask = self.shared.fill(prompts, resource_mediatype(resource))
+        if not ask:
+            return data
+        if per_file:
+            print "\n=== {}".format(path)
+        else:
+            print "\n=== {} (answers apply to each {} file)".format(
+                path, config['key'])
+        prompter = Prompter(config, verbose=self.verbose,
+                            required=self.required, prompts=ask)
+        prompter()
+        if prompter.learned:
+            Overlay(os.path.join(CONFIG_DIR, resource)).record(
+                prompter.learned)
+        self.shared.remember(ask, prompter.results['data'])
+        data.update(prompter.results['data'])
+        return data
+
+    def add(self, path):
+        "Add the finished file at `path` to its mediatype's batch."
+        resource, results = self.describe(path)
+        if resource not in self.batches:
+            self.batches[resource] = Batch(self.clock())
+        self.batches[resource].add(path, results)
+        print "queued {} ({} file(s) in batch)".format(
+            path, len(self.batches[resource].paths))
+
+    def submit(self, resource):
+        """
+        Transfer the batch of files of `resource`, returning True if it
+        was submitted.  If it couldn't be, the batch is kept to be
+        retried later.
+
+        """
+        batch = self.batches[resource]
+        try:
+            checksums = Checksummer(batch.paths,
+                                    cache=self.index or ContentIndex())
+            add_file_info(batch.results, batch.paths, checksums,
+                          root=self.dir)
+            self.transfer(batch.results)
+        except Exception as e:              # auth, api or network error
+            batch.failed(self.clock())
+            print "couldn't transfer {} file(s) of {}: {}".format(
+                len(batch.paths), resource, e)
+            print "retrying in {:.0f} seconds".format(
+                batch.retry_at - self.clock())
+            return False
+        del self.batches[resource]
+        return True
+
+    def submit_due(self, all=False):
+        "Transfer the batches that are due (or `all` of them)."
+        now = self.clock()
+        for resource, batch in sorted(self.batches.items()):
+            if all or batch.due(now, self.settings['batch_bytes'],
+                                     self.settings['batch_seconds']):
+                self.submit(resource)
+
+    def run(self, interval=INTERVAL):
+        "Watch the directory (until interrupted), transferring new files."
+        files = watcher(self.dir, self.settings['settle'])
+        print "watching {} for new files (ctrl-c to stop)".format(self.dir)
+        try:
+            while True:
+                for path in files.ready():
+                    self.add(path)
+                self.submit_due()
+                files.wait(interval)
+        except KeyboardInterrupt:
+            print "\nstopped watching {}".format(self.dir)
+            self.submit_due(all=True)
+            for resource, batch in sorted(self.batches.items()):
+                print "not transferred ({}):".format(resource)
+                for path in batch.paths:
+                    print "   ", path